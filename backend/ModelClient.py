@@ -1,7 +1,26 @@
 from schemaExtract import extract_schema
+from schemaProvider import SchemaProvider
+from schemaPruning import SchemaIndex
+from responseCache import ResponseCache, schema_fingerprint, cache_key
+from questionIndex import QuestionIndex
+from sqlTemplates import TemplateCache
+from singleFlight import SingleFlight
+from connectionPool import connection_pool, ConnectionUnavailableError
+from resultCache import ResultCache
+from queryControl import QueryRegistry, QueryTimeoutError, QueryCancelledError, ER_QUERY_TIMEOUT
+from modelResilience import ResilientCaller, ModelUnavailableError
+from modelCascade import CascadeStats, escalation_reason
+from sqlValidation import classify_sql, validate_sql, repair_sql, limit_sql, time_limit_sql, databases_named, SqlParseError, READ, DDL
 import mysql.connector
+import time
+import json
+import base64
+import hashlib
 import logging
-from config import MySQLConfig
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import MySQLConfig, PruningConfig, ResponseCacheConfig, SimilarityCacheConfig, TemplateCacheConfig, CoalesceConfig, ResilienceConfig, ResultConfig, ResultCacheConfig, QueryTimeoutConfig
 
 logging.basicConfig(level=logging.ERROR)
 
@@ -13,65 +32,161 @@ class InvalidQueryError(Exception):
     #Raised when the SQL query is invalid or ambiguous.
     pass
 
+def _query_fingerprint(sql_query):
+    return hashlib.sha256(" ".join((sql_query or "").split()).encode("utf-8")).hexdigest()[:16]
+
+def encode_page_token(sql_query, offset):
+    #opaque token for the page starting at offset, tied to the query so it can't be used with another one
+    payload = json.dumps({"q": _query_fingerprint(sql_query), "o": offset}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+def decode_page_token(sql_query, token):
+    #the offset a page token starts at, raises InvalidQueryError if it isn't a token for this query
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if payload["q"] == _query_fingerprint(sql_query) and isinstance(payload["o"], int) and payload["o"] >= 0:
+            return payload["o"]
+    except (ValueError, TypeError, KeyError):
+        pass
+    raise InvalidQueryError("The page token is not valid for this query.")
+
+#behaviour instructions that follow the schema in the system prompt, part of the response cache key so changing them retires old answers
+SQL_INSTRUCTIONS = (
+    "You are an expert SQL generator. Based on the above schema, generate a valid SQL query that answers the user's request. (do not use = 'NoneType' instead use IS NULL)"
+    "However, if the user's query is ambiguous or refers to data not available in the schema, instead of a SQL query, "
+    "output a clarifying question, pointing them in the right direction and asking the user for more details. ONLY output the SQL query or a clarifying question, nothing else."
+)
+
 class ModelClient:
-    def __init__(self, client, model):
+    def __init__(self, client, model, *, schema_provider=None, response_cache=None, question_index=None, template_cache=None, caller=None, escalation_model=None, result_cache=None):
         """
         Initialise
         parameters:
         client: he OpenAI client
         model: name of fine-tuned model 
-        mysql_config: dictionary with MySQL connection parameters
+        schema_provider: where live schemas come from (defaults to a SchemaProvider reading INFORMATION_SCHEMA)
+        response_cache: where answered questions are kept (defaults to a ResponseCache unless ResponseCacheConfig turns it off)
+        question_index: similarity search over answered questions for rephrasings (defaults to a QuestionIndex unless SimilarityCacheConfig turns it off)
+        template_cache: parameterised SQL for questions that only differ in literals (defaults to a TemplateCache unless TemplateCacheConfig turns it off)
+        caller: deadline, retries, hedging and circuit breaker for the model call (defaults to a ResilientCaller from ResilienceConfig)
+        escalation_model: stronger (slower) model asked when the answer of model fails validation or is a clarifying question, None to only use model
+        result_cache: rows of SELECTs already run (defaults to a ResultCache unless ResultCacheConfig turns it off)
                     
         """
         self.client = client
         self.model = model
+        self.schema_provider = schema_provider or SchemaProvider()
+        #relevance indexes for schema pruning, one per distinct schema, most recently used last
+        self.schema_indexes = OrderedDict()
+        self.index_lock = threading.Lock()
+        if response_cache is None and ResponseCacheConfig.enabled:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache
+        if question_index is None and SimilarityCacheConfig.enabled:
+            question_index = QuestionIndex()
+        self.question_index = question_index
+        if template_cache is None and TemplateCacheConfig.enabled:
+            template_cache = TemplateCache()
+        self.template_cache = template_cache
+        #identical questions asked at the same time share one model call
+        self.inflight = SingleFlight()
+        self.caller = caller or ResilientCaller()
+        self.escalation_model = escalation_model
+        self.cascade = CascadeStats()
+        if result_cache is None and ResultCacheConfig.enabled:
+            result_cache = ResultCache()
+        self.result_cache = result_cache
+        #queries sent to mysql by id, for cancelling them and killing the ones that run past their time budget
+        self.running_queries = QueryRegistry(self.kill_query)
         
 
-    def get_mysql_connection(self):
-        #Establish and return a MySQL connection using the given configuration
-        #connect to the MySQL database with the deafault config
-        try:
-            config = MySQLConfig.get_config()
-            conn = mysql.connector.connect(
-                host=config["host"],
-                user=config["user"],
-                password=config["password"],
-                database=config["database"]
-            )
-            return conn
-        except mysql.connector.Error as err:
-            print("MySQL connection error:", err)
-            return None
+    def mysql_connection(self):
+        #borrow a connection to the configured database from its pool, use it in a with block so it goes back afterwards
+        config = MySQLConfig.get_config()
+        return connection_pool(config["host"], config["user"], config["password"], config["database"]).connection()
 
-    def query(self, dataset, user_question, max_tokens=150, temperature=0.0, stop=None, filename=None):
+    def resolve_schema(self, dataset, filename=None, schema=None, database=None):
         """
-        Extract the schema from the dataset (file path or uploaded file), append it to the system message to give context 
-        then ask the model for a SQL query based on the user's question.
+        Pick the schema for the prompt, the live one from mysql if the database has been loaded,
+        otherwise the one passed in, otherwise extracted from the dataset file
+        returns the schema and the foreign keys mysql knows about (empty when the schema didn't come from mysql)
+        """
+        if database:
+            snapshot = self.schema_provider.snapshot(database)
+            if snapshot is not None:
+                return snapshot.to_prompt_schema(), snapshot.foreign_keys
+        if schema is not None:
+            return schema, {}
+        return extract_schema(dataset, filename=filename), {}
+
+    def prune_schema(self, schema, user_question, samples=None, foreign_keys=None):
+        """
+        Cut the schema down to the tables the question is about so wide databases don't flood the prompt,
+        the relevance index is built the first time a schema is seen and reused for every question after that
         parameters:
-        dataset: File path OR uploaded file object
-        user_question: The natural language question the user asks 
-        max_tokens: max tokens in the response
-        temperature: temp for the API call
-        stop: stop tokens
-        filename: The name of the uploaded file (needed for file objects)
-    
-        returns the created SQL query
+        schema: the full prompt schema
+        user_question: the question, matched against table names, column names and sample values
+        samples: sample values per table and column (the registry preview), helps match questions that name values
+        foreign_keys: declared foreign keys so joined tables come along with the ones picked
+
+        returns the pruned schema, or the full one if pruning is off or it already fits the budget
+        """
+        if not PruningConfig.enabled or not schema:
+            return schema
+        key = schema_fingerprint(schema, foreign_keys or {})
+        with self.index_lock:
+            index = self.schema_indexes.get(key)
+            if index is not None:
+                self.schema_indexes.move_to_end(key)
+        if index is None:
+            index = SchemaIndex(schema, samples=samples, foreign_keys=foreign_keys)
+            with self.index_lock:
+                self.schema_indexes[key] = index
+                while len(self.schema_indexes) > PruningConfig.index_cache_size:
+                    self.schema_indexes.popitem(last=False)
+        return index.select(user_question)
+
+    def prepare_query(self, dataset, user_question, filename=None, schema=None, database=None, samples=None):
+        """
+        Everything query does before the model call: pick and prune the schema, check the caches and build the prompt,
+        shared with the async client (asyncModelClient) so both answer the same way
+        parameters are the same as query
+
+        returns (cached response, None) when a cache already has the answer,
+        otherwise (None, prompt) where prompt holds the messages for the model and what its answer gets stored under
         """
         # Extract schema from either file path or file object
         #added a logging phase to help wiith handling errors
         try:
-            schema_context_raw = extract_schema(dataset, filename=filename)
+            schema_context_raw, foreign_keys = self.resolve_schema(dataset, filename=filename, schema=schema, database=database)
         except Exception as e:
             logging.error("Error extracting schema", exc_info=True)
             raise SchemaMismatchError("Failed to extract schema from the dataset. Please ensure your file is in the correct format with the expected columns.")
+        schema_context_raw = self.prune_schema(schema_context_raw, user_question, samples=samples, foreign_keys=foreign_keys)
         
+        #the same question on the same schema has been answered before, no need to ask the model again
+        fingerprint = schema_fingerprint(schema_context_raw, SQL_INSTRUCTIONS)
+        key = cache_key(self.model, fingerprint, user_question)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached, None
+        #or the same question with different values has, so the earlier SQL only needs the new values filling in
+        if self.template_cache is not None:
+            match = self.template_cache.lookup((self.model, fingerprint), user_question)
+            if match is not None:
+                sql, source_question = match
+                return {"type": "sql", "query": sql, "templateMatch": {"question": source_question}}, None
+        #or a rephrasing of it has, the match is reported so the user can see which question the answer came from
+        if self.question_index is not None:
+            match = self.question_index.lookup((self.model, fingerprint), user_question)
+            if match is not None:
+                score, matched_question, response = match
+                response["cacheMatch"] = {"score": round(score, 4), "question": matched_question}
+                return response, None
+
         #composing the system prompt, the first part will be the schema of the connected db and the behaviour instructions
-        schema_context = (
-            f"{schema_context_raw}\n\n"
-            "You are an expert SQL generator. Based on the above schema, generate a valid SQL query that answers the user's request. (do not use = 'NoneType' instead use IS NULL)"
-            "However, if the user's query is ambiguous or refers to data not available in the schema, instead of a SQL query, "
-            "output a clarifying question, pointing them in the right direction and asking the user for more details. ONLY output the SQL query or a clarifying question, nothing else."
-        )
+        schema_context = f"{schema_context_raw}\n\n{SQL_INSTRUCTIONS}"
 
         # Create the messages list for the chat API
         messages = [
@@ -83,75 +198,488 @@ class ModelClient:
         print("Full prompt sent to the model:")
         for msg in messages:
             print(f"{msg['role'].upper()}: {msg['content']}\n")
+        return None, {"key": key, "fingerprint": fingerprint, "question": user_question, "messages": messages, "schema": schema_context_raw}
 
-        # Query the fine-tuned model
-        chat_obj = self.client.chat
-        completion = chat_obj.completions.create(
-            model=self.model,
-            messages=messages,
-            #max_tokens=max_tokens,
-            #max_completion_tokens=max_tokens,  # rename parameter here
-            #temperature=temperature,
-            #stop=stop
-        )
-        response_text = completion.choices[0].message.content.strip()
-        print("Model response:")
-        print(response_text)
-    
+    def classify_response(self, response_text):
+        #decide whether the model's answer is SQL or a clarifying question, returns the response dictionary
         # if response starts with a phrase suggesting a clarification, then it is ambiguous and we go through the proper flow to handle that
         clarification_indicators = ["could you", "can you", "please clarify", "which", "do you mean", "ambiguous"]
         is_clarification = any(response_text.lower().startswith(ind) for ind in clarification_indicators)
     
         if is_clarification:
             return {"type": "clarification", "message": response_text}
-        else:
-            return {"type": "sql", "query": response_text}
+        return {"type": "sql", "query": response_text}
+
+    def finish_query(self, prompt, response_text, escalation=None):
+        """
+        Everything query does after the model call: decide whether the answer is SQL or a clarifying question
+        and remember it in the caches
+        parameters:
+        prompt: what prepare_query returned for this question
+        response_text: the model's complete answer
+        escalation: {"model", "reason"} when the answer came from the escalation model
+
+        returns the response dictionary
+        """
+        print("Model response:")
+        print(response_text)
+        result = self.classify_response(response_text)
+        if escalation is not None:
+            result["escalation"] = escalation
+        if self.response_cache is not None:
+            self.response_cache.put(prompt["key"], result)
+        if result["type"] == "sql":
+            if self.question_index is not None:
+                self.question_index.add((self.model, prompt["fingerprint"]), prompt["question"], result)
+            if self.template_cache is not None:
+                self.template_cache.add((self.model, prompt["fingerprint"]), prompt["question"], response_text)
+        return result
+
+    def repair_answer(self, prompt, response_text):
+        #SQL naming a table or column that is a near miss of one in the prompt schema is fixed here rather than by another model call
+        if self.classify_response(response_text)["type"] != "sql":
+            return response_text
+        repaired = repair_sql(response_text, prompt["schema"])
+        if repaired is not None and repaired != response_text:
+            logging.info(f"Repaired generated SQL: {response_text} -> {repaired}")
+            return repaired
+        return response_text
+
+    def check_escalation(self, prompt, response_text):
+        """
+        Whether the fast model's answer should go to the escalation model, recorded in the cascade stats
+        returns the reason, or None to keep the answer (always None without an escalation model)
+        """
+        if not self.escalation_model:
+            return None
+        reason = escalation_reason(self.classify_response(response_text), prompt["schema"])
+        self.cascade.record_question(reason)
+        if reason is not None:
+            logging.info(f"Escalating to {self.escalation_model}: {reason}")
+        return reason
+
+    def query(self, dataset, user_question, max_tokens=150, temperature=0.0, stop=None, filename=None, schema=None, database=None, samples=None):
+        """
+        Extract the schema from the dataset (file path or uploaded file), append it to the system message to give context 
+        then ask the model for a SQL query based on the user's question.
+        parameters:
+        dataset: File path OR uploaded file object
+        user_question: The natural language question the user asks 
+        max_tokens: max tokens in the response
+        temperature: temp for the API call
+        stop: stop tokens
+        filename: The name of the uploaded file (needed for file objects)
+        schema: an already extracted schema (e.g. from the dataset registry), when given the dataset isn't read at all
+        database: name of the loaded database, its live schema from mysql is used when it can be read
+        samples: sample values per table and column, used to pick the relevant tables of a wide schema
+    
+        returns the created SQL query
+        """
+        cached, prompt = self.prepare_query(dataset, user_question, filename=filename, schema=schema, database=database, samples=samples)
+        if cached is not None:
+            return cached
+        if not CoalesceConfig.enabled:
+            return self.complete_query(prompt)
+        #anyone asking the same thing while this call is running gets its answer instead of starting another
+        result, _ = self.inflight.do(prompt["key"], lambda: self.complete_query(prompt))
+        return dict(result)
+
+    def other_worker_answer(self, key):
+        """
+        With cross worker coalescing on, claim the model call for key or wait for the worker that already has
+        returns that worker's answer, or None if this worker should ask the model (it got the lease,
+        the other worker let it go without an answer, or the wait ran out)
+        """
+        if not CoalesceConfig.cross_worker or self.response_cache is None:
+            return None
+        if self.response_cache.acquire_lease(key, CoalesceConfig.lease_seconds):
+            return None
+        #no longer than the question's own deadline
+        deadline = time.monotonic() + min(CoalesceConfig.lease_seconds, self.caller.deadline)
+        while time.monotonic() < deadline:
+            time.sleep(CoalesceConfig.poll_interval)
+            cached = self.response_cache.get(key, record=False)
+            if cached is not None:
+                return cached
+            #the other worker gave up (model error, open breaker, stale answer) and released the lease, take it over
+            if self.response_cache.acquire_lease(key, CoalesceConfig.lease_seconds):
+                return None
+        return None
+
+    def complete_query(self, prompt):
+        #ask the model for a prepared prompt and finish the answer, unless another worker is already asking
+        answer = self.other_worker_answer(prompt["key"])
+        if answer is not None:
+            return answer
+        try:
+            try:
+                response_text = self.repair_answer(prompt, self.ask_model(self.model, prompt))
+            except ModelUnavailableError as e:
+                return self.stale_answer(prompt["key"], e)
+            reason = self.check_escalation(prompt, response_text)
+            if reason is None:
+                return self.finish_query(prompt, response_text)
+            try:
+                escalated_text = self.repair_answer(prompt, self.ask_model(self.escalation_model, prompt))
+            except ModelUnavailableError:
+                #the fast model's answer is still better than none
+                logging.error("Escalation model unavailable, keeping the first answer", exc_info=True)
+                return self.finish_query(prompt, response_text)
+            return self.finish_query(prompt, escalated_text, {"model": self.escalation_model, "reason": reason})
+        finally:
+            if CoalesceConfig.cross_worker and self.response_cache is not None:
+                self.response_cache.release_lease(prompt["key"])
+
+    def ask_model(self, model, prompt):
+        """
+        One completion for a prepared prompt, through the caller's deadline, retries and circuit breaker,
+        the time it took is recorded against the model's tier
+        returns the answer text
+        """
+        start = time.monotonic()
+        # Query the model, timeout is what is left of the question's deadline
+        chat_obj = self.client.chat
+        completion = self.caller.call(lambda timeout: chat_obj.completions.create(
+            model=model,
+            messages=prompt["messages"],
+            timeout=timeout,
+            #max_tokens=max_tokens,
+            #max_completion_tokens=max_tokens,  # rename parameter here
+            #temperature=temperature,
+            #stop=stop
+        ))
+        self.cascade.record_call(model, time.monotonic() - start)
+        return completion.choices[0].message.content.strip()
+
+    def stale_answer(self, key, error):
+        """
+        The model couldn't answer in time or its circuit breaker is open, answer from an expired cache entry if there is one
+        parameters:
+        key: response cache key of the question
+        error: the ModelUnavailableError, raised again if there is no old answer
+        returns the old answer marked with stale
+        """
+        if ResilienceConfig.stale_fallback and self.response_cache is not None:
+            cached = self.response_cache.get(key, record=False, stale=True)
+            if cached is not None:
+                cached["stale"] = True
+                return cached
+        raise error
+
+    def kill_query(self, thread_id):
+        #stop the statement running on a mysql connection, from a connection of its own as the pool may have none free
+        conn = mysql.connector.connect(**MySQLConfig.get_config(), connection_timeout=max(1, int(QueryTimeoutConfig.kill_connect_seconds)))
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"KILL QUERY {int(thread_id)}")
+            cursor.close()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def submitted(self, query_id=None, timeout=None):
+        """
+        A with block for one submitted query, it can be cancelled by id and its time budget runs from here
+        parameters:
+        query_id: id the caller chose so it can cancel the query while waiting for it, None for a new one
+        timeout: seconds the query may take (QueryTimeoutConfig.timeout_seconds, at most QueryTimeoutConfig.max_timeout_seconds)
+        """
+        query = self.running_queries.start(query_id, timeout)
+        try:
+            yield query
+        finally:
+            self.running_queries.finish(query)
+
+    @contextmanager
+    def query_connection(self, query, hinted=False):
+        #borrow a connection for a submitted query, the watchdog kills its statement if it is still running when the time is up
+        with self.mysql_connection() as conn:
+            with self.running_queries.running(query, conn, hinted):
+                yield conn
+
+    def timed_sql(self, sql_query, query):
+        #the statement to send, a SELECT carries the rest of the budget as MAX_EXECUTION_TIME, returns (sql, whether it has the hint)
+        timed = time_limit_sql(sql_query, query.remaining() * 1000)
+        return (timed, True) if timed is not None else (sql_query, False)
+
+    def result_key(self, sql_query, kind):
+        #result cache key for a statement about to run against the configured database, None if it isn't a cacheable read
+        if self.result_cache is None or kind != READ:
+            return None
+        return self.result_cache.key(MySQLConfig.get_config()["database"], sql_query)
+
+    def invalidate_results(self, sql_query, kind):
+        """
+        A confirmed write or DDL ran, cached results of the databases it may have changed are stale
+        a write changes the configured database (or the ones it names), DDL can reach any of them
+        """
+        if self.result_cache is None or kind == READ:
+            return
+        databases = databases_named(sql_query) if kind != DDL else None
+        if databases is None:
+            self.result_cache.bump()
+            return
+        databases.add(MySQLConfig.get_config()["database"])
+        for database in databases:
+            self.result_cache.bump(database)
 
-    def run_query(self, sql_query, confirmed=False):
+    def check_live_schema(self, sql_query, kind):
+        """
+        Check a statement against the schema of the connected database (a cached snapshot, so no round trip per query)
+        returns the problems found, empty when it looks fine, for DDL or when the schema can't be read
+        """
+        if kind == DDL:
+            return []
+        snapshot = self.schema_provider.snapshot(MySQLConfig.get_config()["database"])
+        if snapshot is None:
+            return []
+        return validate_sql(sql_query, snapshot.to_prompt_schema())
+
+    def check_query(self, sql_query_str, confirmed=False):
+        """
+        Validation layer: the statement is parsed locally, anything that isn't SQL or names tables and columns
+        the database doesn't have never gets sent to mysql
+        returns (READ / WRITE / DDL, the confirmation response if it has to be confirmed first, otherwise None)
+        """
+        try:
+            kind = classify_sql(sql_query_str)
+        except SqlParseError as e:
+            raise InvalidQueryError(f"The query could not be understood as SQL ({e}). Please review your question and try again.")
+        # writes and schema changes need confirming, reads (SELECT updated_at included) don't
+        if not confirmed and kind != READ:
+            return kind, {"type": "confirmation", "message": "Warning: This query may be destructive and cause irreversible changes to your data. Please confirm if you want to proceed."}
+        problems = self.check_live_schema(sql_query_str, kind)
+        if problems:
+            raise InvalidQueryError(
+                "It appears you’re asking about columns or data that do not exist in this dataset "
+                f"({'; '.join(problems)}). Please review your question and ensure the requested columns are present."
+            )
+        return kind, None
+
+    def query_error(self, e, query=None):
+        #expected MySQL errors are swappped for more user friendly messages, returns the exception to raise
+        logging.error("Query execution error", exc_info=True)
+        if query is not None:
+            #stopped by its MAX_EXECUTION_TIME hint, or killed by the watchdog / a cancel
+            if e.errno == ER_QUERY_TIMEOUT:
+                query.state = "timedOut"
+            if query.state == "timedOut":
+                return QueryTimeoutError(f"The query took longer than its {query.timeout:g} second limit and was stopped. Try narrowing it down, e.g. with a WHERE clause or fewer joins.")
+            if query.state == "cancelled":
+                return QueryCancelledError(f"Query {query.id} was cancelled.")
+        error_message = str(e)
+        error_code = e.errno  # MySQL-specific error code
+        if "ambiguous" in error_message.lower():
+            return InvalidQueryError("The SQL query references a column that does not exist or is ambiguous. Please verify that your dataset contains the correct columns and that your query references them correctly.")
+        elif error_code == 1064:
+            # 1064 is MySQL's syntax error code, which likely means the model didn't return valid SQL
+            return InvalidQueryError(
+                "It appears you’re asking about columns or data that do not exist in this dataset. "
+                "Please review your question and ensure the requested columns are present."
+            )
+        return Exception("A system error occurred during query execution. Please try again.")
+
+    def run_query(self, sql_query, confirmed=False, query_id=None, timeout=None):
         """
         Execute the provided SQL query against the MySQL database and return the results
+        a SELECT returns at most ResultConfig.max_rows rows, stream_query and run_query_page are for bigger results
         parameters
         sql_query: The SQL query string
+        query_id: id to cancel it by while it runs, see submitted
+        timeout: seconds it may run for, see submitted
         Query results or an error message
+        raises QueryTimeoutError / QueryCancelledError if it was stopped
+        """
+        return self.run_query_result(sql_query, confirmed, query_id=query_id, timeout=timeout)["results"]
+
+    def run_query_result(self, sql_query, confirmed=False, query_id=None, timeout=None):
+        """
+        run_query, saying whether the rows were cut off at ResultConfig.max_rows
+        returns {"results": what run_query returns, "truncated": True if there were more rows than were returned}
         """
         if isinstance(sql_query, dict) and "query" in sql_query:
             sql_query_str = sql_query["query"]
         else:
             sql_query_str = sql_query
-        conn = self.get_mysql_connection()
-        if conn is None:
-            return "MySQL connection failed."
-        # Validation layer: check for dangerous keywords if not confirmed
-        if not confirmed:
-            dangerous_keywords = ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "TRUNCATE"]
-            if any(keyword in sql_query_str.upper() for keyword in dangerous_keywords):
-                return {"type": "confirmation", "message": "Warning: This query may be destructive and cause irreversible changes to your data. Please confirm if you want to proceed."}
+        with self.submitted(query_id, timeout) as query:
+            return self._run_query(sql_query_str, confirmed, query)
+
+    def _run_query(self, sql_query_str, confirmed, query):
+        kind, confirmation = self.check_query(sql_query_str, confirmed)
+        if confirmation is not None:
+            return {"results": confirmation, "truncated": False}
+        max_rows = ResultConfig.max_rows
+        #the same read against data that hasn't changed since is answered from memory
+        key = self.result_key(sql_query_str, kind)
+        cached = self.result_cache.get(key) if key is not None else None
+        if cached is not None:
+            return {"results": cached, "truncated": False}
+        #the SQL runs as it was written, a LIMIT one row over the cap is only added when it has none of its own
+        statement, hinted = self.timed_sql(limit_sql(sql_query_str, max_rows + 1) or sql_query_str, query)
         #execute safely if confirmed that is the desired output
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql_query_str)
-            column_names = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
+            with self.query_connection(query, hinted) as conn:
+                cursor = conn.cursor()
+                try:
+                    try:
+                        cursor.execute(statement)
+                    finally:
+                        #even a write that failed part way may have changed rows
+                        self.invalidate_results(sql_query_str, kind)
+                    if kind == DDL:
+                        #the structure changed, so the cached schema snapshots can't be trusted any more
+                        self.schema_provider.invalidate()
+                    if cursor.description is None:
+                        #confirmed writes and DDL have no result set, commit them and report how many rows changed
+                        affected = cursor.rowcount
+                        conn.commit()
+                        return {"results": [{"rowsAffected": affected}], "truncated": False}
+                    column_names = [desc[0] for desc in cursor.description]
+                    #one row over the cap says whether anything was cut off
+                    rows = cursor.fetchmany(max_rows + 1)
+                finally:
+                    self._close_cursor(cursor)
+            truncated = len(rows) > max_rows
+            results = [dict(zip(column_names, row)) for row in rows[:max_rows]]
+            if key is not None and not truncated:
+                self.result_cache.put(key, results)
+            return {"results": results, "truncated": truncated}
+        except ConnectionUnavailableError as err:
+            print("MySQL connection error:", err)
+            return {"results": "MySQL connection failed.", "truncated": False}
+        except mysql.connector.Error as e:
+            raise self.query_error(e, query)
+
+    def _close_cursor(self, cursor):
+        try:
             cursor.close()
-            conn.close()
+        except mysql.connector.Error:
+            #rows left unread (the client went away or the cap was hit), the pool drops the connection
+            pass
+
+    def stream_query(self, sql_query, confirmed=False, batch_size=None, max_rows=None, query_id=None, timeout=None):
+        """
+        Run a query and hand its rows out a batch at a time as mysql sends them, the cursor is unbuffered
+        so only one batch is ever in memory however big the result is
+        parameters:
+        sql_query: the SQL query string
+        confirmed: the user confirmed a write or DDL statement
+        batch_size: rows per fetchmany batch (ResultConfig.batch_size)
+        max_rows: most rows sent before the result is cut off (ResultConfig.max_rows)
+        query_id, timeout: see submitted, the time budget covers reading the whole result
+        yields ("columns", column names), then ("rows", list of row dictionaries) per batch, then ("done", {"rowCount", "truncated"}),
+        or just ("confirmation", response) if the statement has to be confirmed first
+        raises like run_query, ConnectionUnavailableError when there is no connection
+        """
+        with self.submitted(query_id, timeout) as query:
+            yield from self._stream_query(sql_query, confirmed, batch_size, max_rows, query)
+
+    def _stream_query(self, sql_query, confirmed, batch_size, max_rows, query):
+        batch_size = batch_size or ResultConfig.batch_size
+        max_rows = ResultConfig.max_rows if max_rows is None else max_rows
+        kind, confirmation = self.check_query(sql_query, confirmed)
+        if confirmation is not None:
+            yield ("confirmation", confirmation)
+            return
+        #one row over the cap says whether anything was cut off, without mysql producing the rest
+        statement, hinted = self.timed_sql(limit_sql(sql_query, max_rows + 1) or sql_query, query)
+        with self.query_connection(query, hinted) as conn:
+            cursor = conn.cursor()
+            try:
+                try:
+                    cursor.execute(statement)
+                except mysql.connector.Error as e:
+                    raise self.query_error(e, query)
+                finally:
+                    self.invalidate_results(sql_query, kind)
+                if kind == DDL:
+                    self.schema_provider.invalidate()
+                if cursor.description is None:
+                    affected = cursor.rowcount
+                    conn.commit()
+                    yield ("columns", ["rowsAffected"])
+                    yield ("rows", [{"rowsAffected": affected}])
+                    yield ("done", {"rowCount": 1, "truncated": False})
+                    return
+                column_names = [desc[0] for desc in cursor.description]
+                yield ("columns", column_names)
+                sent = 0
+                truncated = False
+                while True:
+                    try:
+                        rows = cursor.fetchmany(batch_size)
+                    except mysql.connector.Error as e:
+                        raise self.query_error(e, query)
+                    if not rows:
+                        break
+                    if sent + len(rows) > max_rows:
+                        rows = rows[:max_rows - sent]
+                        truncated = True
+                    sent += len(rows)
+                    if rows:
+                        yield ("rows", [dict(zip(column_names, row)) for row in rows])
+                    if truncated:
+                        break
+                yield ("done", {"rowCount": sent, "truncated": truncated})
+            finally:
+                self._close_cursor(cursor)
+
+    def run_query_page(self, sql_query, page_size=None, page_token=None, query_id=None, timeout=None):
+        """
+        One page of a SELECT's results, the page token from the previous page says where the next one starts
+        (it is an offset, so pages are only stable when the query has an ORDER BY), the SQL runs as it was written
+        with LIMIT / OFFSET added, or when it has a LIMIT of its own the rows before the page are skipped while fetching
+        parameters:
+        sql_query: the SQL query string, the same for every page
+        page_size: rows per page (ResultConfig.page_size, at most ResultConfig.max_page_size)
+        page_token: nextPageToken of the previous page, None for the first page
+        query_id, timeout: see submitted, the budget is per page
+        returns {"results": rows, "nextPageToken": token for the next page or None on the last one}
+        """
+        with self.submitted(query_id, timeout) as query:
+            return self._run_query_page(sql_query, page_size, page_token, query)
+
+    def _run_query_page(self, sql_query, page_size, page_token, query):
+        page_size = min(max(1, int(page_size or ResultConfig.page_size)), ResultConfig.max_page_size)
+        offset = decode_page_token(sql_query, page_token) if page_token else 0
+        kind, _ = self.check_query(sql_query, confirmed=False)
+        if kind != READ:
+            raise InvalidQueryError("Only a SELECT query can be read in pages.")
+        #a page past the row cap is never read
+        size = min(page_size, ResultConfig.max_rows - offset)
+        if size <= 0:
+            return {"results": [], "nextPageToken": None}
+        #a dashboard paging through the same query reads each page from memory until the data changes
+        key = self.result_key(sql_query, kind)
+        key = key + (offset, size + 1) if key is not None else None
+        results = self.result_cache.get(key) if key is not None else None
+        if results is None:
+            paged = limit_sql(sql_query, size + 1, offset)
+            skip = 0 if paged is not None else offset
+            statement, hinted = self.timed_sql(paged or sql_query, query)
+            try:
+                with self.query_connection(query, hinted) as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(statement)
+                        column_names = [desc[0] for desc in cursor.description]
+                        while skip > 0 and cursor.fetchmany(min(skip, ResultConfig.batch_size)):
+                            skip -= min(skip, ResultConfig.batch_size)
+                        rows = cursor.fetchmany(size + 1)
+                    finally:
+                        self._close_cursor(cursor)
+            except ConnectionUnavailableError:
+                raise
+            except mysql.connector.Error as e:
+                raise self.query_error(e, query)
             results = [dict(zip(column_names, row)) for row in rows]
-            return results
-        except mysql.connector.Error as e:
-            logging.error("Query execution error", exc_info=True)
-            error_message = str(e)
-            error_code = e.errno  # MySQL-specific error code
-            #expected MySQL errors are swappped for more user friendly messages
-            if "ambiguous" in error_message.lower():
-                raise InvalidQueryError("The SQL query references a column that does not exist or is ambiguous. Please verify that your dataset contains the correct columns and that your query references them correctly.")
-            elif error_code == 1064:
-                # 1064 is MySQL's syntax error code, which likely means the model didn't return valid SQL
-                raise InvalidQueryError(
-                    "It appears you’re asking about columns or data that do not exist in this dataset. "
-                    "Please review your question and ensure the requested columns are present."
-                )
-            else:
-             raise Exception("A system error occurred during query execution. Please try again.")            
-            
+            if key is not None:
+                self.result_cache.put(key, results)
+        more = len(results) > size
+        return {
+            "results": results[:size],
+            "nextPageToken": encode_page_token(sql_query, offset + size) if more else None,
+        }
 
 #for testinf during sprint 2 to check work flows and that everything is ready to move forward
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
 from ModelClient import ModelClient, SchemaMismatchError, InvalidQueryError
@@ -9,19 +9,30 @@ logging.basicConfig(level=logging.ERROR)
 load_dotenv()
 import mysql.connector
 from mysql.connector import errorcode
-import json
-from config import MySQLConfig
+import tempfile
+from config import MySQLConfig, IngestConfig, CascadeConfig
+from datasetIngest import load_dataset, infile_connection_args, INGEST_MODES, INFILE_DIR
+from datasetStream import iter_dataset_events, read_database_name, DatasetFormatError
+from ingestJobs import IngestJobManager
+from datasetRegistry import DatasetRegistry, DatasetSummary, DatasetNotFoundError, hash_file
+from columnProfile import prompt_values
+from modelResilience import ModelUnavailableError
+from connectionPool import connection_pool, close_pool, pool_stats, ConnectionUnavailableError
+from queryControl import QueryTimeoutError, QueryCancelledError, QueryIdInUseError
+import uuid
 
 app = Flask(__name__) #create a flask instance, name being the same as the current module
-CORS(app, origins=["http://localhost:3000"]) #enable cross origin resource, to let the react frontend call the flask api
+CORS_ORIGINS = ["http://localhost:3000"]
+CORS(app, origins=CORS_ORIGINS, expose_headers=["X-Query-Id"]) #enable cross origin resource, to let the react frontend call the flask api
 
 # Initialise open ai client, creating an openai object
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+#retries are left to the ModelClient caller (ResilienceConfig) so they share its deadline and circuit breaker
+openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 
 # the name of the model i fine tuned adn the paremeters to connect to a databsae server
 fine_tuned_model = "ft:gpt-4o-mini-2024-07-18:personal::B3lHt6V9"
-#alternative of using the better (more expensive model)
-#fine_tuned_model = "o3-mini-2025-01-31"
+#the better (more expensive, slower) model only gets the questions the fine-tuned one gets wrong, see CascadeConfig
+escalation_model = CascadeConfig.escalation_model if CascadeConfig.enabled else None
 
 #default param for mysql connection to the database host, pulls from env
 default_mysql_config = {
@@ -32,28 +43,73 @@ default_mysql_config = {
 }
 
 # Instantiate model client class which integrates the schema extraction and MySQL execution logic
-model_client = ModelClient(openai_client, fine_tuned_model)
+model_client = ModelClient(openai_client, fine_tuned_model, escalation_model=escalation_model)
+
+# background pool for dataset uploads so the upload request returns straight away with a job id
+ingest_jobs = IngestJobManager()
+# uploaded datasets by content hash, so questions can send an id instead of the whole file
+dataset_registry = DatasetRegistry()
+
+def find_dataset(dataset_id=None, dataset_file=None, filename=None):
+    """
+    Find the registry entry for a dataset, either by the id returned by upload-dataset or by hashing the uploaded file,
+    a file is only parsed the first time its content is seen
+    returns the entry, or None if there is neither
+    """
+    if dataset_id:
+        return dataset_registry.get(dataset_id)
+    if dataset_file is not None:
+        return dataset_registry.register(dataset_file, filename)
+    return None
+
+def lookup_dataset():
+    #find_dataset for the datasetId / dataset fields of the current flask request
+    dataset_file = request.files.get('dataset')
+    return find_dataset(request.form.get('datasetId'), dataset_file, dataset_file.filename if dataset_file else None)
+
+def question_options(dataset_entry):
+    """
+    The keyword arguments for ModelClient.query that come from a dataset's registry entry
+    once the dataset is fully loaded the prompt uses the live schema from mysql, which has the real types and keys,
+    and the most common values of each column help pick the tables of a wide schema (older entries only have the preview)
+    """
+    database = dataset_entry.get("database")
+    if database and ingest_jobs.is_loading(database):
+        database = None
+    samples = prompt_values(dataset_entry["profile"]) if dataset_entry.get("profile") else dataset_entry.get("preview")
+    return {"schema": dataset_entry["schema"], "database": database, "samples": samples}
 
 @app.route('/api/generate-query', methods=['POST'])
 def generate_query():
     print("Received request at /api/generate-query") #debugginf line
-    # Check if the dataset file is uploaded
-    if 'dataset' not in request.files:
+    # Check if the dataset id or file was sent
+    if not request.form.get('datasetId') and 'dataset' not in request.files:
         return "No dataset file provided", 400
-    dataset_file = request.files['dataset'] #get the uploaded file from the request
 
     # Also check for a question
     question = request.form.get('question')
     if not question:
         return "No question provided", 400 #error if no question is present 
+    #the schema comes from the registry so the file isn't parsed again for every question
+    try:
+        dataset_entry = lookup_dataset()
+    except DatasetNotFoundError as dnf:
+        return jsonify({"type": "error", "message": str(dnf)}), 404
+    except Exception:
+        logging.error("Error registering dataset", exc_info=True)
+        return jsonify({"type": "error", "message": "Failed to extract schema from the dataset. Please ensure your file is in the correct format with the expected columns."}), 400
     try:
-        sql_query = model_client.query(dataset_file, question, filename=dataset_file.filename)
+        sql_query = model_client.query(None, question, **question_options(dataset_entry))
         print("SQL Query generated:", sql_query) #ask the modelclient to produce an sql query using the model, the file for schema and query to know waht to translate
         return jsonify(sql_query) #generated query is returned in json format to display
     except SchemaMismatchError as sme:
     #known errorrs are logged and return an error response 
         logging.error("Schema mismatch error during query generation", exc_info=True)
         return jsonify({"type": "error", "message": str(sme)}), 400
+    except ModelUnavailableError as mue:
+        #the model timed out or its circuit breaker is open and nothing cached could answer instead
+        logging.error("Model unavailable during query generation", exc_info=True)
+        return jsonify({"type": "error", "message": str(mue)}), 503
     except Exception as e:
         logging.error("Unhandled error during query generation", exc_info=True)
         return jsonify({"type": "error", "message": f"Generate Query Error: {str(e)}"}), 500
@@ -67,12 +123,34 @@ def execute_query():
     query = data["query"]
     #extract the query string and potentially a boolean which indicated the user confirms 
     confirmed = data.get("confirmed", False) 
+    #the id /api/cancel-query stops it by, the frontend can send its own so it can cancel before the response arrives,
+    #it is in the X-Query-Id header of every response (a streamed one has it before the first row)
+    query_id = str(data.get("queryId") or uuid.uuid4().hex)
+    timeout = data.get("timeoutSeconds")
     try:
-        #execute the sql query made by my model 
-        results = model_client.run_query(query, confirmed)
-        #return the results of the query as a json
-        return jsonify({"results": results})
+        if data.get("stream"):
+            #newline delimited json as the rows are read, for results too big to hold in memory
+            response = stream_results(model_client.stream_query(query, confirmed, batch_size=data.get("batchSize"), query_id=query_id, timeout=timeout))
+        elif data.get("pageSize") or data.get("pageToken"):
+            #one page at a time, the response's nextPageToken asks for the next one
+            response = jsonify({**model_client.run_query_page(query, data.get("pageSize"), data.get("pageToken"), query_id=query_id, timeout=timeout), "queryId": query_id})
+        else:
+            #execute the sql query made by my model 
+            outcome = model_client.run_query_result(query, confirmed, query_id=query_id, timeout=timeout)
+            #return the results of the query as a json, truncated says rows past ResultConfig.max_rows were left out
+            response = jsonify({**outcome, "queryId": query_id})
+        response.headers["X-Query-Id"] = query_id
+        return response
+    except ConnectionUnavailableError as err:
+        logging.error("MySQL connection error during query execution", exc_info=True)
+        return jsonify({"results": "MySQL connection failed."})
     #log errors and respond to errors
+    except QueryTimeoutError as qte:
+        return jsonify({"type": "timeout", "message": str(qte), "queryId": query_id}), 504
+    except QueryCancelledError as qce:
+        return jsonify({"type": "cancelled", "message": str(qce), "queryId": query_id}), 409
+    except QueryIdInUseError as qie:
+        return jsonify({"type": "error", "message": str(qie)}), 409
     except InvalidQueryError as iqe:
         logging.error("Invalid query error during execution", exc_info=True)
         return jsonify({"type": "error", "message": str(iqe)}), 400
@@ -80,6 +158,55 @@ def execute_query():
         logging.error("Unhandled error during query execution", exc_info=True)
         return f"Execute Query Error: {str(e)}", 500
     
+def stream_results(batches):
+    """
+    Response for a streamed query, one json line per message: {"type": "columns", "columns"}, {"type": "rows", "rows"}
+    per fetched batch and {"type": "done", "rowCount", "truncated"} at the end ({"type": "error", "message"} if it fails part way)
+    the first message is read before the response starts so a query that can't run still gets a normal error response
+    a statement that needs confirming gets the usual {"results": confirmation} json instead
+    """
+    kind, payload = next(batches)
+    if kind == "confirmation":
+        #nothing ran, finishing the generator takes the query off the running list
+        batches.close()
+        return jsonify({"results": payload})
+
+    def line(kind, payload):
+        message = {"type": "done", **payload} if kind == "done" else {"type": kind, kind: payload}
+        return app.json.dumps(message) + "\n"
+
+    def lines():
+        yield line(kind, payload)
+        try:
+            for message in batches:
+                yield line(*message)
+        except Exception as e:
+            logging.error("Error while streaming query results", exc_info=True)
+            yield app.json.dumps({"type": "error", "message": str(e)}) + "\n"
+        finally:
+            #the client went away, the cursor is closed and the connection goes back to the pool
+            batches.close()
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+def drop_database(host, user, password, db_name):
+    #drop a database this system created, returns False (and logs) if it could not be dropped
+    try:
+        with connection_pool(host, user, password).connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"DROP DATABASE IF EXISTS `{db_name}`;")
+                conn.commit()
+            finally:
+                cursor.close()
+        close_pool(host, user, db_name)
+        if model_client.result_cache is not None:
+            model_client.result_cache.bump(db_name)
+        return True
+    except mysql.connector.Error:
+        logging.error(f"Could not drop database {db_name}", exc_info=True)
+        return False
+
 @app.route('/api/upload-dataset', methods=['POST'])
 def upload_dataset():
     # Get credentials from form data (or fallback to defaults)
@@ -88,22 +215,19 @@ def upload_dataset():
         host = "mysql" #as in docker based environments, if the host is local host, default to mysql
     user = request.form.get("user", default_mysql_config["user"])
     password = request.form.get("password", default_mysql_config["password"])
+    #how the rows get loaded, batched inserts or LOAD DATA LOCAL INFILE (falls back to inserts if the server refuses)
+    ingest_mode = request.form.get("ingestMode", IngestConfig.mode)
+    if ingest_mode not in INGEST_MODES:
+        return jsonify({"error": f"Unknown ingest mode '{ingest_mode}'"}), 400
     #check if the file with name "dataset" is in the request, if so retrieve it 
     if 'dataset' not in request.files:
         return jsonify({"error": "No dataset file provided"}), 400
     dataset_file = request.files['dataset']
     
-    # Read the dataset file and pull the database name
+    # Stream the dataset file just far enough to pull the database name, the rows are read later while loading
     try:
-        dataset_content = dataset_file.read().decode('utf-8')
-        dataset_file.seek(0)  # Reset pointer for more processing if needed
-        data = json.loads(dataset_content)
-        db_name = None
-        # Look for the line with "type": "database" to extract the name
-        for line in data:
-            if line.get("type") == "database":
-                db_name = line.get("name")
-                break
+        db_name = read_database_name(dataset_file)
+        dataset_file.seek(0)  # Reset pointer so the tables can be streamed from the start
         if not db_name:
             return jsonify({"error": "Database name not found in dataset"}), 400
     except Exception as e:
@@ -113,16 +237,16 @@ def upload_dataset():
     newDatabaseCreated = False #used to run the drop dataset command or not 
     #create the database
     try:
-        conn = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password
-        )
-        cursor = conn.cursor()
-        #create the database in teh file in our host, so we can fetch results and search the data within the files 
-        create_db_query = f"CREATE DATABASE {db_name};"
-        cursor.execute(create_db_query)
-        conn.commit()
+        #a pooled server connection, no handshake for every upload
+        with connection_pool(host, user, password).connection() as conn:
+            cursor = conn.cursor()
+            try:
+                #create the database in teh file in our host, so we can fetch results and search the data within the files 
+                create_db_query = f"CREATE DATABASE {db_name};"
+                cursor.execute(create_db_query)
+                conn.commit()
+            finally:
+                cursor.close()
         newDatabaseCreated = True
     except mysql.connector.Error as err:
         if err.errno == errorcode.ER_DB_CREATE_EXISTS:
@@ -130,94 +254,150 @@ def upload_dataset():
             newDatabaseCreated = False
             # Update MySQLConfig with the existing database credentials
             MySQLConfig.update_config(host=host, user=user, password=password, database=db_name)
+            #nothing gets loaded but the file still gets an id so questions don't have to send it again
+            dataset_entry = dataset_registry.register(dataset_file, dataset_file.filename)
             return jsonify({
                 "message": f"Database '{db_name}' is already present and did not need to be uploaded. Continue with your question.",
                 "database": db_name,
-                "newDatabaseCreated": newDatabaseCreated
+                "newDatabaseCreated": newDatabaseCreated,
+                "datasetId": dataset_entry["datasetId"]
             })
         else:
             logging.error("MySQL error during database creation", exc_info=True)
             return jsonify({"error": f"MySQL error: {err}"}), 500
         #if the databse already exists, skip the creation
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
-        #all scenarios close the DB connection to avoid resource leaks
+    #all scenarios give the DB connection back to the pool to avoid resource leaks
 
     # Update the model client's configuration to use the new (or existing) database
     MySQLConfig.update_config(host=host, user=user, password=password, database=db_name)
     
     # Process dataset to generate and execute CREATE TABLE and INSERT queries so i can populate the database 
     if newDatabaseCreated:
-        try:
-            conn = mysql.connector.connect(
+        filename = dataset_file.filename
+
+        def connect_dataset_db():
+            #every ingest worker opens its own connection to the new database
+            return mysql.connector.connect(
                 host=host,
                 user=user,
                 password=password,
-                database=db_name
+                database=db_name,
+                **infile_connection_args(ingest_mode)
             )
-            if not conn.is_connected():
-                return jsonify({"error": f"Failed to connect to MySQL database '{db_name}'. Please verify the server and database."}), 500
-            cursor = conn.cursor()
-            # Iterate through each record in the dataset JSON
-            #reconned to the created databsae, then creating the tables within if it is accessible
-            for record in data:
-                if record.get("type") == "table":
-                    table_name = record.get("name")
-                    table_data = record.get("data", [])
-                    if not table_name or not table_data:
-                        continue
-                    # get schema from the first row
-                    first_row = table_data[0]
-                    columns_definitions = []
-                    for col, val in first_row.items():
-                        if isinstance(val, int):
-                            col_type = "INT"
-                        elif isinstance(val, float):
-                            col_type = "DOUBLE"
-                        else:
-                            col_type = "VARCHAR(255)"
-                        columns_definitions.append(f"`{col}` {col_type}")
-                    columns_sql = ", ".join(columns_definitions)
-                    create_table_query = f"CREATE TABLE IF NOT EXISTS `{table_name}` ({columns_sql});"
-                    cursor.execute(create_table_query)
-
-                    # Insert data rows
-                    #for each table in the schema, i build a CREATE TABLE statment, inferring the collumn types from the first row
-                    # then inserting each row of data
-                    for row in table_data:
-                        columns = ", ".join(f"`{col}`" for col in row.keys())
-                        values_list = []
-                        for val in row.values():
-                            if isinstance(val, str):
-                                escaped_val = val.replace("'", "''")
-                                values_list.append(f"'{escaped_val}'")
-                            elif val is None:
-                                values_list.append("NULL")
-                            else:
-                                values_list.append(str(val))
-                        values = ", ".join(values_list)
-                        insert_query = f"INSERT INTO `{table_name}` ({columns}) VALUES ({values});"
-                        cursor.execute(insert_query)
-            conn.commit() #all the create and insert operations go to the database
+        #the uploaded file goes away with the request, so the load works from its own copy on disk
+        #the copy is hashed on the way, the hash is the id the other endpoints use for this dataset
+        spool = tempfile.NamedTemporaryFile(suffix=".json", dir=INFILE_DIR, delete=False)
+        try:
+            dataset_id = hash_file(dataset_file, copy_to=spool)
+        finally:
+            spool.close()
+        #a dataset seen before is already registered, otherwise the load registers it as the rows stream past
+        summary = None if dataset_registry.contains(dataset_id) else DatasetSummary()
+
+        def run_ingest(job):
+            # create each table from its first row and load the rows in parameterised multi row batches
+            # batch size, commit interval and the number of tables loaded at once come from IngestConfig
+            # the file is parsed incrementally so only one chunk of rows is in memory at a time
+            try:
+                with open(spool.name, "rb") as f:
+                    events = iter_dataset_events(f, chunk_rows=IngestConfig.batch_size)
+                    if summary is not None:
+                        events = summary.watch(events)
+                    try:
+                        load_stats = load_dataset(connect_dataset_db, events, mode=ingest_mode, progress=job)
+                    except Exception:
+                        #all or nothing, if anything failed (mysql, a malformed or undecodable file, a bad value) the half loaded
+                        #database is dropped so the upload can simply be retried
+                        logging.error("Error during table creation/insertion, dropping the new database", exc_info=True)
+                        if job is not None:
+                            job.set_phase("cleanup")
+                        drop_database(host, user, password, db_name)
+                        raise
+                    finally:
+                        #the tables are new (or gone), so any snapshot of this database is out of date
+                        model_client.schema_provider.invalidate(db_name)
+                        #and so is any result read from it before this load
+                        if model_client.result_cache is not None:
+                            model_client.result_cache.bump(db_name)
+            finally:
+                os.remove(spool.name)
+            if summary is not None:
+                dataset_registry.add(dataset_id, filename, summary.to_dict())
+            return {
+                "tablesLoaded": load_stats["tables"],
+                "rowsLoaded": load_stats["rows"],
+                "ingestMode": load_stats["mode"],
+                "indexesCreated": load_stats["indexes"],
+                "loadSeconds": load_stats["seconds"],
+                "rowsPerSecond": load_stats["rowsPerSecond"]
+            }
+
+        #by default the load runs in the background and the frontend polls /api/jobs/<id>, wait=true keeps the old blocking behaviour
+        if request.form.get("wait", "false").lower() != "true":
+            job = ingest_jobs.submit(db_name, run_ingest)
+            return jsonify({
+                "message": "Dataset upload started.",
+                "database": db_name,
+                "newDatabaseCreated": newDatabaseCreated,
+                "datasetId": dataset_id,
+                "jobId": job.id
+            }), 202
+        try:
+            load_summary = run_ingest(None)
+        except DatasetFormatError as dfe:
+            return jsonify({"error": f"Failed to parse dataset: {dfe}"}), 400
         except mysql.connector.Error as err:
-            #in case of error when creating the tabls or inserting tthe data, roll back and output error
-            conn.rollback()
             return jsonify({"error": f"MySQL error during table creation/insertion: {err}"}), 500
-        finally:
-            if 'cursor' in locals():
-                cursor.close()
-            if 'conn' in locals():
-                conn.close()
-                #when done close the cursor and connection
+        except Exception as e:
+            #anything else is down to the file (undecodable text, values that don't convert), the database was dropped
+            return jsonify({"error": f"Failed to load dataset: {e}"}), 400
         return jsonify({
             "message": "Dataset processed successfully.",
             "database": db_name,
-            "newDatabaseCreated": newDatabaseCreated
+            "newDatabaseCreated": newDatabaseCreated,
+            "datasetId": dataset_id,
+            **load_summary
         }) #pop up a massage telling the user that the database is ready
 
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    #hit / miss counters and sizes of the model response cache, and of the query result cache
+    result_cache = model_client.result_cache.stats() if model_client.result_cache is not None else None
+    if model_client.response_cache is None:
+        return jsonify({"enabled": False, "resultCache": result_cache})
+    return jsonify({"enabled": True, **model_client.response_cache.stats(), "coalesced": model_client.inflight.shared, "resultCache": result_cache})
+
+@app.route('/api/pool-stats', methods=['GET'])
+def mysql_pool_stats():
+    #checkouts, reuse, health check failures, idle evictions and wait times of every mysql connection pool,
+    #and how many queries are running and how many were cancelled or stopped for taking too long
+    return jsonify({"pools": pool_stats(), "queries": model_client.running_queries.stats()})
+
+@app.route('/api/cancel-query', methods=['POST'])
+def cancel_query():
+    #stop a query from /api/execute-query by its queryId, its own request then gets a "cancelled" response
+    data = request.get_json(silent=True) or {}
+    query_id = data.get("queryId")
+    if not query_id:
+        return jsonify({"error": "No queryId provided"}), 400
+    if not model_client.running_queries.cancel(str(query_id)):
+        return jsonify({"error": f"Query '{query_id}' is not running (it may have finished already)"}), 404
+    return jsonify({"message": f"Query {query_id} has been cancelled.", "queryId": query_id})
+
+@app.route('/api/model-stats', methods=['GET'])
+def model_stats():
+    #retries, hedges, circuit breaker state and recent latency percentiles of the model calls,
+    #and the latency per model and escalation rate of the cascade
+    return jsonify({**model_client.caller.stats(), "cascade": model_client.cascade.stats()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    #progress of a background dataset upload, polled by the frontend until the phase is done or failed
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/remove-dataset', methods=['POST'])
 def remove_dataset():
     # Get credentials from form data
@@ -230,20 +410,20 @@ def remove_dataset():
     # Get the flag indicating if the database was newly created
     new_db_flag = request.form.get("newDatabaseCreated", "false").lower() == "true"
     
-    if 'dataset' not in request.files:
+    dataset_id = request.form.get("datasetId")
+    if not dataset_id and 'dataset' not in request.files:
         return jsonify({"error": "No dataset file provided"}), 400
-    dataset_file = request.files['dataset'] #read the credentials, check if the dataset was created, retrieve the dataset file
+    #read the credentials, check if the dataset was created, find the database name from the registry or the dataset file
     
     try:
-        dataset_content = dataset_file.read().decode('utf-8')
-        data = json.loads(dataset_content)
-        db_name = None
-        for line in data:
-            if line.get("type") == "database":
-                db_name = line.get("name")
-                break
+        if dataset_id:
+            db_name = dataset_registry.get(dataset_id)["database"]
+        else:
+            db_name = read_database_name(request.files['dataset'])
         if not db_name:
             return jsonify({"error": "Database name not found in dataset"}), 400
+    except DatasetNotFoundError as dnf:
+        return jsonify({"error": str(dnf)}), 404
     except Exception as e:
         logging.error("Error parsing dataset file during removal", exc_info=True)
         return jsonify({"error": "Failed to parse dataset"}), 400
@@ -255,47 +435,38 @@ def remove_dataset():
     
     #to drop the dataset, get the name from the db, check if it was created, if it was then safe to drop without comprimising data
     try:
-        conn = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password
-        )
-        cursor = conn.cursor()
-        drop_db_query = f"DROP DATABASE {db_name};"
-        cursor.execute(drop_db_query)
-        conn.commit()
+        with connection_pool(host, user, password).connection() as conn:
+            cursor = conn.cursor()
+            try:
+                drop_db_query = f"DROP DATABASE {db_name};"
+                cursor.execute(drop_db_query)
+                conn.commit()
+            finally:
+                cursor.close()
+        model_client.schema_provider.invalidate(db_name)
+        if model_client.result_cache is not None:
+            model_client.result_cache.bump(db_name)
+        #connections to the dropped database are no use to anyone now
+        close_pool(host, user, db_name)
     except mysql.connector.Error as err:
         logging.error("MySQL error during DROP DATABASE", exc_info=True)
         return jsonify({"error": f"MySQL error during DROP DATABASE: {err}"}), 500
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
     #tell the user that the db was removed
     return jsonify({"message": f"Database {db_name} has been dropped successfully."})
 
 @app.route('/api/schema-preview', methods=['POST'])
 def schema_preview():
-    if 'dataset' not in request.files:
+    if not request.form.get('datasetId') and 'dataset' not in request.files:
         return jsonify({"error": "No dataset file provided"}), 400
-    dataset_file = request.files['dataset'] #check and retrieve the db file
     try:
-        dataset_content = dataset_file.read().decode('utf-8')
-        data = json.loads(dataset_content)
-        preview = {}
-        #for each table within the db, gather a few examples to user in the preview from each collumn
-        for record in data:
-            if record.get("type") == "table":
-                table_name = record["name"]
-                table_data = record.get("data", [])
-                if table_data:
-                    column_samples = {}
-                    for col in table_data[0].keys():
-                        unique_vals = list({row[col] for row in table_data if row.get(col) is not None})
-                        column_samples[col] = unique_vals[:3]
-                    preview[table_name] = column_samples
-        return jsonify(preview) #return the data for preview, including the few samples per column
+        #a few distinct example values per column of each table, worked out once when the dataset was registered
+        dataset_entry = lookup_dataset()
+        if request.form.get('stats', 'false').lower() == 'true':
+            #the full column profiles as well, distinct counts, null ratios, min / max and the most common values
+            return jsonify({"preview": dataset_entry["preview"], "profile": dataset_entry.get("profile", {})})
+        return jsonify(dataset_entry["preview"]) #return the data for preview, including the few samples per column
+    except DatasetNotFoundError as dnf:
+        return jsonify({"error": str(dnf)}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
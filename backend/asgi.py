@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from a2wsgi import WSGIMiddleware
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+import api
+from asyncModelClient import AsyncModelClient
+from ModelClient import SchemaMismatchError, InvalidQueryError
+from datasetRegistry import DatasetNotFoundError
+from modelResilience import ModelUnavailableError
+from connectionPool import ConnectionUnavailableError
+from queryControl import QueryTimeoutError, QueryCancelledError
+from sqlValidation import classify_sql, SqlParseError, READ
+from config import ServerConfig, BatchConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+def _reads_only(sql_query):
+    #only statements that read are run for a batch, anything else (WITH ... DELETE included) is returned for the user to confirm and run themselves
+    try:
+        return classify_sql(sql_query) == READ
+    except SqlParseError:
+        return False
+
+#asgi entry point for the api, run with: uvicorn asgi:app --host 0.0.0.0 --port 5001
+#the routes that mostly wait on the model are async so one process can hold hundreds of model calls at once,
+#every other route is the flask app from api.py running on a thread pool, so both share the same registry, jobs and caches
+
+#same schema provider and caches as the flask model client, a question answered by either is cached for both
+async_model_client = AsyncModelClient(
+    AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0),
+    api.fine_tuned_model,
+    schema_provider=api.model_client.schema_provider,
+    response_cache=api.model_client.response_cache,
+    question_index=api.model_client.question_index,
+    template_cache=api.model_client.template_cache,
+    caller=api.model_client.caller, #same deadlines, breaker and latency percentiles, it is the same provider
+    escalation_model=api.escalation_model,
+    result_cache=api.model_client.result_cache
+)
+#one set of cascade stats for /api/model-stats whichever client answered
+async_model_client.cascade = api.model_client.cascade
+#one list of running queries, so /api/pool-stats and /api/cancel-query see the batch queries too
+async_model_client.running_queries = api.model_client.running_queries
+
+async def find_dataset(form):
+    #the registry entry for the datasetId or dataset field of a form, registering (hashing / parsing) runs off the event loop
+    dataset_file = form.get('dataset')
+    if isinstance(dataset_file, str):
+        dataset_file = None
+    return await asyncio.to_thread(
+        api.find_dataset, form.get('datasetId'),
+        dataset_file.file if dataset_file is not None else None,
+        dataset_file.filename if dataset_file is not None else None
+    )
+
+async def read_question(request):
+    """
+    Read the dataset and question of a generate request
+    returns (question, dataset entry, None), or (None, None, error response) if the request can't be answered
+    """
+    async with request.form() as form:
+        if not form.get('datasetId') and not form.get('dataset'):
+            return None, None, PlainTextResponse("No dataset file provided", status_code=400)
+        question = form.get('question')
+        if not question:
+            return None, None, PlainTextResponse("No question provided", status_code=400)
+        try:
+            return question, await find_dataset(form), None
+        except DatasetNotFoundError as dnf:
+            return None, None, JSONResponse({"type": "error", "message": str(dnf)}, status_code=404)
+        except Exception:
+            logging.error("Error registering dataset", exc_info=True)
+            return None, None, JSONResponse({"type": "error", "message": "Failed to extract schema from the dataset. Please ensure your file is in the correct format with the expected columns."}, status_code=400)
+
+async def generate_query(request):
+    #async version of the flask /api/generate-query, same form fields and same responses
+    question, dataset_entry, error = await read_question(request)
+    if error is not None:
+        return error
+    try:
+        sql_query = await async_model_client.query(None, question, **api.question_options(dataset_entry))
+        return JSONResponse(sql_query)
+    except SchemaMismatchError as sme:
+        logging.error("Schema mismatch error during query generation", exc_info=True)
+        return JSONResponse({"type": "error", "message": str(sme)}, status_code=400)
+    except ModelUnavailableError as mue:
+        logging.error("Model unavailable during query generation", exc_info=True)
+        return JSONResponse({"type": "error", "message": str(mue)}, status_code=503)
+    except Exception as e:
+        logging.error("Unhandled error during query generation", exc_info=True)
+        return JSONResponse({"type": "error", "message": f"Generate Query Error: {str(e)}"}, status_code=500)
+
+def sse_event(event, data):
+    #one server-sent event with a json payload
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def generate_query_stream(request):
+    """
+    /api/generate-query as server-sent events, same form fields
+    "token" events carry each piece of the answer as the model writes it ({"text": ...}),
+    then one "result" event with the same json /api/generate-query returns, or an "error" event
+    """
+    question, dataset_entry, error = await read_question(request)
+    if error is not None:
+        return error
+    options = api.question_options(dataset_entry)
+
+    async def events():
+        try:
+            async for kind, payload in async_model_client.query_stream(None, question, **options):
+                yield sse_event(kind, {"text": payload} if kind == "token" else payload)
+        except SchemaMismatchError as sme:
+            logging.error("Schema mismatch error during query generation", exc_info=True)
+            yield sse_event("error", {"type": "error", "message": str(sme)})
+        except ModelUnavailableError as mue:
+            logging.error("Model unavailable during streamed query generation", exc_info=True)
+            yield sse_event("error", {"type": "error", "message": str(mue)})
+        except Exception as e:
+            logging.error("Unhandled error during streamed query generation", exc_info=True)
+            yield sse_event("error", {"type": "error", "message": f"Generate Query Error: {str(e)}"})
+
+    #no caching or proxy buffering, every event should reach the browser as soon as it is written
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def parse_questions(raw):
+    #the questions field is a json list of strings, or one question per line
+    try:
+        questions = json.loads(raw)
+    except ValueError:
+        questions = raw.splitlines()
+    if not isinstance(questions, list):
+        raise ValueError("questions must be a list")
+    return [str(q).strip() for q in questions if str(q).strip()]
+
+async def answer_question(index, question, options, execute, semaphore):
+    """
+    Generate (and optionally run) the SQL for one question of a batch, waiting for a free slot first
+    errors are reported in the item rather than raised so one bad question doesn't stop the rest
+    returns the item streamed back for this question
+    """
+    async with semaphore:
+        item = {"index": index, "question": question}
+        try:
+            response = await async_model_client.query(None, question, **options)
+            item["response"] = response
+            if execute and response.get("type") == "sql" and _reads_only(response["query"]):
+                outcome = await async_model_client.run_query_result_async(response["query"])
+                if isinstance(outcome["results"], str):
+                    item["error"] = outcome["results"]
+                else:
+                    item["results"] = outcome["results"]
+                    item["truncated"] = outcome["truncated"]
+        except (SchemaMismatchError, InvalidQueryError, ModelUnavailableError,
+                QueryTimeoutError, QueryCancelledError, ConnectionUnavailableError) as e:
+            #the question or its query failed in a way the user can be told about, not a bug
+            item["error"] = str(e)
+        except Exception as e:
+            logging.error(f"Unhandled error answering batch question {index}", exc_info=True)
+            item["error"] = f"Generate Query Error: {str(e)}"
+        return item
+
+async def generate_batch(request):
+    """
+    Answer a list of questions against one dataset, the schema is looked up once and the model calls run at the same time
+    (at most BatchConfig.concurrency, or the concurrency field if it is lower)
+    form fields: datasetId or dataset, questions (json list), execute ("true" to run the SELECTs), concurrency
+    the response is newline delimited json, one line per question as soon as it is finished (with its index so it can
+    be matched up) and a last line with done set and the totals
+    """
+    async with request.form() as form:
+        if not form.get('datasetId') and not form.get('dataset'):
+            return PlainTextResponse("No dataset file provided", status_code=400)
+        try:
+            questions = parse_questions(form.get('questions') or "")
+        except ValueError:
+            return JSONResponse({"type": "error", "message": "questions must be a JSON list of strings"}, status_code=400)
+        if not questions:
+            return PlainTextResponse("No questions provided", status_code=400)
+        if len(questions) > BatchConfig.max_questions:
+            return JSONResponse({"type": "error", "message": f"A batch can have at most {BatchConfig.max_questions} questions"}, status_code=400)
+        execute = (form.get('execute') or 'false').lower() == 'true'
+        try:
+            concurrency = min(BatchConfig.concurrency, int(form.get('concurrency') or BatchConfig.concurrency))
+        except ValueError:
+            concurrency = BatchConfig.concurrency
+        try:
+            dataset_entry = await find_dataset(form)
+        except DatasetNotFoundError as dnf:
+            return JSONResponse({"type": "error", "message": str(dnf)}, status_code=404)
+        except Exception:
+            logging.error("Error registering dataset", exc_info=True)
+            return JSONResponse({"type": "error", "message": "Failed to extract schema from the dataset. Please ensure your file is in the correct format with the expected columns."}, status_code=400)
+    options = api.question_options(dataset_entry)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def stream():
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(answer_question(i, q, options, execute, semaphore)) for i, q in enumerate(questions)]
+        errors = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                errors += "error" in item
+                yield json.dumps(item, default=str) + "\n"
+            yield json.dumps({"done": True, "questions": len(questions), "errors": errors,
+                              "elapsedSeconds": round(time.perf_counter() - start, 3)}) + "\n"
+        finally:
+            #the client went away part way through, don't keep paying for the questions nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def cache_stats(request):
+    #the flask /api/cache-stats with the calls coalesced by the async client counted too
+    result_cache = async_model_client.result_cache.stats() if async_model_client.result_cache is not None else None
+    if async_model_client.response_cache is None:
+        return JSONResponse({"enabled": False, "resultCache": result_cache})
+    stats = await asyncio.to_thread(async_model_client.response_cache.stats)
+    return JSONResponse({"enabled": True, **stats, "coalesced": api.model_client.inflight.shared + async_model_client.inflight.shared,
+                         "resultCache": result_cache})
+
+ASYNC_ROUTES = [
+    Route('/api/generate-query', generate_query, methods=['POST']),
+    Route('/api/generate-query-stream', generate_query_stream, methods=['POST']),
+    Route('/api/generate-batch', generate_batch, methods=['POST']),
+    Route('/api/cache-stats', cache_stats, methods=['GET']),
+]
+
+#the flask routes get their cors headers from flask-cors, the async ones from starlette
+async_api = CORSMiddleware(Starlette(routes=ASYNC_ROUTES), allow_origins=api.CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"])
+
+app = Starlette(routes=[
+    *(Route(route.path, async_api) for route in ASYNC_ROUTES),
+    Mount('/', app=WSGIMiddleware(api.app, workers=ServerConfig.wsgi_workers)),
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=ServerConfig.host, port=ServerConfig.port)
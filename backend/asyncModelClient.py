@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+from ModelClient import ModelClient
+from singleFlight import AsyncSingleFlight
+from modelResilience import ModelUnavailableError
+from config import CoalesceConfig
+
+class AsyncModelClient(ModelClient):
+    """
+    ModelClient for the asgi app, the model call goes through the async OpenAI client so one process can wait on
+    hundreds of completions at once, the blocking parts (reading the schema, the caches, mysql) run in worker threads
+    it can share the schema provider and caches of a ModelClient so both clients answer from the same caches
+    parameters:
+    client: an AsyncOpenAI client
+    model: name of fine-tuned model
+    everything else is the same as ModelClient
+    """
+    def __init__(self, client, model, **kwargs):
+        super().__init__(client, model, **kwargs)
+        #identical questions in flight at the same time share one model call (per event loop)
+        self.inflight = AsyncSingleFlight()
+
+    async def query(self, dataset, user_question, max_tokens=150, temperature=0.0, stop=None, filename=None, schema=None, database=None, samples=None):
+        #same as ModelClient.query but awaitable
+        cached, prompt = await asyncio.to_thread(
+            self.prepare_query, dataset, user_question, filename=filename, schema=schema, database=database, samples=samples
+        )
+        if cached is not None:
+            return cached
+        if not CoalesceConfig.enabled:
+            return await self.complete_query_async(prompt)
+        result, _ = await self.inflight.do(prompt["key"], lambda: self.complete_query_async(prompt))
+        return dict(result)
+
+    async def other_worker_answer_async(self, key):
+        #ModelClient.other_worker_answer without holding a thread while waiting
+        if not CoalesceConfig.cross_worker or self.response_cache is None:
+            return None
+        if await asyncio.to_thread(self.response_cache.acquire_lease, key, CoalesceConfig.lease_seconds):
+            return None
+        deadline = time.monotonic() + min(CoalesceConfig.lease_seconds, self.caller.deadline)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(CoalesceConfig.poll_interval)
+            cached = await asyncio.to_thread(self.response_cache.get, key, False)
+            if cached is not None:
+                return cached
+            if await asyncio.to_thread(self.response_cache.acquire_lease, key, CoalesceConfig.lease_seconds):
+                return None
+        return None
+
+    async def complete_query_async(self, prompt):
+        #ModelClient.complete_query with the async OpenAI client
+        answer = await self.other_worker_answer_async(prompt["key"])
+        if answer is not None:
+            return answer
+        try:
+            try:
+                response_text = await self.ask_model_async(self.model, prompt)
+            except ModelUnavailableError as e:
+                return await asyncio.to_thread(self.stale_answer, prompt["key"], e)
+            return await self.finish_cascade_async(prompt, response_text)
+        finally:
+            if CoalesceConfig.cross_worker and self.response_cache is not None:
+                await asyncio.to_thread(self.response_cache.release_lease, prompt["key"])
+
+    async def ask_model_async(self, model, prompt):
+        #ModelClient.ask_model with the async OpenAI client
+        start = time.monotonic()
+        completion = await self.caller.call_async(lambda timeout: self.client.chat.completions.create(
+            model=model,
+            messages=prompt["messages"],
+            timeout=timeout,
+        ))
+        self.cascade.record_call(model, time.monotonic() - start)
+        return completion.choices[0].message.content.strip()
+
+    async def finish_cascade_async(self, prompt, response_text):
+        #repair the fast model's answer and keep it, or replace it with the escalation model's, then finish the query
+        response_text = self.repair_answer(prompt, response_text)
+        reason = self.check_escalation(prompt, response_text)
+        if reason is not None:
+            try:
+                escalated_text = self.repair_answer(prompt, await self.ask_model_async(self.escalation_model, prompt))
+                return await asyncio.to_thread(
+                    self.finish_query, prompt, escalated_text, {"model": self.escalation_model, "reason": reason}
+                )
+            except ModelUnavailableError:
+                logging.error("Escalation model unavailable, keeping the first answer", exc_info=True)
+        return await asyncio.to_thread(self.finish_query, prompt, response_text)
+
+    async def query_stream(self, dataset, user_question, filename=None, schema=None, database=None, samples=None):
+        """
+        Same as query but hands out the answer while the model is still writing it
+        yields ("token", text) for each piece of the answer as it arrives and then one ("result", response dictionary),
+        whether it is SQL or a clarifying question is only decided on the complete text, a cached answer is just the result
+        """
+        cached, prompt = await asyncio.to_thread(
+            self.prepare_query, dataset, user_question, filename=filename, schema=schema, database=database, samples=samples
+        )
+        if cached is not None:
+            yield ("result", cached)
+            return
+        #the same question is already being answered without streaming, wait for that instead of a second call
+        running = self.inflight.calls.get(prompt["key"])
+        if running is not None:
+            self.inflight.shared += 1
+            yield ("result", dict(await asyncio.shield(running)))
+            return
+        #a stream isn't hedged, only opening it goes through the deadline, retries and breaker
+        start = time.monotonic()
+        try:
+            stream = await self.caller.call_async(lambda timeout: self.client.chat.completions.create(
+                model=self.model,
+                messages=prompt["messages"],
+                stream=True,
+                timeout=timeout,
+            ), hedge=False)
+        except ModelUnavailableError as e:
+            yield ("result", await asyncio.to_thread(self.stale_answer, prompt["key"], e))
+            return
+        pieces = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                pieces.append(text)
+                yield ("token", text)
+        self.cascade.record_call(self.model, time.monotonic() - start)
+        #an answer that fails validation is replaced by the escalation model's, which comes as the result without tokens
+        yield ("result", await self.finish_cascade_async(prompt, "".join(pieces).strip()))
+
+    async def run_query_async(self, sql_query, confirmed=False):
+        #mysql-connector is blocking, so the query runs in a worker thread and the event loop stays free
+        return await asyncio.to_thread(self.run_query, sql_query, confirmed)
+
+    async def run_query_result_async(self, sql_query, confirmed=False):
+        #run_query_result in a worker thread, the rows and whether they were cut off at the row cap
+        return await asyncio.to_thread(self.run_query_result, sql_query, confirmed)
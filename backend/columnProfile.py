@@ -0,0 +1,166 @@
+import json
+import numpy as np
+import pandas as pd
+
+#smallest hashes kept per column for the distinct count estimate (k minimum values sketch)
+SKETCH_SIZE = 256
+#counters kept per column for the frequent values (Misra-Gries summary), the top few of them are reported
+HEAVY_HITTERS = 64
+TOP_VALUES = 5
+#distinct example values kept per column, in the order they first appear
+SAMPLE_VALUES = 3
+#rows gathered before a table's profiles are updated, pandas has a fixed cost per call so bigger batches are much cheaper per row
+PROFILE_BATCH_ROWS = 20000
+_HASH_SPACE = float(2 ** 64)
+
+def _native(value):
+    #numpy scalars to plain python so the profile can go straight into json
+    return value.item() if isinstance(value, np.generic) else value
+
+def _hashable(value):
+    #nested objects and lists can't be counted as they are, their json text is used instead
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+class ColumnProfile:
+    """
+    Running statistics of one column, updated a chunk at a time with pandas so the work per row stays in C
+    the distinct count is exact up to SKETCH_SIZE values and an estimate after that,
+    the top values are the Misra-Gries counters so their counts are lower bounds
+    """
+    def __init__(self, rows_before=0):
+        #a column that first shows up part way through a table was missing (null) in the rows before it
+        self.count = rows_before
+        self.nulls = rows_before
+        self.min = None
+        self.max = None
+        self.sketch = np.array([], dtype=np.uint64)
+        self.counters = pd.Series(dtype="int64")
+        self.samples = []
+
+    def update(self, series):
+        self.count += len(series)
+        #with the nulls gone a column of numbers gets a numeric dtype back, which pandas counts and hashes far faster
+        present = series.dropna().infer_objects()
+        self.nulls += len(series) - len(present)
+        if present.empty:
+            return
+        try:
+            counts = present.value_counts(sort=False)
+            hashes = pd.util.hash_array(counts.index.to_numpy())
+        except TypeError:
+            present = present.map(_hashable)
+            counts = present.value_counts(sort=False)
+            hashes = pd.util.hash_array(counts.index.to_numpy())
+        values = counts.index
+        #distinct values, keep the smallest hashes seen so far
+        self.sketch = np.unique(np.concatenate([self.sketch, hashes]))[:SKETCH_SIZE]
+        #frequent values, merge the chunk's counts in and trim back to HEAVY_HITTERS counters
+        counters = self.counters.add(counts, fill_value=0) if len(self.counters) else counts.astype("int64")
+        if len(counters) > HEAVY_HITTERS:
+            threshold = np.partition(counters.to_numpy(), -(HEAVY_HITTERS + 1))[-(HEAVY_HITTERS + 1)]
+            counters = counters[counters > threshold] - threshold
+        self.counters = counters
+        self._update_range(values)
+        if len(self.samples) < SAMPLE_VALUES:
+            for value in present.unique().tolist():
+                if value not in self.samples:
+                    self.samples.append(_native(value))
+                    if len(self.samples) >= SAMPLE_VALUES:
+                        break
+
+    def _update_range(self, values):
+        #min and max in the column's own ordering, columns that mix types fall back to comparing them as text
+        try:
+            low, high = values.min(), values.max()
+            if self.min is not None:
+                low, high = min(low, self.min), max(high, self.max)
+        except TypeError:
+            candidates = list(values) + [v for v in (self.min, self.max) if v is not None]
+            low, high = min(candidates, key=str), max(candidates, key=str)
+        self.min, self.max = _native(low), _native(high)
+
+    def distinct(self):
+        #exact while the sketch isn't full, otherwise the usual (k - 1) / kth smallest hash estimate
+        if len(self.sketch) < SKETCH_SIZE:
+            return len(self.sketch), True
+        kth = float(self.sketch[-1]) / _HASH_SPACE
+        return int(round((SKETCH_SIZE - 1) / kth)), False
+
+    def to_dict(self):
+        distinct, exact = self.distinct()
+        top = self.counters.sort_values(ascending=False, kind="stable").head(TOP_VALUES)
+        return {
+            "count": self.count,
+            "nulls": self.nulls,
+            "nullRatio": round(self.nulls / self.count, 4) if self.count else 0.0,
+            "distinct": distinct,
+            "distinctExact": exact,
+            "min": self.min,
+            "max": self.max,
+            "topValues": [{"value": _native(value), "count": int(count)} for value, count in top.items()],
+            "samples": list(self.samples)
+        }
+
+class DatasetProfiler:
+    """
+    Column profiles for every table of a dataset, built in the same pass that reads the rows
+    (during ingestion or registration) so the preview and the prompt builder never need the file again
+    """
+    def __init__(self):
+        self.tables = {}
+        self.row_counts = {}
+        self.pending = {}
+
+    def observe_frame(self, table_name, frame):
+        #update the table's profiles with one chunk of rows as a DataFrame
+        columns = self.tables.setdefault(table_name, {})
+        rows_before = self.row_counts.get(table_name, 0)
+        for col in frame.columns:
+            if col not in columns:
+                columns[col] = ColumnProfile(rows_before)
+            columns[col].update(frame[col])
+        #columns this chunk didn't have at all count as null for its rows
+        for col, profile in columns.items():
+            if col not in frame.columns:
+                profile.count += len(frame)
+                profile.nulls += len(frame)
+        self.row_counts[table_name] = rows_before + len(frame)
+
+    def observe_rows(self, table_name, rows):
+        #same for a chunk of row dictionaries, held back until there are PROFILE_BATCH_ROWS of them
+        if not rows:
+            return
+        pending = self.pending.setdefault(table_name, [])
+        pending.extend(rows)
+        if len(pending) >= PROFILE_BATCH_ROWS:
+            self._flush(table_name)
+
+    def _flush(self, table_name):
+        #object dtype so ints with gaps don't turn into floats
+        rows = self.pending.pop(table_name, None)
+        if rows:
+            self.observe_frame(table_name, pd.DataFrame(rows, dtype=object))
+
+    def to_dict(self):
+        for table_name in list(self.pending):
+            self._flush(table_name)
+        return {table: {col: profile.to_dict() for col, profile in columns.items()} for table, columns in self.tables.items()}
+
+def preview_from_profile(profile):
+    #the schema preview format, a few example values per column of each table
+    return {table: {col: stats["samples"] for col, stats in columns.items()} for table, columns in profile.items()}
+
+def prompt_values(profile):
+    """
+    Values worth matching a question against for each column, the most frequent ones first and then the samples,
+    in the same table to column to values shape the schema pruning index takes
+    """
+    values = {}
+    for table, columns in profile.items():
+        values[table] = {}
+        for col, stats in columns.items():
+            seen = [top["value"] for top in stats["topValues"]]
+            values[table][col] = seen + [value for value in stats["samples"] if value not in seen]
+    return values
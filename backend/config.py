@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,3 +31,136 @@ class MySQLConfig:
             cls.password = password
         if database is not None:
             cls.database = database
+
+#settings for loading uploaded datasets into mysql, pulled from env so they can be tuned per deployment
+class IngestConfig:
+    batch_size = int(os.getenv("INGEST_BATCH_SIZE", "1000")) #rows sent per multi row insert
+    commit_interval = int(os.getenv("INGEST_COMMIT_INTERVAL", "0")) #rows between commits, 0 means commit once at the end
+    mode = os.getenv("INGEST_MODE", "insert") #"insert" for batched inserts, "infile" for LOAD DATA LOCAL INFILE
+    workers = int(os.getenv("INGEST_WORKERS", "4")) #tables loaded at the same time, each worker has its own connection
+    job_workers = int(os.getenv("INGEST_JOB_WORKERS", "2")) #uploads that can run in the background at the same time
+    job_history = int(os.getenv("INGEST_JOB_HISTORY", "100")) #finished jobs kept around for polling
+    profile_rows = int(os.getenv("INGEST_PROFILE_ROWS", "10000")) #rows per table sampled to pick the column types
+    auto_index = os.getenv("INGEST_AUTO_INDEX", "true").lower() == "true" #add primary keys and id column indexes after loading
+
+    @classmethod
+    def get_config(cls):
+        return {
+            "batch_size": cls.batch_size,
+            "commit_interval": cls.commit_interval,
+            "mode": cls.mode,
+            "workers": cls.workers,
+            "job_workers": cls.job_workers,
+            "job_history": cls.job_history,
+            "profile_rows": cls.profile_rows,
+            "auto_index": cls.auto_index
+        }
+
+#where registered datasets (schema, preview and stats, keyed by the hash of the file) are kept between restarts
+class RegistryConfig:
+    directory = os.getenv("DATASET_REGISTRY_DIR", os.path.join(tempfile.gettempdir(), "nl2sql_registry"))
+    memory_entries = int(os.getenv("DATASET_REGISTRY_MEMORY_ENTRIES", "256")) #most entries held in memory, the rest are read back from the directory
+
+#how long a schema snapshot read from INFORMATION_SCHEMA is trusted, 0 means until the app itself changes the schema
+class SchemaConfig:
+    ttl = int(os.getenv("SCHEMA_CACHE_TTL", "0"))
+    #a database with no tables or a server that couldn't be reached is asked again after this long, ttl=0 would never ask again
+    missing_ttl = float(os.getenv("SCHEMA_CACHE_MISSING_TTL", "30"))
+
+#schema pruning, only the tables relevant to the question (and the tables they join to) go in the prompt once the schema is bigger than the budget
+class PruningConfig:
+    enabled = os.getenv("SCHEMA_PRUNE_ENABLED", "true").lower() == "true"
+    top_k = int(os.getenv("SCHEMA_PRUNE_TOP_K", "5")) #best matching tables kept before their join neighbours are added
+    token_budget = int(os.getenv("SCHEMA_PRUNE_TOKEN_BUDGET", "1500")) #rough prompt tokens the schema part may use
+    index_cache_size = int(os.getenv("SCHEMA_PRUNE_INDEX_CACHE", "32")) #datasets whose relevance index is kept in memory
+
+#cache of model responses keyed by model, schema fingerprint and normalised question, memory LRU in front of a SQLite file
+class ResponseCacheConfig:
+    enabled = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    path = os.getenv("RESPONSE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "nl2sql_cache", "responses.sqlite3")) #empty for memory only
+    ttl = int(os.getenv("RESPONSE_CACHE_TTL", "86400")) #seconds an answer is reused for, 0 means forever
+    memory_entries = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+    disk_entries = int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES", "100000"))
+
+#near duplicate questions, a rephrased question on the same schema reuses the earlier answer when it is similar enough
+class SimilarityCacheConfig:
+    enabled = os.getenv("SIMILARITY_CACHE_ENABLED", "true").lower() == "true"
+    threshold = float(os.getenv("SIMILARITY_CACHE_THRESHOLD", "0.8")) #cosine similarity of the two questions, 0 to 1
+    max_questions = int(os.getenv("SIMILARITY_CACHE_MAX_QUESTIONS", "1000")) #answered questions kept per schema
+    max_schemas = int(os.getenv("SIMILARITY_CACHE_MAX_SCHEMAS", "64"))
+
+#sql templates, questions that only differ in their literals reuse the parameterised SQL of an earlier answer
+class TemplateCacheConfig:
+    enabled = os.getenv("TEMPLATE_CACHE_ENABLED", "true").lower() == "true"
+    max_templates = int(os.getenv("TEMPLATE_CACHE_MAX_TEMPLATES", "5000"))
+
+#the asgi server (asgi.py), async routes run on the event loop and the rest of the flask api on a thread pool
+class ServerConfig:
+    host = os.getenv("SERVER_HOST", "0.0.0.0")
+    port = int(os.getenv("SERVER_PORT", "5001"))
+    wsgi_workers = int(os.getenv("WSGI_WORKERS", "32")) #threads for the flask routes that aren't async
+
+#/api/generate-batch, questions answered at the same time per batch and the most one batch can hold
+class BatchConfig:
+    concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    max_questions = int(os.getenv("BATCH_MAX_QUESTIONS", "200"))
+
+#identical questions asked at the same time share one model call, within a process and optionally across worker processes
+class CoalesceConfig:
+    enabled = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+    cross_worker = os.getenv("COALESCE_CROSS_WORKER", "false").lower() == "true" #uses the response cache's SQLite file
+    lease_seconds = float(os.getenv("COALESCE_LEASE_SECONDS", "30")) #how long other workers wait before asking the model themselves
+    poll_interval = float(os.getenv("COALESCE_POLL_INTERVAL", "0.05")) #how often a waiting worker checks the cache
+
+#protecting the model call, every question has a deadline, retryable failures are retried with jittered backoff,
+#a slow call can be hedged with a second one and a circuit breaker stops calling a provider that keeps failing
+class ResilienceConfig:
+    deadline_seconds = float(os.getenv("MODEL_DEADLINE_SECONDS", "20")) #total time for one question, retries included
+    retries = int(os.getenv("MODEL_RETRIES", "2"))
+    backoff_base = float(os.getenv("MODEL_BACKOFF_BASE", "0.25")) #seconds, doubled every retry and jittered
+    backoff_cap = float(os.getenv("MODEL_BACKOFF_CAP", "4"))
+    hedge = os.getenv("MODEL_HEDGE_ENABLED", "false").lower() == "true"
+    hedge_after = float(os.getenv("MODEL_HEDGE_AFTER", "3")) #seconds before hedging until there are enough latencies for a p95
+    hedge_min_samples = int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "20"))
+    hedge_workers = int(os.getenv("MODEL_HEDGE_WORKERS", "16")) #threads for hedged calls from the blocking client
+    latency_window = int(os.getenv("MODEL_LATENCY_WINDOW", "500")) #recent calls the percentiles are taken over
+    breaker_failures = int(os.getenv("MODEL_BREAKER_FAILURES", "5")) #failures in a row that open the breaker
+    breaker_reset_seconds = float(os.getenv("MODEL_BREAKER_RESET_SECONDS", "30")) #how long it stays open before a trial call
+    stale_fallback = os.getenv("MODEL_STALE_FALLBACK", "true").lower() == "true" #answer from an expired cache entry when the model is unavailable
+
+#model cascade, the fine-tuned model answers first and its answer goes to the stronger model only when it fails
+#validation against the schema or is a clarifying question
+class CascadeConfig:
+    enabled = os.getenv("CASCADE_ENABLED", "true").lower() == "true"
+    escalation_model = os.getenv("CASCADE_ESCALATION_MODEL", "o3-mini-2025-01-31")
+
+#pooled mysql connections for running queries and creating / dropping databases, one pool per host, user and database
+class PoolConfig:
+    size = int(os.getenv("MYSQL_POOL_SIZE", "8")) #most connections a pool has open at once
+    idle_seconds = float(os.getenv("MYSQL_POOL_IDLE_SECONDS", "300")) #unused connections are closed after this long
+    wait_seconds = float(os.getenv("MYSQL_POOL_WAIT_SECONDS", "10")) #how long a request waits for a busy pool
+    ping_after = float(os.getenv("MYSQL_POOL_PING_AFTER", "5")) #a connection idle longer than this is pinged before reuse
+
+#query results, a plain /api/execute-query holds the whole result in memory so it is capped,
+#streamed results are read in batches and paged results a page at a time
+class ResultConfig:
+    max_rows = int(os.getenv("RESULT_MAX_ROWS", "100000")) #hard cap on the rows one query returns, streamed or not
+    batch_size = int(os.getenv("RESULT_BATCH_SIZE", "1000")) #rows per fetchmany when streaming
+    page_size = int(os.getenv("RESULT_PAGE_SIZE", "500"))
+    max_page_size = int(os.getenv("RESULT_MAX_PAGE_SIZE", "10000"))
+
+#rows of SELECTs already run, reused until the database they ran against changes
+class ResultCacheConfig:
+    enabled = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    ttl = float(os.getenv("RESULT_CACHE_TTL", "300")) #seconds, bounds how stale a result changed outside this process can get
+    max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "512"))
+    max_rows = int(os.getenv("RESULT_CACHE_MAX_ROWS", "200000")) #rows held across all the cached results
+    max_entry_rows = int(os.getenv("RESULT_CACHE_MAX_ENTRY_ROWS", "10000")) #bigger results aren't cached
+
+#time budget of a query sent to mysql, SELECTs carry a MAX_EXECUTION_TIME hint and anything still running
+#once its budget (plus the grace for SELECTs, whose hint should have stopped them) is up gets a KILL QUERY from the watchdog
+class QueryTimeoutConfig:
+    timeout_seconds = float(os.getenv("QUERY_TIMEOUT_SECONDS", "30")) #budget of a query that doesn't ask for one
+    max_timeout_seconds = float(os.getenv("QUERY_MAX_TIMEOUT_SECONDS", "300")) #most a request's timeoutSeconds can ask for
+    grace_seconds = float(os.getenv("QUERY_TIMEOUT_GRACE_SECONDS", "2"))
+    kill_connect_seconds = float(os.getenv("QUERY_KILL_CONNECT_SECONDS", "5")) #connecting to send KILL QUERY gives up after this
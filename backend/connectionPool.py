@@ -0,0 +1,223 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+import mysql.connector
+from mysql.connector import errors
+from config import PoolConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+#errors that mean the connection itself is no good any more (server gone away, lost connection), it isn't given back
+_BROKEN_CONNECTION_ERRORS = (errors.InterfaceError, errors.OperationalError)
+
+class ConnectionUnavailableError(errors.PoolError):
+    #Raised when no connection could be had, the server refused it or every one was busy for the whole wait.
+    pass
+
+class ConnectionPool:
+    """
+    Reusable connections to one server / user / database so a query doesn't pay for a new TCP and auth handshake
+    connections are handed out most recently used first so the spare ones sit idle and get closed,
+    one that has been idle for a while is pinged before it is handed out
+    the connections are autocommit, a reused connection never carries an old transaction or read snapshot,
+    (commit() still works, it just has nothing left to do)
+    parameters:
+    connect_args: the mysql.connector.connect arguments
+    size: most connections open at once, a caller waits for one to come back after that
+    idle_seconds: how long an unused connection is kept open
+    wait_seconds: how long a caller waits for a connection before giving up
+    ping_after: seconds idle after which a connection is checked before it is handed out
+    """
+    def __init__(self, connect_args, size=None, idle_seconds=None, wait_seconds=None, ping_after=None):
+        self.connect_args = dict(connect_args)
+        self.size = PoolConfig.size if size is None else size
+        self.idle_seconds = PoolConfig.idle_seconds if idle_seconds is None else idle_seconds
+        self.wait_seconds = PoolConfig.wait_seconds if wait_seconds is None else wait_seconds
+        self.ping_after = PoolConfig.ping_after if ping_after is None else ping_after
+        self.idle = deque() #(connection, when it was given back), most recent on the right
+        self.open = 0
+        self.closed = False
+        self.available = threading.Condition()
+        self.counters = {"checkouts": 0, "created": 0, "reused": 0, "healthCheckFailures": 0, "evictedIdle": 0,
+                         "discarded": 0, "waits": 0, "waitTimeouts": 0, "waitSeconds": 0.0, "maxWaitSeconds": 0.0}
+
+    def _evict_idle(self, now):
+        #close the connections nobody has used for idle_seconds, caller holds the lock
+        expired = []
+        while self.idle and now - self.idle[0][1] >= self.idle_seconds:
+            expired.append(self.idle.popleft()[0])
+        self.open -= len(expired)
+        self.counters["evictedIdle"] += len(expired)
+        return expired
+
+    def _close(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def acquire(self):
+        """
+        Check a connection out, reusing an idle one when there is one
+        returns the connection, raises ConnectionUnavailableError if none can be had
+        """
+        start = time.monotonic()
+        waited = False
+        while True:
+            with self.available:
+                expired = self._evict_idle(time.monotonic())
+                candidate = None
+                create = False
+                while candidate is None:
+                    if self.idle:
+                        candidate, returned = self.idle.pop()
+                    elif self.open < self.size:
+                        self.open += 1
+                        create = True
+                        break
+                    else:
+                        remaining = self.wait_seconds - (time.monotonic() - start)
+                        if remaining <= 0:
+                            self.counters["waitTimeouts"] += 1
+                            self._close(expired)
+                            raise ConnectionUnavailableError(f"All {self.size} connections are busy")
+                        if not waited:
+                            waited = True
+                            self.counters["waits"] += 1
+                        self.available.wait(remaining)
+                        expired += self._evict_idle(time.monotonic())
+                self.counters["checkouts"] += 1
+                if waited:
+                    wait = time.monotonic() - start
+                    self.counters["waitSeconds"] += wait
+                    self.counters["maxWaitSeconds"] = max(self.counters["maxWaitSeconds"], wait)
+            self._close(expired)
+            if create:
+                return self._connect()
+            if time.monotonic() - returned < self.ping_after or self._healthy(candidate):
+                with self.available:
+                    self.counters["reused"] += 1
+                return candidate
+            #it went bad while it was idle, drop it and try again
+            self._forget(candidate, "healthCheckFailures")
+
+    def _connect(self):
+        try:
+            conn = mysql.connector.connect(**self.connect_args)
+            conn.autocommit = True
+        except mysql.connector.Error as err:
+            with self.available:
+                self.open -= 1
+                self.available.notify()
+            raise ConnectionUnavailableError(f"Could not connect to MySQL: {err}") from err
+        with self.available:
+            self.counters["created"] += 1
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def _forget(self, conn, counter):
+        #a checked out connection that won't be coming back
+        self._close([conn])
+        with self.available:
+            self.open -= 1
+            self.counters[counter] += 1
+            self.available.notify()
+
+    def release(self, conn, broken=False):
+        #give a connection back, a broken one (or any once the pool is closed) is closed instead
+        if broken or self.closed:
+            self._forget(conn, "discarded")
+            return
+        try:
+            if conn.unread_result:
+                #a result set nobody finished reading would get in the way of the next query
+                self._forget(conn, "discarded")
+                return
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            self._forget(conn, "discarded")
+            return
+        with self.available:
+            self.idle.append((conn, time.monotonic()))
+            self.available.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for a with block, it goes back to the pool afterwards
+        (or is closed if the block failed with an error that means the connection is broken)
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except _BROKEN_CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def close(self):
+        #close the idle connections, the ones checked out are closed when they come back
+        with self.available:
+            self.closed = True
+            idle = [conn for conn, _ in self.idle]
+            self.idle.clear()
+            self.open -= len(idle)
+        self._close(idle)
+
+    def stats(self):
+        with self.available:
+            stats = dict(self.counters)
+            stats["open"] = self.open
+            stats["idle"] = len(self.idle)
+            stats["inUse"] = self.open - len(self.idle)
+            stats["size"] = self.size
+        stats["waitSeconds"] = round(stats["waitSeconds"], 4)
+        stats["maxWaitSeconds"] = round(stats["maxWaitSeconds"], 4)
+        return stats
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def connection_pool(host, user, password, database=None):
+    """
+    The pool for a (host, user, database), created the first time it is asked for,
+    a different password for the same key (the credentials were changed) replaces the old pool
+    returns the ConnectionPool
+    """
+    key = (host, user, database)
+    connect_args = {"host": host, "user": user, "password": password}
+    if database:
+        connect_args["database"] = database
+    with _pools_lock:
+        old = _pools.get(key)
+        if old is not None and old.connect_args["password"] == password:
+            return old
+        pool = _pools[key] = ConnectionPool(connect_args)
+    if old is not None:
+        old.close()
+    return pool
+
+def close_pool(host, user, database=None):
+    #close and forget the pool of a database that has been dropped
+    with _pools_lock:
+        pool = _pools.pop((host, user, database), None)
+    if pool is not None:
+        pool.close()
+
+def pool_stats():
+    #stats of every pool, for /api/pool-stats
+    with _pools_lock:
+        pools = list(_pools.items())
+    return [{"host": host, "user": user, "database": database, **pool.stats()} for (host, user, database), pool in pools]
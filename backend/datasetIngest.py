@@ -0,0 +1,560 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
+from itertools import chain, islice
+import pandas as pd
+import mysql.connector
+from config import IngestConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+#used if the server won't tell us its max_allowed_packet, this is the mysql 8 default
+DEFAULT_MAX_ALLOWED_PACKET = 64 * 1024 * 1024
+#only fill part of the packet so the statement text and protocol overhead still fit
+PACKET_FILL_RATIO = 0.75
+
+INGEST_MODES = ("insert", "infile")
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+_DATE_PATTERN = r"\d{4}-\d{2}-\d{2}"
+_DATETIME_PATTERN = r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?"
+_ID_PATTERN = re.compile(r"(^id$|_id$|[a-z]Id$|ID$)")
+#the temporary tsv files live here and the connection only allows LOAD DATA LOCAL from this directory
+INFILE_DIR = tempfile.gettempdir()
+#errors meaning the server or the client refuses LOAD DATA LOCAL INFILE, in which case the insert path is used instead
+#1148 ER_NOT_ALLOWED_COMMAND, 2068 CR_LOAD_DATA_LOCAL_INFILE_REJECTED, 3948 ER_CLIENT_LOCAL_FILES_DISABLED
+INFILE_DISALLOWED_ERRORS = {1148, 2068, 3948}
+#characters that have to be escaped in the tsv so mysql reads them back as data
+_INFILE_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+_INFILE_UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "0": "\0"}
+
+def infer_column_type(values):
+    """
+    Work out the mysql column type for a column from a sample of its values, using pandas so the checks run
+    over the whole sample at once instead of value by value
+    parameters:
+    values: pandas Series of the column's sample values with the nulls already dropped
+
+    returns the mysql type as a string
+    """
+    if values.empty:
+        return "VARCHAR(255)"
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == "boolean":
+        return "TINYINT(1)"
+    if kind == "integer":
+        try:
+            numbers = values.astype("int64")
+        except OverflowError:
+            return "DECIMAL(65,0)" #too big even for BIGINT
+        if numbers.min() >= INT_MIN and numbers.max() <= INT_MAX:
+            return "INT"
+        return "BIGINT"
+    if kind in ("floating", "mixed-integer-float", "decimal"):
+        return "DOUBLE"
+    if kind == "string":
+        lengths = values.str.len()
+        #only strings that look exactly like iso dates become DATE / DATETIME, and they have to be real dates too
+        if values.str.fullmatch(_DATE_PATTERN).all():
+            if pd.to_datetime(values, format="%Y-%m-%d", errors="coerce").notna().all():
+                return "DATE"
+        elif values.str.fullmatch(_DATETIME_PATTERN).all():
+            if pd.to_datetime(values, format="ISO8601", errors="coerce").notna().all():
+                return "DATETIME"
+        if lengths.max() <= 255:
+            return "VARCHAR(255)"
+        return "TEXT"
+    return "TEXT"
+
+def is_id_like(column_name):
+    #columns named id, something_id or somethingId are the ones joins and lookups go through
+    return bool(_ID_PATTERN.search(column_name))
+
+def profile_sample(columns, sample, complete):
+    """
+    Profile a sample of a table's rows to decide the column types, nullability and which columns to index
+    parameters:
+    columns: ordered list of the table's column names
+    sample: list of row dictionaries from the start of the table
+    complete: True if the sample is the whole table, only then can a column be declared NOT NULL
+
+    returns a dictionary of column name to {"type", "nullable", "unique", "id_like"}
+    """
+    #object dtype keeps ints as ints when the column also has nulls, otherwise pandas turns them into floats
+    frame = pd.DataFrame(sample, columns=columns, dtype=object)
+    profile = {}
+    for col in columns:
+        series = frame[col]
+        values = series.dropna()
+        profile[col] = {
+            "type": infer_column_type(values),
+            "nullable": not complete or len(values) < len(series),
+            "unique": len(values) == len(series) and values.astype(str).is_unique,
+            "id_like": is_id_like(col)
+        }
+    return profile
+
+def build_create_table_query(table_name, profile):
+    """
+    Build the CREATE TABLE statement for a table from its sample profile
+    parameters:
+    table_name: name of the table in the dataset
+    profile: column profile from profile_sample
+
+    returns the CREATE TABLE query string
+    """
+    columns_definitions = []
+    for col, info in profile.items():
+        null_sql = "" if info["nullable"] else " NOT NULL"
+        columns_definitions.append(f"`{col}` {info['type']}{null_sql}")
+    columns_sql = ", ".join(columns_definitions)
+    return f"CREATE TABLE IF NOT EXISTS `{table_name}` ({columns_sql});"
+
+def choose_indexes(table_name, profile):
+    """
+    Pick the primary key and the secondary indexes for a loaded table
+    the primary key is an id like column that was unique and never null in the sample, preferring id or <table>_id,
+    every other id like column looks like a foreign key and gets a normal index so joins and lookups on it can use it
+    returns (primary key column or None, list of columns to index)
+    """
+    indexable = [col for col, info in profile.items() if info["id_like"] and info["type"] != "TEXT"]
+    candidates = [col for col in indexable if profile[col]["unique"]]
+    preferred = {"id", f"{table_name}_id".lower(), f"{table_name.rstrip('s')}_id".lower()}
+    candidates.sort(key=lambda col: col.lower() not in preferred)
+    primary_key = candidates[0] if candidates else None
+    return primary_key, [col for col in indexable if col != primary_key]
+
+def add_indexes(cursor, table_name, profile):
+    """
+    Add the primary key and foreign key like indexes once a table is loaded, building them after the load is much
+    quicker than keeping them up to date row by row
+    everything goes in one ALTER so the table is only rebuilt once, if the primary key turns out not to be unique
+    across the whole table it is left out and only the secondary indexes are added
+    returns the list of index descriptions that were created
+    """
+    primary_key, secondary = choose_indexes(table_name, profile)
+    index_parts = [f"ADD INDEX `idx_{col}` (`{col}`)" for col in secondary]
+    attempts = []
+    if primary_key:
+        attempts.append([f"ADD PRIMARY KEY (`{primary_key}`)"] + index_parts)
+    attempts.append(index_parts)
+    for parts in attempts:
+        if not parts:
+            continue
+        try:
+            cursor.execute(f"ALTER TABLE `{table_name}` " + ", ".join(parts))
+            created = [f"PRIMARY KEY ({primary_key})"] if len(parts) > len(index_parts) else []
+            return created + [f"INDEX ({col})" for col in secondary]
+        except mysql.connector.Error:
+            logging.error(f"Could not add indexes to {table_name}", exc_info=True)
+    return []
+
+def get_max_allowed_packet(cursor):
+    #ask the server how big a single statement can be so the batches never go over it
+    try:
+        cursor.execute("SELECT @@max_allowed_packet")
+        row = cursor.fetchone()
+        return int(row[0])
+    except (mysql.connector.Error, TypeError, ValueError):
+        logging.error("Could not read max_allowed_packet, using the default", exc_info=True)
+        return DEFAULT_MAX_ALLOWED_PACKET
+
+def estimate_row_size(values):
+    #rough number of bytes a row adds to the multi row VALUES list, quotes, commas and brackets included
+    return sum(len(str(val)) + 3 for val in values) + 3
+
+def insert_rows(conn, cursor, table_name, columns, rows, batch_size=None, commit_interval=None, max_packet=None, progress=None):
+    """
+    Insert the rows of a table using parameterised multi row batches instead of one statement per row
+    the connector rewrites executemany on an INSERT ... VALUES into a single multi row statement,
+    so each batch is one round trip and the values are escaped by the driver
+    parameters:
+    conn: open MySQL connection, used for the periodic commits
+    cursor: cursor on that connection
+    table_name: table to insert into
+    columns: ordered list of column names, missing keys in a row are inserted as NULL
+    rows: iterable of row dictionaries
+    batch_size: max rows per batch (defaults to IngestConfig)
+    commit_interval: commit after this many rows, 0 means leave the commit to the caller (defaults to IngestConfig)
+    max_packet: server max_allowed_packet in bytes, batches are cut before they get close to it
+    progress: optional object with add_rows(count), told about every batch that is sent (e.g. an IngestJob)
+
+    returns the number of rows inserted
+    """
+    ingest_config = IngestConfig.get_config()
+    if batch_size is None:
+        batch_size = ingest_config["batch_size"]
+    if commit_interval is None:
+        commit_interval = ingest_config["commit_interval"]
+    if max_packet is None:
+        max_packet = DEFAULT_MAX_ALLOWED_PACKET
+    batch_size = max(1, batch_size)
+
+    columns_sql = ", ".join(f"`{col}`" for col in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    insert_query = f"INSERT INTO `{table_name}` ({columns_sql}) VALUES ({placeholders})"
+    packet_budget = int(max_packet * PACKET_FILL_RATIO) - len(insert_query)
+
+    batch = []
+    batch_bytes = 0
+    rows_inserted = 0
+    rows_since_commit = 0
+    for row in rows:
+        values = tuple(row.get(col) for col in columns)
+        row_bytes = estimate_row_size(values)
+        #send what we have if this row would make the batch too long or too big for the packet
+        if batch and (len(batch) >= batch_size or batch_bytes + row_bytes > packet_budget):
+            cursor.executemany(insert_query, batch)
+            rows_inserted += len(batch)
+            rows_since_commit += len(batch)
+            if progress is not None:
+                progress.add_rows(len(batch))
+            batch = []
+            batch_bytes = 0
+            if commit_interval and rows_since_commit >= commit_interval:
+                conn.commit()
+                rows_since_commit = 0
+        batch.append(values)
+        batch_bytes += row_bytes
+    if batch:
+        cursor.executemany(insert_query, batch)
+        rows_inserted += len(batch)
+        if progress is not None:
+            progress.add_rows(len(batch))
+    return rows_inserted
+
+def infile_connection_args(mode=None):
+    #extra mysql.connector.connect arguments needed for the chosen ingest mode
+    if (mode or IngestConfig.mode) == "infile":
+        return {"allow_local_infile_in_path": INFILE_DIR}
+    return {}
+
+def escape_infile_value(val):
+    #format one value for the tsv, NULL becomes \N and tabs, newlines and backslashes are escaped
+    if val is None:
+        return "\\N"
+    if isinstance(val, bool):
+        return "1" if val else "0"
+    return str(val).translate(_INFILE_ESCAPES)
+
+def _unescape_infile_value(field):
+    #reverse of escape_infile_value, used when the rows have to be re-sent with inserts
+    if field == "\\N":
+        return None
+    if "\\" not in field:
+        return field
+    out = []
+    chars = iter(field)
+    for char in chars:
+        if char == "\\":
+            nxt = next(chars, "")
+            out.append(_INFILE_UNESCAPES.get(nxt, nxt))
+        else:
+            out.append(char)
+    return "".join(out)
+
+def write_infile_rows(file_obj, columns, rows):
+    #write the rows as tab separated lines in the format LOAD DATA expects, returns how many rows were written
+    count = 0
+    for row in rows:
+        file_obj.write("\t".join(escape_infile_value(row.get(col)) for col in columns))
+        file_obj.write("\n")
+        count += 1
+    return count
+
+def _read_infile_rows(path, columns):
+    #read a tsv written by write_infile_rows back into row dictionaries
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            yield {col: _unescape_infile_value(field) for col, field in zip(columns, fields)}
+
+def local_infile_enabled(cursor):
+    #the server has to have local_infile switched on before the fast path is worth trying
+    try:
+        cursor.execute("SELECT @@local_infile")
+        row = cursor.fetchone()
+        return bool(row and int(row[0]))
+    except (mysql.connector.Error, TypeError, ValueError):
+        return False
+
+def load_rows_infile(conn, cursor, table_name, columns, rows, batch_size=None, commit_interval=None, max_packet=None, progress=None):
+    """
+    Load the rows of a table with LOAD DATA LOCAL INFILE, the rows are written to a temporary tsv file first
+    if the server or client refuses local infile the same rows are read back from the file and inserted with insert_rows
+    parameters:
+    conn, cursor, table_name, columns, rows: as for insert_rows
+    batch_size, commit_interval, max_packet: only used if it has to fall back to insert_rows
+    progress: optional object with add_rows(count)
+
+    returns (number of rows loaded, True if LOAD DATA was used or False if it fell back to inserts)
+    """
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".tsv",
+                                     dir=INFILE_DIR, delete=False) as tmp:
+        row_count = write_infile_rows(tmp, columns, rows)
+        path = tmp.name
+    try:
+        columns_sql = ", ".join(f"`{col}`" for col in columns)
+        load_query = (
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table_name}` CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({columns_sql})"
+        )
+        try:
+            cursor.execute(load_query, (path,))
+            if progress is not None:
+                progress.add_rows(row_count)
+            return row_count, True
+        except mysql.connector.Error as err:
+            if err.errno not in INFILE_DISALLOWED_ERRORS:
+                raise
+            logging.error("LOAD DATA LOCAL INFILE was refused, falling back to batched inserts", exc_info=True)
+        rows_inserted = insert_rows(conn, cursor, table_name, columns, _read_infile_rows(path, columns),
+                                    batch_size=batch_size, commit_interval=commit_interval, max_packet=max_packet,
+                                    progress=progress)
+        return rows_inserted, False
+    finally:
+        os.remove(path)
+
+def _table_rows(table_name, first_chunk, events):
+    #rows of one table, pulled lazily from the event stream until that table ends
+    yield from first_chunk
+    for event in events:
+        if event[0] == "rows" and event[1] == table_name:
+            yield from event[2]
+        elif event[0] == "table_end":
+            return
+
+def _load_table(conn, cursor, table_name, first_row, rows, mode, batch_size, commit_interval, max_packet, progress=None):
+    """
+    Create one table and load its rows with the chosen mode
+    the first IngestConfig.profile_rows rows are profiled to pick the column types, then the indexes are added after the load
+    returns (rows loaded, mode that was actually used, indexes created)
+    """
+    columns = list(first_row.keys())
+    rows = iter(rows)
+    sample = list(islice(rows, max(1, IngestConfig.profile_rows)))
+    #peek one row past the sample to know if the sample is actually the whole table
+    next_row = next(rows, None)
+    complete = next_row is None
+    if not complete:
+        rows = chain([next_row], rows)
+    profile = profile_sample(columns, sample, complete)
+    cursor.execute(build_create_table_query(table_name, profile))
+    rows = chain(sample, rows)
+    if mode == "infile":
+        table_count, used_infile = load_rows_infile(conn, cursor, table_name, columns, rows,
+                                                    batch_size=batch_size, commit_interval=commit_interval, max_packet=max_packet,
+                                                    progress=progress)
+        used_mode = "infile" if used_infile else "insert"
+    else:
+        table_count = insert_rows(conn, cursor, table_name, columns, rows,
+                                  batch_size=batch_size, commit_interval=commit_interval, max_packet=max_packet,
+                                  progress=progress)
+        used_mode = "insert"
+    indexes = add_indexes(cursor, table_name, profile) if IngestConfig.auto_index else []
+    if progress is not None:
+        progress.table_done(table_name)
+    return table_count, used_mode, indexes
+
+def _check_mode(mode):
+    if mode is None:
+        mode = IngestConfig.mode
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode '{mode}', expected one of {', '.join(INGEST_MODES)}")
+    return mode
+
+def _load_stats(tables_loaded, rows_loaded, mode, indexes, start):
+    elapsed = time.perf_counter() - start
+    return {
+        "tables": tables_loaded,
+        "rows": rows_loaded,
+        "mode": mode,
+        "indexes": indexes,
+        "seconds": round(elapsed, 3),
+        "rowsPerSecond": round(rows_loaded / elapsed, 1) if elapsed > 0 else None
+    }
+
+def load_dataset_events(conn, events, batch_size=None, commit_interval=None, mode=None, progress=None):
+    """
+    Create every table in the dataset and bulk insert its rows one table after another on a single connection,
+    reading them from a stream of dataset events (see datasetStream) so only one chunk of rows is held in memory at a time
+    parameters:
+    conn: MySQL connection to the (new) dataset database
+    events: dataset events from iter_dataset_events or events_from_records
+    batch_size: rows per insert batch (defaults to IngestConfig)
+    commit_interval: rows between commits (defaults to IngestConfig)
+    mode: "insert" for batched inserts or "infile" for LOAD DATA LOCAL INFILE (defaults to IngestConfig),
+          infile quietly becomes insert if the server doesn't allow it
+    progress: optional object with add_rows(count) and table_done(table_name), e.g. an IngestJob
+
+    returns a dictionary with the number of tables and rows loaded, the mode actually used, the indexes created per table,
+    the time it took and the rows per second
+    """
+    mode = _check_mode(mode)
+    start = time.perf_counter()
+    events = iter(events)
+    cursor = conn.cursor()
+    tables_loaded = 0
+    rows_loaded = 0
+    indexes = {}
+    try:
+        max_packet = get_max_allowed_packet(cursor)
+        if mode == "infile" and not local_infile_enabled(cursor):
+            mode = "insert"
+        for event in events:
+            if event[0] != "rows":
+                continue
+            _, table_name, first_chunk = event
+            if not table_name or not first_chunk:
+                continue
+            table_count, mode, indexes[table_name] = _load_table(conn, cursor, table_name, first_chunk[0],
+                                            _table_rows(table_name, first_chunk, events),
+                                            mode, batch_size, commit_interval, max_packet, progress)
+            rows_loaded += table_count
+            tables_loaded += 1
+        conn.commit() #whatever is left from the last commit interval goes to the database
+    finally:
+        cursor.close()
+    return _load_stats(tables_loaded, rows_loaded, mode, indexes, start)
+
+def _spool_rows(path):
+    #read back the rows of a table spooled to disk as json lines
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+class _WorkerConnections:
+    #one connection per pool thread, opened the first time that thread loads a table and all closed at the end
+    def __init__(self, connect):
+        self.connect = connect
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def get(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            self.local.max_packet = None
+            with self.lock:
+                self.opened.append(conn)
+        return conn
+
+    def close_all(self):
+        for conn in self.opened:
+            try:
+                conn.close()
+            except Exception:
+                logging.error("Error closing ingest worker connection", exc_info=True)
+
+def _load_spooled_table(connections, table_name, first_row, path, mode, batch_size, commit_interval, progress):
+    #runs on a pool thread, loads one table from its spool file on that thread's connection
+    try:
+        conn = connections.get()
+        cursor = conn.cursor()
+        try:
+            if connections.local.max_packet is None:
+                connections.local.max_packet = get_max_allowed_packet(cursor)
+            count, used_mode, indexes = _load_table(conn, cursor, table_name, first_row, _spool_rows(path), mode,
+                                                    batch_size, commit_interval, connections.local.max_packet, progress)
+            conn.commit()
+            return table_name, count, used_mode, indexes
+        finally:
+            cursor.close()
+    finally:
+        os.remove(path)
+
+def load_dataset(connect, events, workers=None, batch_size=None, commit_interval=None, mode=None, progress=None):
+    """
+    Load every table of a dataset, several tables at once when workers > 1
+    the stream is read on the calling thread and each table's rows are spooled to a temporary json lines file,
+    as soon as a table is complete it is handed to a bounded pool where each worker thread has its own connection,
+    so the load time is roughly the slowest table instead of the sum of all of them
+    if any table fails the remaining work is cancelled and the error is raised, the caller is expected to drop the database
+    parameters:
+    connect: function with no arguments that opens a new connection to the dataset database
+    events: dataset events from iter_dataset_events or events_from_records
+    workers: size of the pool (defaults to IngestConfig), 1 loads everything on one connection without spooling
+    batch_size, commit_interval, mode, progress: as for load_dataset_events
+
+    returns the same statistics dictionary as load_dataset_events, mode is "infile" only if every table used it
+    """
+    if workers is None:
+        workers = IngestConfig.workers
+    mode = _check_mode(mode)
+    if workers <= 1:
+        conn = connect()
+        try:
+            return load_dataset_events(conn, events, batch_size=batch_size, commit_interval=commit_interval,
+                                       mode=mode, progress=progress)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    if mode == "infile":
+        probe = connect()
+        try:
+            probe_cursor = probe.cursor()
+            if not local_infile_enabled(probe_cursor):
+                mode = "insert"
+            probe_cursor.close()
+        finally:
+            probe.close()
+
+    connections = _WorkerConnections(connect)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+    futures = []
+    spool_paths = []
+    spool = None
+    try:
+        for event in events:
+            #stop reading as soon as a table has failed, everything is going to be dropped anyway
+            if any(f.done() and f.exception() is not None for f in futures):
+                break
+            if event[0] == "rows":
+                _, table_name, chunk = event
+                if not table_name or not chunk:
+                    continue
+                if spool is None:
+                    spool = (table_name, chunk[0], tempfile.NamedTemporaryFile(
+                        "w", encoding="utf-8", suffix=".jsonl", dir=INFILE_DIR, delete=False))
+                for row in chunk:
+                    spool[2].write(json.dumps(row))
+                    spool[2].write("\n")
+            elif event[0] == "table_end" and spool is not None:
+                table_name, first_row, spool_file = spool
+                spool_file.close()
+                spool = None
+                spool_paths.append(spool_file.name)
+                futures.append(executor.submit(_load_spooled_table, connections, table_name, first_row,
+                                               spool_file.name, mode, batch_size, commit_interval, progress))
+        #wait for the tables, raising the first failure
+        results = []
+        for future in as_completed(futures):
+            results.append(future.result())
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        if spool is not None:
+            spool[2].close()
+            os.remove(spool[2].name)
+        executor.shutdown(wait=True)
+        #spool files of tables that were cancelled before they started
+        for path in spool_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        connections.close_all()
+
+    rows_loaded = sum(count for _, count, _, _ in results)
+    if mode == "infile" and any(used != "infile" for _, _, used, _ in results):
+        mode = "insert"
+    indexes = {table_name: table_indexes for table_name, _, _, table_indexes in results}
+    return _load_stats(len(results), rows_loaded, mode, indexes, start)
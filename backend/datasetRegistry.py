@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from schemaExtract import extract_schema
+from datasetStream import iter_dataset_events, DatasetStreamReader
+from columnProfile import DatasetProfiler, preview_from_profile
+from config import RegistryConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+HASH_READ_SIZE = 1024 * 1024
+#rows of a csv profiled at a time
+CSV_CHUNK_ROWS = 10000
+
+class DatasetNotFoundError(Exception):
+    #Raised when a dataset id is used that was never registered.
+    pass
+
+def hash_file(file_obj, copy_to=None):
+    """
+    sha256 of an uploaded file, read in pieces so big files never sit in memory
+    parameters:
+    file_obj: binary (or text) file object, put back at the start afterwards
+    copy_to: optional open binary file that every piece is also written to, so saving and hashing is one read
+
+    returns the hex digest, which is used as the dataset id
+    """
+    digest = hashlib.sha256()
+    while True:
+        piece = file_obj.read(HASH_READ_SIZE)
+        if not piece:
+            break
+        if isinstance(piece, str):
+            piece = piece.encode("utf-8")
+        digest.update(piece)
+        if copy_to is not None:
+            copy_to.write(piece)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+class DatasetSummary:
+    """
+    Collects what the rest of the app needs to know about a dataset while its events stream past,
+    so the ingestion pass can register the dataset without reading the file a second time
+    the column profiles (distinct counts, nulls, min / max, top values, samples) are built here too
+    """
+    def __init__(self):
+        self.database = None
+        self.schema = {}
+        self.profiler = DatasetProfiler()
+
+    def observe(self, event):
+        if event[0] == "database":
+            self.database = event[1].get("name")
+        elif event[0] == "rows":
+            _, table_name, rows = event
+            if not rows:
+                return
+            if table_name not in self.schema:
+                #same format as schemaExtract, column name to the python type name of the first row's value
+                self.schema[table_name] = {key: type(value).__name__ for key, value in rows[0].items()}
+            self.profiler.observe_rows(table_name, rows)
+
+    def observe_frame(self, table_name, frame):
+        #csv files come in as DataFrames already, the schema is taken from extract_schema for those
+        self.profiler.observe_frame(table_name, frame)
+
+    def watch(self, events):
+        #pass the events straight through, taking notes on the way
+        for event in events:
+            self.observe(event)
+            yield event
+
+    def to_dict(self):
+        profile = self.profiler.to_dict()
+        return {
+            "database": self.database,
+            "schema": self.schema,
+            "preview": preview_from_profile(profile),
+            "profile": profile,
+            "rowCounts": dict(self.profiler.row_counts)
+        }
+
+class DatasetRegistry:
+    """
+    Datasets registered by the hash of their content, so a file is only parsed once
+    and later questions can refer to it by id instead of uploading it again
+    entries are written to RegistryConfig.directory so they survive a restart, the most recently used
+    memory_entries of them are also kept in memory (an LRU), the others are read back from the directory when asked for
+    without a directory an entry pushed out of memory is gone and its file has to be uploaded again
+    """
+    def __init__(self, directory=None, memory_entries=None):
+        self.directory = RegistryConfig.directory if directory is None else directory
+        self.memory_entries = RegistryConfig.memory_entries if memory_entries is None else memory_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, dataset_id):
+        return os.path.join(self.directory, f"{dataset_id}.json")
+
+    def get(self, dataset_id):
+        """
+        Look up a registered dataset
+        returns the entry dictionary (datasetId, filename, database, schema, preview, profile, rowCounts)
+        raises DatasetNotFoundError if the id is unknown
+        """
+        with self.lock:
+            entry = self.entries.get(dataset_id)
+            if entry is not None:
+                self.entries.move_to_end(dataset_id)
+                return entry
+        #ids are hex digests, anything else can't be a file of ours
+        if self.directory and dataset_id and all(c in "0123456789abcdef" for c in dataset_id):
+            try:
+                with open(self._path(dataset_id), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                with self.lock:
+                    self._remember(dataset_id, entry)
+                return entry
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError):
+                logging.error(f"Could not read registry entry {dataset_id}", exc_info=True)
+        raise DatasetNotFoundError(f"Dataset '{dataset_id}' has not been registered. Please upload it again.")
+
+    def _remember(self, dataset_id, entry):
+        #memory LRU, caller holds the lock
+        self.entries[dataset_id] = entry
+        self.entries.move_to_end(dataset_id)
+        while len(self.entries) > self.memory_entries:
+            self.entries.popitem(last=False)
+
+    def contains(self, dataset_id):
+        try:
+            self.get(dataset_id)
+            return True
+        except DatasetNotFoundError:
+            return False
+
+    def add(self, dataset_id, filename, summary):
+        #store a summary (DatasetSummary.to_dict) under its id, returns the entry
+        entry = {"datasetId": dataset_id, "filename": filename, "registered": time.time(), **summary}
+        with self.lock:
+            self._remember(dataset_id, entry)
+        if self.directory:
+            try:
+                tmp_path = self._path(dataset_id) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, default=str)
+                os.replace(tmp_path, self._path(dataset_id))
+            except OSError:
+                logging.error(f"Could not save registry entry {dataset_id}", exc_info=True)
+        return entry
+
+    def register(self, file_obj, filename, dataset_id=None):
+        """
+        Register an uploaded file, parsing it only if this exact content hasn't been seen before
+        parameters:
+        file_obj: the uploaded file (or an open file), left at the start afterwards
+        filename: original file name, the extension decides how it is parsed
+        dataset_id: the content hash if the caller already worked it out
+
+        returns the registry entry
+        """
+        if dataset_id is None:
+            dataset_id = hash_file(file_obj)
+        if self.contains(dataset_id):
+            return self.get(dataset_id)
+        ext = os.path.splitext(filename or "")[1].lower()
+        summary = DatasetSummary()
+        if ext == ".json":
+            for _ in summary.watch(iter_dataset_events(file_obj)):
+                pass
+            summary = summary.to_dict()
+        elif ext == ".jsonl":
+            for _ in summary.watch(DatasetStreamReader(file_obj).line_events()):
+                pass
+            summary = summary.to_dict()
+            #jsonl files are never loaded into mysql, so there is no database to point at
+            summary["database"] = None
+        else:
+            #csv is one table, named the way schemaExtract names it, profiled a chunk at a time
+            schema = extract_schema(file_obj, filename=filename)
+            file_obj.seek(0)
+            table_name = next(iter(schema))
+            for frame in pd.read_csv(file_obj, chunksize=CSV_CHUNK_ROWS):
+                summary.observe_frame(table_name, frame)
+            summary = {**summary.to_dict(), "database": None, "schema": schema}
+        file_obj.seek(0)
+        return self.add(dataset_id, filename, summary)
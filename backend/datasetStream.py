@@ -0,0 +1,260 @@
+import re
+import json
+import codecs
+
+#how much of the file is read at a time, the buffer never holds much more than this plus one record
+READ_SIZE = 64 * 1024
+#rows handed to the ingestion code per event unless the caller asks for something else
+DEFAULT_CHUNK_ROWS = 1000
+
+_WHITESPACE = " \t\n\r"
+#used when skipping, the next quote or bracket, the rest of a string up to its closing quote, and a table that deletes everything but brackets
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_TAIL = re.compile(r'(?:[^"\\]|\\.)*"')
+_ONLY_BRACKETS = str.maketrans("", "", "".join(chr(c) for c in range(128) if chr(c) not in "[]{}"))
+#a run of complete rows with no nested objects, which is what almost every data array is made of,
+#matched in one go so skipping doesn't go back to python for every quote
+_FLAT_ROWS = re.compile(r'(?:\s*,?\s*\{(?:[^{}"]|"(?:[^"\\]|\\.)*")*\})*')
+
+class DatasetFormatError(ValueError):
+    #Raised when the uploaded file is not a JSON list of database / table records.
+    pass
+
+class DatasetStreamReader:
+    """
+    Incremental reader for the dataset format [{"type": "database", ...}, {"type": "table", "name": ..., "data": [...]}]
+    the file is read in small pieces and every record except the table "data" arrays is decoded normally,
+    the data arrays are decoded one row at a time and handed out in chunks so memory depends on the chunk size
+    and not on the size of the file
+    parameters:
+    file_obj: binary or text file object (an uploaded file, an open file or a StringIO)
+    chunk_rows: how many rows go in each "rows" event
+    max_rows: only hand out this many rows per table and skip over the rest without decoding it, None for every row
+    """
+    def __init__(self, file_obj, chunk_rows=DEFAULT_CHUNK_ROWS, max_rows=None):
+        self.file_obj = file_obj
+        self.chunk_rows = max(1, chunk_rows)
+        self.max_rows = max_rows
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        #read the next piece of the file into the buffer, dropping the part that has already been parsed
+        if self.eof:
+            return False
+        piece = self.file_obj.read(READ_SIZE)
+        if isinstance(piece, bytes):
+            text = self.utf8.decode(piece, final=not piece)
+        else:
+            text = piece
+        if not piece:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return bool(text) or not self.eof
+
+    def _peek(self):
+        #next character that isn't whitespace, or None at the end of the file
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise DatasetFormatError(f"Expected '{char}' in dataset but found {found!r}")
+        self.pos += 1
+
+    def _value(self):
+        #decode one complete json value, reading more of the file whenever it is cut off by the buffer end
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise DatasetFormatError("Dataset file ended in the middle of a value")
+                self._fill()
+                continue
+            #a number at the very end of the buffer might carry on in the next piece
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _members(self, close):
+        #walk the comma separated members of an object or array, yielding once per member
+        if self._peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            sep = self._peek()
+            self.pos += 1
+            if sep == close:
+                return
+            if sep != ",":
+                raise DatasetFormatError(f"Expected ',' or '{close}' in dataset but found {sep!r}")
+
+    def _data_rows(self):
+        #stream the rows of a "data" array one at a time
+        self._expect("[")
+        for _ in self._members("]"):
+            yield self._value()
+
+    def _skip_to_close(self):
+        """
+        Skip the rest of the array or object we are inside without decoding any of it
+        most of the time a whole buffer is passed over at once: escaped characters are masked out, the strings are removed
+        and the brackets that are left are counted, all with C level string methods, only the piece of the buffer where
+        the array actually closes is walked one quote or bracket at a time
+        """
+        depth = 1
+        while depth:
+            #mask escapes without changing the length so positions still line up, then every quote left is a real one
+            segment = self.buffer[self.pos:].replace("\\\\", "__").replace('\\"', "__")
+            last_quote = segment.rfind('"')
+            if last_quote == -1:
+                cut = len(segment)
+            elif segment.count('"', 0, last_quote) % 2 == 0:
+                cut = last_quote #the last quote opens a string that isn't finished yet
+            else:
+                cut = last_quote + 1
+            if cut == 0:
+                if not self._fill():
+                    raise DatasetFormatError("Dataset file ended in the middle of a value")
+                continue
+            #keep only the brackets outside strings (every other piece between quotes), then cancel out every complete pair, innermost first,
+            #what is left is the brackets that close something from before this piece followed by the ones still open
+            structure = "".join(segment[:cut].split('"')[::2]).translate(_ONLY_BRACKETS)
+            while True:
+                reduced = structure.replace("[]", "").replace("{}", "")
+                if reduced == structure:
+                    break
+                structure = reduced
+            closes = structure.count("]") + structure.count("}")
+            if closes < depth:
+                #the array can't close in this piece, so only the change in depth matters
+                depth += len(structure) - 2 * closes
+                self.pos += cut
+                continue
+            depth = self._scan_tokens(depth, self.pos + cut)
+
+    def _scan_tokens(self, depth, limit):
+        #the precise version of the skip, one quote or bracket at a time up to limit or until the depth gets back to 0
+        while depth and self.pos < limit:
+            if depth == 1:
+                self.pos = _FLAT_ROWS.match(self.buffer, self.pos, limit).end()
+            match = _STRUCTURE.search(self.buffer, self.pos, limit)
+            if match is None:
+                self.pos = limit
+                break
+            if match.group() == '"':
+                end = _STRING_TAIL.match(self.buffer, match.end(), limit)
+                self.pos = end.end() if end is not None else limit
+            else:
+                depth += 1 if match.group() in "[{" else -1
+                self.pos = match.end()
+        return depth
+
+    def _record_events(self):
+        #events for one {"type": ..., "name": ..., "data": [...]} record
+        self._expect("{")
+        record = {}
+        held_rows = None
+        row_count = 0
+        for _ in self._members("}"):
+            key = self._value()
+            self._expect(":")
+            if key == "data" and self._peek() == "[":
+                if record.get("type") == "table" and record.get("name"):
+                    #the usual layout, type and name come first so the rows can be handed out as they are read
+                    chunk = []
+                    for row in self._data_rows():
+                        chunk.append(row)
+                        if len(chunk) >= self.chunk_rows:
+                            row_count += len(chunk)
+                            yield ("rows", record["name"], chunk)
+                            chunk = []
+                        if self.max_rows is not None and row_count + len(chunk) >= self.max_rows:
+                            #got all the rows the caller wanted, pass over the rest of the array undecoded
+                            self._skip_to_close()
+                            break
+                    if chunk:
+                        row_count += len(chunk)
+                        yield ("rows", record["name"], chunk)
+                else:
+                    #data came before the table name, nothing to attach the rows to yet so they have to be held
+                    held_rows = []
+                    for row in self._data_rows():
+                        held_rows.append(row)
+                        if self.max_rows is not None and len(held_rows) >= self.max_rows:
+                            self._skip_to_close()
+                            break
+            else:
+                record[key] = self._value()
+        if record.get("type") == "table":
+            if held_rows is not None:
+                for start in range(0, len(held_rows), self.chunk_rows):
+                    yield ("rows", record.get("name"), held_rows[start:start + self.chunk_rows])
+                row_count = len(held_rows)
+            yield ("table_end", record.get("name"), row_count)
+        elif record.get("type") == "database":
+            yield ("database", record)
+        else:
+            yield ("record", record)
+
+    def events(self):
+        """
+        Yield the contents of the dataset as a flat stream of events:
+        ("database", record) for the database record,
+        ("rows", table_name, rows) for each chunk of a table's rows,
+        ("table_end", table_name, row_count) once a table is finished (row_count is the rows handed out),
+        ("record", record) for anything else in the list
+        """
+        self._expect("[")
+        for _ in self._members("]"):
+            yield from self._record_events()
+        if self._peek() is not None:
+            raise DatasetFormatError("Unexpected content after the end of the dataset list")
+
+    def line_events(self):
+        #same events for a JSONL file, where each line is one record instead of the records being in a list
+        while self._peek() is not None:
+            yield from self._record_events()
+
+def iter_dataset_events(file_obj, chunk_rows=DEFAULT_CHUNK_ROWS, max_rows=None):
+    #shortcut for streaming the events of an uploaded dataset file
+    return DatasetStreamReader(file_obj, chunk_rows=chunk_rows, max_rows=max_rows).events()
+
+def events_from_records(data, chunk_rows=DEFAULT_CHUNK_ROWS):
+    #turn an already parsed dataset list into the same events as the stream reader, so one ingestion path handles both
+    for record in data:
+        record_type = record.get("type")
+        if record_type == "table":
+            rows = record.get("data", [])
+            for start in range(0, len(rows), chunk_rows):
+                yield ("rows", record.get("name"), rows[start:start + chunk_rows])
+            yield ("table_end", record.get("name"), len(rows))
+        elif record_type == "database":
+            yield ("database", record)
+        else:
+            yield ("record", record)
+
+def read_database_name(file_obj):
+    """
+    Find the database name in a dataset file, stopping as soon as the database record has been read
+    returns the name or None if there isn't one
+    """
+    for event in iter_dataset_events(file_obj):
+        if event[0] == "database":
+            return event[1].get("name")
+    return None
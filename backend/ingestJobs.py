@@ -0,0 +1,118 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import IngestConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+class IngestJob:
+    """
+    Progress of one dataset upload running in the background
+    the ingestion code reports into it through add_rows and table_done (from any worker thread)
+    and the api reads it back with to_dict when the frontend polls
+    """
+    def __init__(self, database):
+        self.id = uuid.uuid4().hex
+        self.database = database
+        self.phase = "queued"
+        self.tables_done = []
+        self.rows_loaded = 0
+        self.errors = []
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def set_phase(self, phase):
+        with self.lock:
+            self.phase = phase
+            if phase == "loading" and self.started is None:
+                self.started = time.perf_counter()
+            if phase in ("done", "failed"):
+                self.finished = time.perf_counter()
+
+    def add_rows(self, count):
+        with self.lock:
+            self.rows_loaded += count
+
+    def table_done(self, table_name):
+        with self.lock:
+            self.tables_done.append(table_name)
+
+    def add_error(self, message):
+        with self.lock:
+            self.errors.append(message)
+
+    def to_dict(self):
+        #snapshot used for the /api/jobs/<id> response
+        with self.lock:
+            elapsed = None
+            if self.started is not None:
+                elapsed = (self.finished or time.perf_counter()) - self.started
+            return {
+                "jobId": self.id,
+                "database": self.database,
+                "phase": self.phase,
+                "tablesDone": len(self.tables_done),
+                "rowsLoaded": self.rows_loaded,
+                "elapsedSeconds": round(elapsed, 3) if elapsed is not None else None,
+                "rowsPerSecond": round(self.rows_loaded / elapsed, 1) if elapsed else None,
+                "errors": list(self.errors),
+                "result": self.result
+            }
+
+class IngestJobManager:
+    """
+    Runs ingestion jobs on a small background pool and keeps the most recent jobs so their progress can be polled
+    parameters:
+    workers: how many uploads can load at the same time
+    history: how many jobs to remember, the oldest finished ones are forgotten first
+    """
+    def __init__(self, workers=None, history=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or IngestConfig.job_workers, thread_name_prefix="ingest-job")
+        self.history = history or IngestConfig.job_history
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, database, work):
+        """
+        Queue work(job) to run in the background and return the job straight away
+        work should report progress into the job and return the result dictionary, any exception marks the job failed
+        """
+        job = IngestJob(database)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self.executor.submit(self._run, job, work)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def is_loading(self, database):
+        #true while a job for this database is still queued or loading, so its tables aren't all there yet
+        with self.lock:
+            return any(job.database == database and job.phase not in ("done", "failed") for job in self.jobs.values())
+
+    def _run(self, job, work):
+        job.set_phase("loading")
+        try:
+            job.result = work(job)
+            job.set_phase("done")
+        except Exception as e:
+            logging.error(f"Ingestion job {job.id} failed", exc_info=True)
+            job.add_error(str(e))
+            job.set_phase("failed")
+
+    def _forget_old_jobs(self):
+        #only drop jobs that are finished, a running job always stays visible
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.history:
+                break
+            if self.jobs[job_id].phase in ("done", "failed"):
+                del self.jobs[job_id]
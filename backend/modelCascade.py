@@ -0,0 +1,63 @@
+import threading
+from modelResilience import LatencyTracker
+from sqlValidation import validate_sql
+
+def escalation_reason(result, schema):
+    """
+    Why an answer from the fast model should go to the stronger one
+    parameters:
+    result: the response dictionary for the fast model's answer
+    schema: the schema the prompt was written with
+    returns a short reason, or None if the answer can be used as it is
+    """
+    if result["type"] == "clarification":
+        return "clarification"
+    problems = validate_sql(result["query"], schema)
+    if problems:
+        return "; ".join(problems)
+    return None
+
+class CascadeStats:
+    #calls and latency per model tier and how often the fast model's answer was escalated, for /api/model-stats
+    def __init__(self):
+        self.tiers = {}
+        self.escalations = 0
+        self.questions = 0
+        self.reasons = {}
+        self.lock = threading.Lock()
+
+    def record_call(self, model, seconds):
+        with self.lock:
+            tier = self.tiers.get(model)
+            if tier is None:
+                tier = self.tiers[model] = {"calls": 0, "latency": LatencyTracker(min_samples=1)}
+            tier["calls"] += 1
+        tier["latency"].record(seconds)
+
+    def record_question(self, reason=None):
+        #one question answered by the cascade, with the reason if it was escalated
+        with self.lock:
+            self.questions += 1
+            if reason is not None:
+                self.escalations += 1
+                kind = "clarification" if reason == "clarification" else "validation"
+                self.reasons[kind] = self.reasons.get(kind, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            tiers = dict(self.tiers)
+            stats = {
+                "questions": self.questions,
+                "escalations": self.escalations,
+                "escalationRate": round(self.escalations / self.questions, 4) if self.questions else 0.0,
+                "reasons": dict(self.reasons),
+            }
+        stats["tiers"] = {}
+        for model, tier in tiers.items():
+            p50, p95 = tier["latency"].percentile(0.5), tier["latency"].percentile(0.95)
+            stats["tiers"][model] = {
+                "calls": tier["calls"],
+                "p50Seconds": round(p50, 3) if p50 is not None else None,
+                "p95Seconds": round(p95, 3) if p95 is not None else None,
+            }
+        return stats
@@ -0,0 +1,282 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+from config import ResilienceConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+#errors that mean the provider is slow or struggling rather than that the request itself is wrong, these are retried
+#and count against the circuit breaker (asyncio.TimeoutError is its own class before python 3.11)
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError, #includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+class ModelUnavailableError(Exception):
+    #Raised when the model can't answer in time, the circuit breaker is open or every retry failed.
+    pass
+
+class CircuitBreaker:
+    """
+    Stops calling a provider that keeps failing, after failure_threshold failures in a row calls fail straight away
+    for reset_seconds, then one trial call is let through and its result decides whether to close again
+    """
+    def __init__(self, failure_threshold=None, reset_seconds=None):
+        self.failure_threshold = ResilienceConfig.breaker_failures if failure_threshold is None else failure_threshold
+        self.reset_seconds = ResilienceConfig.breaker_reset_seconds if reset_seconds is None else reset_seconds
+        self.failures = 0
+        self.opened = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened is None:
+            return "closed"
+        if time.monotonic() - self.opened >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        #whether a call may go ahead now, in half-open only the one trial call does
+        with self.lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release_trial(self):
+        #the call let through ended without saying anything about the provider (it was cancelled), the next call may be the trial
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened is not None or self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+
+class LatencyTracker:
+    #recent successful call times, for the hedging delay and /api/model-stats
+    def __init__(self, window=None, min_samples=None):
+        self.samples = deque(maxlen=ResilienceConfig.latency_window if window is None else window)
+        self.min_samples = ResilienceConfig.hedge_min_samples if min_samples is None else min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        #the given percentile of the window, None until there are enough samples to mean anything
+        with self.lock:
+            if not self.samples or len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class ResilientCaller:
+    """
+    Wraps model calls with an overall deadline, retries with jittered exponential backoff, optional hedging
+    (a second identical request once the first is slower than the recent p95, whichever answers first wins)
+    and a circuit breaker that fails fast while the provider is down
+    the call is a function taking the seconds it has left, which it passes on as the request timeout
+    one caller can be shared by the blocking and async model clients so they see the same breaker and latencies
+    """
+    def __init__(self, deadline=None, retries=None, hedge=None, breaker=None, tracker=None):
+        self.deadline = ResilienceConfig.deadline_seconds if deadline is None else deadline
+        self.retries = ResilienceConfig.retries if retries is None else retries
+        self.hedge = ResilienceConfig.hedge if hedge is None else hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.tracker = tracker or LatencyTracker()
+        self.executor = ThreadPoolExecutor(max_workers=ResilienceConfig.hedge_workers, thread_name_prefix="model-hedge")
+        self.counters = {"calls": 0, "retries": 0, "hedges": 0, "hedgeWins": 0, "failures": 0, "rejected": 0}
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _backoff(self, attempt):
+        #full jitter, anywhere between 0 and the exponential step so retries from many callers spread out
+        return random.uniform(0, min(ResilienceConfig.backoff_cap, ResilienceConfig.backoff_base * (2 ** attempt)))
+
+    def _hedge_delay(self):
+        p95 = self.tracker.percentile(0.95)
+        return ResilienceConfig.hedge_after if p95 is None else p95
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise ModelUnavailableError("The model service is temporarily unavailable. Please try again shortly.")
+
+    def _failed(self, error):
+        #every attempt failed or the deadline passed
+        self._count("failures")
+        raise ModelUnavailableError("The model took too long to respond or is unavailable. Please try again.") from error
+
+    def call(self, fn):
+        """
+        Run fn(timeout) under the deadline, retry policy, hedging and circuit breaker, the breaker is checked before every attempt
+        returns what fn returns, raises ModelUnavailableError when the model can't be reached in time,
+        any other error from fn (a bad request for example) is raised straight away
+        """
+        self._check_breaker()
+        self._count("calls")
+        end = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.retries + 1):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                if attempt:
+                    #the breaker let this retry through but the backoff used up the deadline
+                    self.breaker.release_trial()
+                break
+            start = time.monotonic()
+            try:
+                result = self._hedged(fn, remaining) if self.hedge else fn(remaining)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                self.breaker.record_failure()
+                if attempt < self.retries:
+                    if not self.breaker.allow():
+                        #the breaker opened while this call was retrying (or its half-open trial failed), stop adding to the load
+                        break
+                    self._count("retries")
+                    time.sleep(min(self._backoff(attempt), max(0.0, end - time.monotonic())))
+                continue
+            except Exception:
+                #the provider answered, it just didn't like the request, so it isn't degraded
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                #cancelled (the client went away) or interrupted, that's no answer either way so the breaker isn't left waiting on it
+                self.breaker.release_trial()
+                raise
+            self.breaker.record_success()
+            self.tracker.record(time.monotonic() - start)
+            return result
+        self._failed(last_error or TimeoutError("deadline passed"))
+
+    def _hedged(self, fn, remaining):
+        #first request in a worker thread, a second one if it hasn't answered within the hedge delay, first good answer wins
+        end = time.monotonic() + remaining
+        first = self.executor.submit(fn, remaining)
+        done, _ = wait([first], timeout=min(self._hedge_delay(), remaining))
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = self.executor.submit(fn, max(0.0, end - time.monotonic()))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedgeWins")
+                    return future.result()
+                error = future.exception()
+        raise error or TimeoutError("deadline passed")
+
+    async def call_async(self, fn, hedge=None):
+        #call for coroutines, fn(timeout) returns an awaitable, hedge=False turns hedging off for this call (streams)
+        self._check_breaker()
+        self._count("calls")
+        hedge = self.hedge if hedge is None else hedge
+        end = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.retries + 1):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                if attempt:
+                    #the breaker let this retry through but the backoff used up the deadline
+                    self.breaker.release_trial()
+                break
+            start = time.monotonic()
+            try:
+                if hedge:
+                    result = await self._hedged_async(fn, remaining)
+                else:
+                    result = await asyncio.wait_for(fn(remaining), remaining)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                self.breaker.record_failure()
+                if attempt < self.retries:
+                    if not self.breaker.allow():
+                        #the breaker opened while this call was retrying (or its half-open trial failed), stop adding to the load
+                        break
+                    self._count("retries")
+                    await asyncio.sleep(min(self._backoff(attempt), max(0.0, end - time.monotonic())))
+                continue
+            except Exception:
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+            self.breaker.record_success()
+            self.tracker.record(time.monotonic() - start)
+            return result
+        self._failed(last_error or TimeoutError("deadline passed"))
+
+    async def _hedged_async(self, fn, remaining):
+        end = time.monotonic() + remaining
+        first = asyncio.ensure_future(fn(remaining))
+        done, _ = await asyncio.wait([first], timeout=min(self._hedge_delay(), remaining))
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = asyncio.ensure_future(fn(max(0.0, end - time.monotonic())))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedgeWins")
+                        return task.result()
+                    error = task.exception()
+            raise error or TimeoutError("deadline passed")
+        finally:
+            #the slower request isn't needed any more
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        #counters, breaker state and recent latency percentiles for /api/model-stats
+        with self.lock:
+            stats = dict(self.counters)
+        stats["breaker"] = self.breaker.state
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            value = self.tracker.percentile(fraction)
+            stats[f"{name}Seconds"] = round(value, 3) if value is not None else None
+        return stats
@@ -0,0 +1,170 @@
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from config import QueryTimeoutConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+#mysql error codes for a statement that was stopped part way
+ER_QUERY_INTERRUPTED = 1317 #KILL QUERY
+ER_QUERY_TIMEOUT = 3024 #MAX_EXECUTION_TIME ran out
+
+class QueryTimeoutError(Exception):
+    #Raised when a query ran out of its time budget and was stopped.
+    pass
+
+class QueryCancelledError(Exception):
+    #Raised when a query was cancelled through /api/cancel-query.
+    pass
+
+class QueryIdInUseError(ValueError):
+    #Raised when a query is submitted with the id of one that is still running.
+    pass
+
+class RunningQuery:
+    #one submitted query, from before it is validated until its last row has been read
+    def __init__(self, query_id, timeout):
+        self.id = query_id
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.kill_at = None #when the watchdog stops it, set while it is running on a connection
+        self.thread_id = None #mysql connection id while it is running on one
+        self.state = "running" #or "cancelled" / "timedOut"
+        self.lock = threading.Lock() #held while it is being killed, so the connection isn't handed back mid kill
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        #raise if it was cancelled or its time ran out before it got to mysql
+        if self.state == "cancelled":
+            raise QueryCancelledError(f"Query {self.id} was cancelled.")
+        if self.state == "timedOut" or time.monotonic() >= self.deadline:
+            self.state = "timedOut"
+            raise QueryTimeoutError(f"The query took longer than its {self.timeout:g} second limit and was stopped.")
+
+class QueryRegistry:
+    """
+    The queries running in this process by id, so one can be cancelled from another request, and a watchdog thread
+    that sends KILL QUERY for any still running once its time is up
+    parameters:
+    kill: called with a mysql connection id to stop the statement running on it (on a different connection)
+    grace_seconds: extra time a SELECT gets before it is killed, its MAX_EXECUTION_TIME hint should stop it first
+    """
+    def __init__(self, kill, grace_seconds=None):
+        self.kill = kill
+        self.grace_seconds = QueryTimeoutConfig.grace_seconds if grace_seconds is None else grace_seconds
+        self.queries = {}
+        self.changed = threading.Condition()
+        self.watchdog = None
+        self.counters = {"started": 0, "cancelled": 0, "timedOut": 0, "killed": 0, "killFailures": 0}
+
+    def budget(self, timeout=None):
+        #the time budget of a query, the configured one when it doesn't ask, never more than the configured maximum
+        if timeout is None:
+            return QueryTimeoutConfig.timeout_seconds
+        return min(max(0.001, float(timeout)), QueryTimeoutConfig.max_timeout_seconds)
+
+    def start(self, query_id=None, timeout=None):
+        """
+        Register a query as it is submitted, its budget starts now
+        parameters:
+        query_id: id chosen by the caller so it can cancel before the response comes back, None for a new one
+        timeout: seconds the query may take, see budget
+        returns the RunningQuery, call finish with it once it is done
+        """
+        query = RunningQuery(query_id or uuid.uuid4().hex, self.budget(timeout))
+        with self.changed:
+            if query.id in self.queries:
+                raise QueryIdInUseError(f"A query with id {query.id} is already running.")
+            self.queries[query.id] = query
+            self.counters["started"] += 1
+        return query
+
+    def finish(self, query):
+        with self.changed:
+            if self.queries.get(query.id) is query:
+                del self.queries[query.id]
+            if query.state in ("cancelled", "timedOut"):
+                self.counters[query.state] += 1
+
+    @contextmanager
+    def running(self, query, conn, hinted=False):
+        """
+        A with block where a query runs on a connection, the watchdog kills it there once its time is up
+        parameters:
+        query: the RunningQuery
+        conn: the mysql connection it runs on
+        hinted: the statement carries a MAX_EXECUTION_TIME hint, so it gets grace_seconds before it is killed
+        """
+        with self.changed:
+            #checked under the lock, a cancel either sees the connection id or the query sees it was cancelled
+            query.check()
+            query.thread_id = conn.connection_id
+            query.kill_at = query.deadline + (self.grace_seconds if hinted else 0)
+            self._start_watchdog()
+            self.changed.notify()
+        try:
+            yield query
+        finally:
+            #waits for a kill in progress, after this the connection can go back to the pool
+            with query.lock:
+                query.thread_id = None
+                query.kill_at = None
+
+    def _stop(self, query, state):
+        #kill the statement of a running query, returns False if it isn't running on a connection any more
+        with query.lock:
+            if query.thread_id is None:
+                return False
+            query.state = state
+            try:
+                self.kill(query.thread_id)
+                outcome = "killed"
+            except Exception:
+                logging.error(f"Could not kill query {query.id}", exc_info=True)
+                outcome = "killFailures"
+        with self.changed:
+            self.counters[outcome] += 1
+        return True
+
+    def cancel(self, query_id):
+        """
+        Cancel a query, stopping its statement if it is already running in mysql
+        returns False if there is no such query (it already finished or it runs in another process)
+        """
+        with self.changed:
+            query = self.queries.get(query_id)
+            if query is None or query.state != "running":
+                return query is not None
+            query.state = "cancelled"
+        self._stop(query, "cancelled")
+        return True
+
+    def _start_watchdog(self):
+        #caller holds the lock
+        if self.watchdog is None or not self.watchdog.is_alive():
+            self.watchdog = threading.Thread(target=self._watch, name="query-watchdog", daemon=True)
+            self.watchdog.start()
+
+    def _watch(self):
+        while True:
+            with self.changed:
+                now = time.monotonic()
+                watched = [query for query in self.queries.values() if query.kill_at is not None and query.state == "running"]
+                due = [query for query in watched if query.kill_at <= now]
+                if not due:
+                    upcoming = [query.kill_at for query in watched]
+                    self.changed.wait(min(upcoming) - now if upcoming else None)
+                    continue
+            for query in due:
+                self._stop(query, "timedOut")
+
+    def stats(self):
+        with self.changed:
+            stats = dict(self.counters)
+            stats["running"] = len(self.queries)
+        return stats
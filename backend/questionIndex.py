@@ -0,0 +1,145 @@
+import re
+import math
+import threading
+from collections import Counter, OrderedDict
+from config import SimilarityCacheConfig
+
+#phrases that ask for the same thing, rewritten to one form before comparing questions
+_PHRASES = [
+    (re.compile(r"\b(how many|number of|count of|total number of|amount of)\b"), "count"),
+    (re.compile(r"\b(average|mean|avg)\b"), "avg"),
+    (re.compile(r"\b(highest|largest|biggest|maximum|most)\b"), "max"),
+    (re.compile(r"\b(lowest|smallest|minimum|least|fewest)\b"), "min"),
+    (re.compile(r"\b(show|list|display|give|get|find|return|fetch)( me)?\b"), "list"),
+]
+#words that don't change what a question asks for
+_STOPWORDS = frozenset(
+    "a an the of in on at to for from by with during within is are was were be been do does did "
+    "what which who whom whose there that this these those all any each every me i we our my please "
+    "placed made have has had and".split()
+)
+#numbers, quoted values and capitalised names after the first word, a question about 2020 is never a duplicate of one about 2021
+LITERAL_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|\b\d+(?:\.\d+)?\b|(?<=\w )[A-Z][\w-]*")
+_WORD = re.compile(r"[a-z0-9]+")
+
+def question_literals(question):
+    #the literal values in a question, in order
+    return [match.strip("'\"").lower() for match in LITERAL_PATTERN.findall((question or "").strip())]
+
+def question_terms(question):
+    """
+    Character trigrams of the question's meaningful words, after the common phrasings have been folded together
+    the literals are left out, they are compared exactly instead
+    """
+    text = LITERAL_PATTERN.sub(" ", (question or "").strip()).lower()
+    for pattern, replacement in _PHRASES:
+        text = pattern.sub(replacement, text)
+    terms = Counter()
+    for word in _WORD.findall(text):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            terms[padded[i:i + 3]] += 1
+    return terms
+
+class _SchemaQuestions:
+    #the answered questions for one schema fingerprint, with an inverted index from trigram to question
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.postings = {}
+        self.next_id = 0
+
+    def add(self, question, literals, terms, response, limit):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = (question, literals, terms, response)
+        for term in terms:
+            self.postings.setdefault(term, set()).add(entry_id)
+        while len(self.entries) > limit:
+            old_id, (_, _, old_terms, _) = self.entries.popitem(last=False)
+            for term in old_terms:
+                ids = self.postings.get(term)
+                if ids is not None:
+                    ids.discard(old_id)
+                    if not ids:
+                        del self.postings[term]
+
+    def best(self, literals, terms):
+        #highest tf-idf cosine among the questions sharing a trigram and the exact same literals
+        count = len(self.entries)
+        idf = {term: math.log(1 + count / (1 + len(self.postings.get(term, ())))) for term in terms}
+        query_weights = {term: (1 + math.log(freq)) * idf[term] for term, freq in terms.items()}
+        query_norm = math.sqrt(sum(w * w for w in query_weights.values()))
+        candidates = set()
+        for term in terms:
+            candidates.update(self.postings.get(term, ()))
+        best_score, best_entry = 0.0, None
+        for entry_id in candidates:
+            question, entry_literals, entry_terms, response = self.entries[entry_id]
+            if entry_literals != literals:
+                continue
+            dot = 0.0
+            norm = 0.0
+            for term, freq in entry_terms.items():
+                weight = (1 + math.log(freq)) * math.log(1 + count / (1 + len(self.postings.get(term, ()))))
+                norm += weight * weight
+                if term in query_weights:
+                    dot += weight * query_weights[term]
+            if dot and norm and query_norm:
+                score = min(1.0, dot / (math.sqrt(norm) * query_norm))
+                if score > best_score:
+                    best_score, best_entry = score, (question, response)
+        return best_score, best_entry
+
+class QuestionIndex:
+    """
+    Local similarity search over questions that have already been answered, so rephrasings of a question
+    reuse its SQL instead of going back to the model
+    questions are compared as tf-idf weighted character trigrams (after folding "how many" / "number of" and the like),
+    per schema fingerprint, and only ever match a question with exactly the same literal values
+    parameters:
+    threshold: cosine similarity needed to count as the same question
+    max_questions: answered questions remembered per schema, the oldest are dropped
+    max_schemas: schemas remembered, the least recently used are dropped
+    """
+    def __init__(self, threshold=None, max_questions=None, max_schemas=None):
+        self.threshold = SimilarityCacheConfig.threshold if threshold is None else threshold
+        self.max_questions = SimilarityCacheConfig.max_questions if max_questions is None else max_questions
+        self.max_schemas = SimilarityCacheConfig.max_schemas if max_schemas is None else max_schemas
+        self.schemas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, fingerprint, question, response):
+        #remember an answered question for a schema
+        terms = question_terms(question)
+        if not terms:
+            return
+        with self.lock:
+            questions = self.schemas.get(fingerprint)
+            if questions is None:
+                questions = self.schemas[fingerprint] = _SchemaQuestions()
+            self.schemas.move_to_end(fingerprint)
+            while len(self.schemas) > self.max_schemas:
+                self.schemas.popitem(last=False)
+            questions.add(question, question_literals(question), terms, dict(response), self.max_questions)
+
+    def lookup(self, fingerprint, question):
+        """
+        Find an earlier question on the same schema that asks the same thing
+        returns (score, earlier question, response copy), or None if nothing is similar enough
+        """
+        terms = question_terms(question)
+        if not terms:
+            return None
+        with self.lock:
+            questions = self.schemas.get(fingerprint)
+            if questions is None:
+                return None
+            self.schemas.move_to_end(fingerprint)
+            score, entry = questions.best(question_literals(question), terms)
+        if entry is None or score < self.threshold:
+            return None
+        return score, entry[0], dict(entry[1])
@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from config import ResponseCacheConfig
+
+logging.basicConfig(level=logging.ERROR)
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!]+$")
+
+def schema_fingerprint(schema, *extra):
+    """
+    Stable hash of a schema, the same tables and columns give the same fingerprint whatever order they come in
+    extra: anything else the answer depends on (instructions, foreign keys), hashed in with it
+    """
+    canonical = json.dumps([schema, *extra], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def normalize_question(question):
+    #case, extra spaces and the question mark at the end don't change what is being asked
+    return _TRAILING_PUNCTUATION.sub("", _SPACES.sub(" ", (question or "").strip().lower()))
+
+def cache_key(model, fingerprint, question):
+    return hashlib.sha256(f"{model}\n{fingerprint}\n{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Model responses kept so the same question on the same schema never goes to the API twice
+    two tiers: an in-memory LRU for the hot entries and a SQLite file that survives restarts,
+    a disk hit is copied back into memory
+    parameters:
+    path: SQLite file for the disk tier, None or "" for memory only
+    ttl: seconds an entry stays valid, 0 means forever
+    memory_entries: size of the LRU
+    disk_entries: rows kept in the SQLite file, the least recently used go first
+    """
+    def __init__(self, path=None, ttl=None, memory_entries=None, disk_entries=None):
+        self.path = ResponseCacheConfig.path if path is None else path
+        self.ttl = ResponseCacheConfig.ttl if ttl is None else ttl
+        self.memory_entries = ResponseCacheConfig.memory_entries if memory_entries is None else memory_entries
+        self.disk_entries = ResponseCacheConfig.disk_entries if disk_entries is None else disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memoryHits": 0, "diskHits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.db = None
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses "
+                    "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+                self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+                #which worker process is asking the model for a key right now, so the others wait for its answer
+                self.db.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+                self.db.commit()
+            except sqlite3.Error:
+                #the cache is only an optimisation, carry on with the memory tier if the file can't be used
+                logging.error(f"Could not open the response cache at {self.path}", exc_info=True)
+                self.db = None
+
+    def _expired(self, created, now):
+        return bool(self.ttl) and now - created >= self.ttl
+
+    def get(self, key, record=True, stale=False):
+        """
+        Look up a response, record=False leaves the hit / miss counters alone (for workers polling for someone else's answer)
+        stale=True also returns an entry past its ttl, expired entries are kept until they are replaced or evicted
+        so there is still something to answer with while the model is unavailable
+        returns a copy of the cached response dictionary, or None on a miss (or if the entry is past its ttl)
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and (stale or not self._expired(entry[1], now)):
+                self.memory.move_to_end(key)
+                self.counters["memoryHits"] += record
+                return dict(entry[0])
+            if self.db is not None:
+                try:
+                    row = self.db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None and (stale or not self._expired(row[1], now)):
+                        self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                        self.db.commit()
+                        response = json.loads(row[0])
+                        self._remember(key, response, row[1])
+                        self.counters["diskHits"] += record
+                        return dict(response)
+                except (sqlite3.Error, ValueError):
+                    logging.error("Response cache read failed", exc_info=True)
+            self.counters["misses"] += record
+            return None
+
+    def put(self, key, response):
+        #store a response dictionary in both tiers
+        now = time.time()
+        with self.lock:
+            self._remember(key, dict(response), now)
+            self.counters["stores"] += 1
+            if self.db is not None:
+                try:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, created, last_used) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(response, default=str), now, now)
+                    )
+                    #keep the file to its size limit, dropping the entries that haven't been used for longest
+                    removed = self.db.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_entries,)
+                    ).rowcount
+                    self.counters["evictions"] += max(removed, 0)
+                    self.db.commit()
+                except sqlite3.Error:
+                    logging.error("Response cache write failed", exc_info=True)
+
+    def _remember(self, key, response, created):
+        #memory tier, caller holds the lock
+        self.memory[key] = (response, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def acquire_lease(self, key, seconds):
+        """
+        Claim the model call for a key across every worker process sharing the SQLite file
+        returns True if this process should make the call, False if another one already is (and its lease hasn't run out)
+        without a disk tier there is nobody to share with, so the answer is always True
+        """
+        if self.db is None:
+            return True
+        now = time.time()
+        with self.lock:
+            try:
+                self.db.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+                claimed = self.db.execute(
+                    "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                    (key, f"{os.getpid()}:{id(self)}", now + seconds)
+                ).rowcount == 1
+                self.db.commit()
+                return claimed
+            except sqlite3.Error:
+                logging.error("Response cache lease failed", exc_info=True)
+                return True
+
+    def release_lease(self, key):
+        if self.db is None:
+            return
+        with self.lock:
+            try:
+                self.db.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, f"{os.getpid()}:{id(self)}"))
+                self.db.commit()
+            except sqlite3.Error:
+                logging.error("Response cache lease release failed", exc_info=True)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                try:
+                    self.db.execute("DELETE FROM responses")
+                    self.db.commit()
+                except sqlite3.Error:
+                    logging.error("Response cache clear failed", exc_info=True)
+
+    def stats(self):
+        #counters plus the current size of each tier, for /api/cache-stats
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memoryEntries"] = len(self.memory)
+            stats["diskEntries"] = 0
+            if self.db is not None:
+                try:
+                    stats["diskEntries"] = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            lookups = stats["memoryHits"] + stats["diskHits"] + stats["misses"]
+            stats["hitRate"] = round((stats["memoryHits"] + stats["diskHits"]) / lookups, 4) if lookups else 0.0
+            return stats
@@ -0,0 +1,102 @@
+import time
+import threading
+from collections import OrderedDict
+from sqlValidation import cacheable_sql
+from config import ResultCacheConfig
+
+class ResultCache:
+    """
+    Rows of SELECTs already run, so the same query against a database that hasn't changed isn't sent to mysql again
+    every database has a version number that is bumped whenever its data may have changed (a confirmed write or DDL,
+    the dataset being loaded again or removed), entries for an older version are never used again
+    an LRU bounded by the number of entries and the rows they hold, entries also expire after ttl seconds
+    in case the data is changed by something other than this app
+    parameters:
+    ttl: seconds an entry is used for, 0 means until its database changes
+    max_entries: most results kept
+    max_rows: most rows kept across all the results
+    max_entry_rows: results bigger than this aren't kept at all
+    """
+    def __init__(self, ttl=None, max_entries=None, max_rows=None, max_entry_rows=None):
+        self.ttl = ResultCacheConfig.ttl if ttl is None else ttl
+        self.max_entries = ResultCacheConfig.max_entries if max_entries is None else max_entries
+        self.max_rows = ResultCacheConfig.max_rows if max_rows is None else max_rows
+        self.max_entry_rows = ResultCacheConfig.max_entry_rows if max_entry_rows is None else max_entry_rows
+        self.entries = OrderedDict() #key to (rows, when it was stored)
+        self.rows = 0
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def key(self, database, sql_query):
+        """
+        Cache key for a query against a database at its current version, take it before the query runs
+        so a result that races with a write is stored under the old version and never read
+        returns the key, or None if the query's result can't be cached (writes, NOW(), RAND() and the like)
+        """
+        canonical = cacheable_sql(sql_query)
+        if canonical is None:
+            return None
+        with self.lock:
+            return (database, self.versions.get(database, 0), canonical)
+
+    def get(self, key):
+        #the cached rows for a key (a new list, the row dictionaries are shared), None on a miss
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry[1] >= self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return list(entry[0])
+
+    def put(self, key, rows):
+        #keep the rows of a finished query, unless its database changed while it ran or the result is too big
+        if key is None or len(rows) > self.max_entry_rows:
+            return
+        with self.lock:
+            #callers can add to the end of a key (the page of a paged query), the database and version lead it
+            database, version = key[0], key[1]
+            if self.versions.get(database, 0) != version:
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (list(rows), time.time())
+            self.rows += len(rows)
+            self.counters["stores"] += 1
+            while self.entries and (len(self.entries) > self.max_entries or self.rows > self.max_rows):
+                self._drop(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def _drop(self, key):
+        #caller holds the lock
+        rows, _ = self.entries.pop(key)
+        self.rows -= len(rows)
+
+    def bump(self, database=None):
+        """
+        The data of a database may have changed, none of its cached results are used again
+        database: None when it isn't known which databases changed (DDL can reach any of them), every database is bumped
+        """
+        with self.lock:
+            databases = {database} if database is not None else set(self.versions) | {key[0] for key in self.entries}
+            for name in databases:
+                self.versions[name] = self.versions.get(name, 0) + 1
+            for key in [key for key in self.entries if key[0] in databases]:
+                self._drop(key)
+            self.counters["invalidations"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+            stats["rows"] = self.rows
+        lookups = stats["hits"] + stats["misses"]
+        stats["hitRate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
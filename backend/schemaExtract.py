@@ -1,80 +1,72 @@
 import os
 import json
 import pandas as pd
+from datasetStream import iter_dataset_events, DatasetStreamReader
+
+#rows of a csv read to infer its column types, the rest of the file is never read
+CSV_SAMPLE_ROWS = 1000
+
+def _schema_from_events(events):
+    """
+    Build the schema dictionary from dataset events (see datasetStream)
+    each table's schema is inferred from its first row, mapping each column name to the type of its value
+    """
+    schema_dict = {}  # where the schema will be stored
+    for event in events:
+        if event[0] == "rows":  # the first rows of a table, the reader has already skipped the rest
+            _, table_name, rows = event
+            '''
+            get the first element in the table which will in this case represent the schema
+            then make a dictionary to go through the key-value pairs in the first row ^
+            then maps each of the column names to the type of the corresponding value
+            '''
+            first_row = rows[0]
+            schema_dict[table_name] = {key: type(value).__name__ for key, value in first_row.items()}
+    return schema_dict
 
 def extract_schema_from_json(file_input):
     """
     if the file is json:
-    first read a JSON file containing multiple objects
+    stream a JSON file containing multiple objects
     for each of the objects with "type": "table", take the table name and
-    infer the schema from the first record in the "data" list
+    infer the schema from the first record in the "data" list,
+    the rest of each data list is skipped without being parsed so the time and memory don't grow with the file
     Returns a dictionary mapping table names to their schema dictionaries
     """
     if isinstance(file_input, str):  # Check if the input is a file path
-        with open(file_input, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    else:  # If it's a file object, read it directly
-        data = json.load(file_input)
-    
-    schema_dict = {}  # where the schema will be stored
-    for record in data:
-        if isinstance(record, dict) and record.get("type") == "table":  # running the loop if the type in the directory is a table
-            table_name = record.get("name")  # get the name of the table
-            table_data = record.get("data", [])  # and then all the data too, if there isn't any, just an empty list
-            if table_data:
-                '''
-                get the first element in the table which will in this case represent the schema
-                then make a dictionary to go through the key-value pairs in the first row ^
-                then maps each of the column names to the type of the corresponding value
-                then store and once all the records have been iterated through, return the complete dictionary
-                '''
-                first_row = table_data[0]
-                table_schema = {key: type(value).__name__ for key, value in first_row.items()}
-                schema_dict[table_name] = table_schema
-    return schema_dict
+        with open(file_input, "rb") as f:
+            return _schema_from_events(iter_dataset_events(f, chunk_rows=1, max_rows=1))
+    # If it's a file object, stream it directly
+    return _schema_from_events(iter_dataset_events(file_input, chunk_rows=1, max_rows=1))
 
 def extract_schema_from_jsonl(file_input):
     """
     if the file is JSONL:
-    Reads a JSONL file
+    Streams a JSONL file record by record
     For each JSON object with "type": "table", it extracts the table name and
-    infers the schema from the first record in the "data" list
+    infers the schema from the first record in the "data" list, skipping over the rest of the list
     Returns a dictionary mapping table names to their schema dictionaries
     """
-    schema_dict = {}
-
     if isinstance(file_input, str):  # Check if input is a file path
-        with open(file_input, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-    else:  # If it's a file object, read lines directly
-        lines = file_input.readlines()
-
-    for line in lines:
-        if line.strip():
-            record = json.loads(line)
-            if isinstance(record, dict) and record.get("type") == "table":  # checks for table in the line
-                table_name = record.get("name")
-                table_data = record.get("data", [])
-                if table_data:
-                    first_row = table_data[0]
-                    table_schema = {key: type(value).__name__ for key, value in first_row.items()}
-                    schema_dict[table_name] = table_schema
-    return schema_dict
+        with open(file_input, "rb") as f:
+            return _schema_from_events(DatasetStreamReader(f, chunk_rows=1, max_rows=1).line_events())
+    # If it's a file object, stream it directly
+    return _schema_from_events(DatasetStreamReader(file_input, chunk_rows=1, max_rows=1).line_events())
 
 def extract_schema_from_csv(file_input):
     """
     if the file is CSV:
-    Reads a CSV file into a DataFrame
+    Reads the first CSV_SAMPLE_ROWS rows of a CSV file into a DataFrame, which is plenty to infer the types
     Assumes the entire CSV is one table; the table name is derived from the file name
     It infers the schema by mapping pandas dtypes to simplified type names
     Returns a dictionary with a single key (the table name) and its column schema
     """
     if isinstance(file_input, str):  # Check if input is a file path
         table_name = os.path.splitext(os.path.basename(file_input))[0]
-        df = pd.read_csv(file_input)
+        df = pd.read_csv(file_input, nrows=CSV_SAMPLE_ROWS)
     else:  # If it's a file object, read it directly and assign a generic table name
         table_name = "uploaded_table"
-        df = pd.read_csv(file_input)
+        df = pd.read_csv(file_input, nrows=CSV_SAMPLE_ROWS)
 
     df = df.infer_objects()  # Attempt to infer better data types
 
@@ -0,0 +1,142 @@
+import time
+import logging
+import threading
+import mysql.connector
+from config import MySQLConfig, SchemaConfig
+from connectionPool import connection_pool
+
+logging.basicConfig(level=logging.ERROR)
+
+COLUMNS_QUERY = (
+    "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY "
+    "FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = %s "
+    "ORDER BY TABLE_NAME, ORDINAL_POSITION"
+)
+KEYS_QUERY = (
+    "SELECT TABLE_NAME, COLUMN_NAME, CONSTRAINT_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+    "FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = %s"
+)
+
+class SchemaSnapshot:
+    """
+    The schema of one database as mysql actually has it, columns with their types and nullability,
+    primary keys and foreign keys
+    """
+    def __init__(self, database, columns, keys):
+        self.database = database
+        self.taken = time.time()
+        self.tables = {}
+        self.primary_keys = {}
+        self.foreign_keys = {}
+        for table_name, column_name, column_type, is_nullable, column_key in columns:
+            self.tables.setdefault(table_name, {})[column_name] = {
+                "type": column_type.decode() if isinstance(column_type, bytes) else column_type,
+                "nullable": is_nullable == "YES",
+                "key": column_key
+            }
+        for table_name, column_name, constraint_name, ref_table, ref_column in keys:
+            if constraint_name == "PRIMARY":
+                self.primary_keys.setdefault(table_name, []).append(column_name)
+            elif ref_table:
+                self.foreign_keys.setdefault(table_name, {})[column_name] = (ref_table, ref_column)
+
+    def to_prompt_schema(self):
+        """
+        Same shape as the schema from schemaExtract (table name to column name to type) so the prompt looks the same,
+        but with the real mysql types and the keys written next to the columns
+        """
+        schema = {}
+        for table_name, columns in self.tables.items():
+            table_schema = {}
+            for column_name, info in columns.items():
+                description = info["type"]
+                if column_name in self.primary_keys.get(table_name, []):
+                    description += " primary key"
+                reference = self.foreign_keys.get(table_name, {}).get(column_name)
+                if reference:
+                    description += f" references {reference[0]}({reference[1]})"
+                table_schema[column_name] = description
+            schema[table_name] = table_schema
+        return schema
+
+    def to_dict(self):
+        return {
+            "database": self.database,
+            "tables": self.tables,
+            "primaryKeys": self.primary_keys,
+            "foreignKeys": {table: {col: list(ref) for col, ref in refs.items()} for table, refs in self.foreign_keys.items()}
+        }
+
+def _connect_server():
+    #pooled connection to the configured server without picking a database, INFORMATION_SCHEMA covers all of them
+    config = MySQLConfig.get_config()
+    return connection_pool(config["host"], config["user"], config["password"]).connection()
+
+class SchemaProvider:
+    """
+    Reads a database's schema from INFORMATION_SCHEMA once and keeps the snapshot until something invalidates it
+    (DDL run through run_query, a dataset being loaded or removed) or it is older than SchemaConfig.ttl
+    parameters:
+    connect: function with no arguments that returns a connection to the server for a with block (defaults to a pooled one from MySQLConfig)
+    ttl: seconds a snapshot is trusted for, 0 means until it is invalidated
+    missing_ttl: seconds before a database with no tables, or one that couldn't be read, is asked for again
+    """
+    def __init__(self, connect=None, ttl=None, missing_ttl=None):
+        self.connect = connect or _connect_server
+        self.ttl = SchemaConfig.ttl if ttl is None else ttl
+        self.missing_ttl = SchemaConfig.missing_ttl if missing_ttl is None else missing_ttl
+        self.snapshots = {}
+        #when a database was found to have no tables or couldn't be read, so every query doesn't go asking again
+        self.missing = {}
+        self.lock = threading.Lock()
+
+    def _key(self, database):
+        return (MySQLConfig.host, database)
+
+    def snapshot(self, database):
+        """
+        Get the schema snapshot of a database, reading INFORMATION_SCHEMA only if there isn't a usable cached one
+        returns the SchemaSnapshot, or None if the database has no tables or can't be reached
+        """
+        key = self._key(database)
+        now = time.time()
+        with self.lock:
+            cached = self.snapshots.get(key)
+            missing = self.missing.get(key)
+        if cached is not None and (not self.ttl or now - cached.taken < self.ttl):
+            return cached
+        if missing is not None and now - missing < self.missing_ttl:
+            return None
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(COLUMNS_QUERY, (database,))
+                    columns = cursor.fetchall()
+                    cursor.execute(KEYS_QUERY, (database,))
+                    keys = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error:
+            logging.error(f"Could not read the schema of {database} from INFORMATION_SCHEMA", exc_info=True)
+            columns = None
+        if not columns:
+            with self.lock:
+                self.snapshots.pop(key, None)
+                self.missing[key] = time.time()
+            return None
+        snapshot = SchemaSnapshot(database, columns, keys)
+        with self.lock:
+            self.snapshots[key] = snapshot
+            self.missing.pop(key, None)
+        return snapshot
+
+    def invalidate(self, database=None):
+        #forget the snapshot of one database, or of every database if none is given
+        with self.lock:
+            if database is None:
+                self.snapshots.clear()
+                self.missing.clear()
+            else:
+                self.snapshots.pop(self._key(database), None)
+                self.missing.pop(self._key(database), None)
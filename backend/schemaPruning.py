@@ -0,0 +1,147 @@
+import re
+import math
+from collections import Counter
+from config import PruningConfig
+
+#BM25 parameters, the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+#how much each part of a table counts towards its document, the name says the most about what a table holds
+TABLE_NAME_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 2
+SAMPLE_VALUE_WEIGHT = 1
+
+_CAMEL_BOUNDARY = re.compile(r"([a-z0-9])([A-Z])")
+_WORD = re.compile(r"[a-z0-9]+")
+
+def _singular(word):
+    #very small stemmer so "orders" matches "order" and "categories" matches "category"
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 2 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def tokenize(text):
+    """
+    Split text or an identifier into search terms, customer_id / customerId / "customer ids" all give "customer" and "id",
+    each word also adds its character trigrams so partial names like "dept" still overlap with "department"
+    """
+    words = [_singular(w) for w in _WORD.findall(_CAMEL_BOUNDARY.sub(r"\1 \2", str(text)).lower())]
+    terms = list(words)
+    for word in words:
+        padded = f"#{word}#"
+        terms.extend("~" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return terms
+
+def estimate_tokens(table_name, table_schema):
+    #rough prompt tokens for one table, about four characters per token
+    return max(1, len(f"'{table_name}': {table_schema}, ") // 4)
+
+def infer_links(schema):
+    """
+    Guess the join links between tables when mysql has no foreign keys declared,
+    a column x_id (or xId) links to the table called x / xs or to a table whose first column is that same column
+    returns a dictionary of table name to the set of tables it can join to (both directions)
+    """
+    links = {table: set() for table in schema}
+    table_lookup = {_singular(table.lower()): table for table in schema}
+    key_owner = {}
+    for table, columns in schema.items():
+        first_column = next(iter(columns), None)
+        if first_column:
+            key_owner[first_column.lower()] = table
+    for table, columns in schema.items():
+        for column in columns:
+            words = [_singular(w) for w in _WORD.findall(_CAMEL_BOUNDARY.sub(r"\1 \2", column).lower())]
+            if len(words) < 2 or words[-1] != "id":
+                continue
+            target = table_lookup.get("_".join(words[:-1])) or table_lookup.get(words[-2]) or key_owner.get(column.lower())
+            if target and target != table:
+                links[table].add(target)
+                links[target].add(table)
+    return links
+
+class SchemaIndex:
+    """
+    Local BM25 index over the tables of one dataset, built once and then used to pick the tables a question needs
+    each table is a document made of its name, its column names and a few sample values
+    parameters:
+    schema: table name to column name to type, as used in the prompt
+    samples: optional table name to column name to a list of sample values (the registry preview)
+    foreign_keys: optional table name to column name to (referenced table, referenced column)
+    """
+    def __init__(self, schema, samples=None, foreign_keys=None):
+        self.schema = schema
+        self.documents = {}
+        for table, columns in schema.items():
+            terms = Counter()
+            for term in tokenize(table):
+                terms[term] += TABLE_NAME_WEIGHT
+            for column in columns:
+                for term in tokenize(column):
+                    terms[term] += COLUMN_NAME_WEIGHT
+            for values in (samples or {}).get(table, {}).values():
+                for value in values:
+                    for term in tokenize(value):
+                        terms[term] += SAMPLE_VALUE_WEIGHT
+            self.documents[table] = terms
+        self.lengths = {table: sum(terms.values()) for table, terms in self.documents.items()}
+        self.average_length = (sum(self.lengths.values()) / len(self.lengths)) if self.lengths else 0
+        document_frequency = Counter()
+        for terms in self.documents.values():
+            document_frequency.update(terms.keys())
+        count = len(self.documents)
+        self.idf = {term: math.log(1 + (count - freq + 0.5) / (freq + 0.5)) for term, freq in document_frequency.items()}
+        #declared foreign keys plus the ones guessed from the column names
+        self.links = infer_links(schema)
+        for table, references in (foreign_keys or {}).items():
+            for ref_table, _ in references.values():
+                if table in self.links and ref_table in self.links:
+                    self.links[table].add(ref_table)
+                    self.links[ref_table].add(table)
+        self.tokens = {table: estimate_tokens(table, columns) for table, columns in schema.items()}
+
+    def scores(self, question):
+        #BM25 score of every table for the question
+        query_terms = Counter(tokenize(question))
+        results = {}
+        for table, terms in self.documents.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[table] / (self.average_length or 1))
+            score = 0.0
+            for term, query_count in query_terms.items():
+                freq = terms.get(term)
+                if freq:
+                    score += query_count * self.idf[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            results[table] = score
+        return results
+
+    def select(self, question, top_k=None, token_budget=None):
+        """
+        Choose the tables to put in the prompt for a question
+        the top_k best scoring tables come first, then the tables they join to, added in score order until the
+        token budget is used up, the best table is always kept
+        if the whole schema already fits in the budget, or nothing in it matches the question, the full schema is returned
+
+        returns the pruned schema in the same format as the input
+        """
+        top_k = PruningConfig.top_k if top_k is None else top_k
+        token_budget = PruningConfig.token_budget if token_budget is None else token_budget
+        if sum(self.tokens.values()) <= token_budget:
+            return self.schema
+        scores = self.scores(question)
+        ranked = [table for table in sorted(scores, key=scores.get, reverse=True) if scores[table] > 0]
+        if not ranked:
+            return self.schema
+        chosen = ranked[:top_k]
+        neighbours = sorted({n for table in chosen for n in self.links.get(table, ())} - set(chosen),
+                            key=lambda table: scores.get(table, 0), reverse=True)
+        selected = []
+        used = 0
+        for table in chosen + neighbours:
+            if selected and used + self.tokens[table] > token_budget:
+                continue
+            selected.append(table)
+            used += self.tokens[table]
+        #keep the tables in their original order so the prompt reads the same way as the full schema
+        return {table: self.schema[table] for table in self.schema if table in selected}
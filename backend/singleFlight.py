@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+class SingleFlight:
+    """
+    Coalesces identical calls made at the same time from different threads, the first caller for a key runs the call
+    and everyone who asks for the same key while it is running waits for it and gets the same result (or exception)
+    """
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn):
+        """
+        Run fn() for key unless a call for key is already running, in which case wait for that one
+        returns (result, True if it came from someone else's call)
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+            else:
+                self.shared += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        try:
+            call["result"] = fn()
+            return call["result"], False
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+class AsyncSingleFlight:
+    """
+    The same for coroutines on one event loop, the call runs as its own task so a caller giving up
+    (a closed connection) doesn't cancel it for the others waiting on it
+    """
+    def __init__(self):
+        self.calls = {}
+        self.shared = 0
+
+    async def do(self, key, fn):
+        #await fn() for key unless a call for key is already running, returns (result, True if it came from someone else's call)
+        task = self.calls.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = self.calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        return await asyncio.shield(task), shared
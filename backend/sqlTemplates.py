@@ -0,0 +1,126 @@
+import re
+import threading
+from collections import OrderedDict
+from questionIndex import LITERAL_PATTERN
+from responseCache import normalize_question
+from config import TemplateCacheConfig
+
+#a quoted string in the generated SQL, text literals are only ever swapped inside these
+_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?$")
+
+def extract_literals(question):
+    """
+    The literal values in a question with their kind, numbers are "num" and quoted values or capitalised names are "text"
+    returns a list of (value, kind, (start, end)) in the order they appear
+    """
+    literals = []
+    for match in LITERAL_PATTERN.finditer(question or ""):
+        value = match.group().strip("'\"")
+        literals.append((value, "num" if _NUMBER.match(value) else "text", match.span()))
+    return literals
+
+def question_template(question, literals=None):
+    #the question with each literal swapped for a slot naming its kind, e.g. "how many orders in {num}"
+    literals = extract_literals(question) if literals is None else literals
+    pieces = []
+    last = 0
+    for _, kind, (start, end) in literals:
+        pieces.append(question[last:start])
+        pieces.append(f"{{{kind}}}")
+        last = end
+    pieces.append(question[last:])
+    return normalize_question("".join(pieces))
+
+def _literal_spans(sql, value, kind):
+    #where a question literal shows up in the SQL, numbers anywhere that isn't part of a name, text only inside quoted strings
+    if kind == "num":
+        pattern = re.compile(rf"(?<![\w.]){re.escape(value)}(?![\w.])")
+        return [match.span() for match in pattern.finditer(sql)]
+    pattern = re.compile(rf"(?<!\w){re.escape(value)}(?!\w)", re.IGNORECASE)
+    spans = []
+    for string in _SQL_STRING.finditer(sql):
+        inner_start, inner_end = string.start() + 1, string.end() - 1
+        spans.extend(match.span() for match in pattern.finditer(sql, inner_start, inner_end))
+    return spans
+
+def build_sql_template(question, sql):
+    """
+    Turn an answered question into a reusable template, every literal of the question has to appear in the SQL
+    and the literals have to be distinct, otherwise it isn't clear which value goes where
+    returns (question template, SQL parts) where the parts are strings and slot numbers, or None if it can't be templated
+    """
+    literals = extract_literals(question)
+    if not literals or len({value.lower() for value, _, _ in literals}) != len(literals):
+        return None
+    slots = []
+    for index, (value, kind, _) in enumerate(literals):
+        spans = _literal_spans(sql, value, kind)
+        if not spans:
+            return None
+        slots.extend((start, end, index) for start, end in spans)
+    slots.sort()
+    if any(slots[i][1] > slots[i + 1][0] for i in range(len(slots) - 1)):
+        return None
+    parts = []
+    last = 0
+    for start, end, index in slots:
+        parts.append(sql[last:start])
+        parts.append(index)
+        last = end
+    parts.append(sql[last:])
+    return question_template(question, literals), parts
+
+def fill_sql_template(parts, literals):
+    #put the new literal values into the slots, text is escaped for the quoted string it sits in
+    filled = []
+    for part in parts:
+        if isinstance(part, int):
+            value, kind, _ = literals[part]
+            filled.append(value if kind == "num" else value.replace("\\", "\\\\").replace("'", "''"))
+        else:
+            filled.append(part)
+    return "".join(filled)
+
+class TemplateCache:
+    """
+    Parameterised SQL for questions that only differ in their literals (a year, a name, a quoted value),
+    a question matching a template seen before on the same schema gets the SQL with its own values filled in
+    without the model being asked
+    parameters:
+    max_templates: templates kept, least recently used dropped first
+    """
+    def __init__(self, max_templates=None):
+        self.max_templates = TemplateCacheConfig.max_templates if max_templates is None else max_templates
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, scope, question, sql):
+        #learn a template from an answered question, scope is whatever the SQL depends on besides the question (model, schema)
+        template = build_sql_template(question, sql)
+        if template is None:
+            return False
+        key, parts = template
+        with self.lock:
+            self.templates[(scope, key)] = (question, parts)
+            self.templates.move_to_end((scope, key))
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return True
+
+    def lookup(self, scope, question):
+        """
+        Fill a known template with the question's literals
+        returns (SQL, the question the template was learned from), or None on a template miss
+        """
+        literals = extract_literals(question)
+        if not literals:
+            return None
+        key = (scope, question_template(question, literals))
+        with self.lock:
+            entry = self.templates.get(key)
+            if entry is None:
+                return None
+            self.templates.move_to_end(key)
+        source_question, parts = entry
+        return fill_sql_template(parts, literals), source_question
@@ -0,0 +1,417 @@
+import re
+import difflib
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import TokenType
+from sqlglot.optimizer.scope import traverse_scope
+
+#local checks on SQL against the schema it was written for, parsed into an AST with sqlglot (mysql dialect)
+#so nothing that is obviously wrong has to go to the database to find out
+
+READ = "read"
+WRITE = "write"
+DDL = "ddl"
+
+_READ_STATEMENTS = (exp.Select, exp.SetOperation, exp.Subquery, exp.Show, exp.Describe)
+_WRITE_STATEMENTS = (exp.Insert, exp.Update, exp.Delete, exp.Merge)
+_DDL_STATEMENTS = (exp.Create, exp.Drop, exp.Alter, exp.TruncateTable)
+#statements sqlglot only knows as a bare command, by their first word
+_READ_COMMANDS = {"SHOW", "DESCRIBE", "DESC", "EXPLAIN"}
+_WRITE_COMMANDS = {"REPLACE", "LOAD", "CALL", "HANDLER"}
+_CACHE_SIZE = 4096
+#how sqlglot writes a token in its error messages
+_TOKEN = re.compile(r"<Token token_type: [^,]*, text: ([^,]*),[^>]*>")
+
+class SqlParseError(ValueError):
+    #Raised when the text can't be parsed as SQL at all.
+    pass
+
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+
+def parse_sql(sql):
+    """
+    Parse SQL into its statements, the same text is only parsed once (the AST is copied on the way out)
+    returns a list of sqlglot expressions, raises SqlParseError if it isn't SQL
+    """
+    with _parsed_lock:
+        statements = _parsed.get(sql)
+        if statements is not None:
+            _parsed.move_to_end(sql)
+            return [statement.copy() for statement in statements]
+    try:
+        statements = [statement for statement in sqlglot.parse(sql or "", read="mysql") if statement is not None]
+    except SqlglotError as e:
+        details = getattr(e, "errors", None)
+        message = details[0]["description"] if details else str(e).splitlines()[0]
+        raise SqlParseError(_TOKEN.sub(lambda m: "the end" if m.group(1) == "SENTINEL" else f"'{m.group(1)}'", message)) from e
+    if not statements:
+        raise SqlParseError("no SQL statement")
+    with _parsed_lock:
+        _parsed[sql] = statements
+        while len(_parsed) > _CACHE_SIZE:
+            _parsed.popitem(last=False)
+    return [statement.copy() for statement in statements]
+
+def _statement_kind(statement):
+    if isinstance(statement, _READ_STATEMENTS):
+        #SELECT ... INTO a table writes
+        return WRITE if statement.args.get("into") else READ
+    if isinstance(statement, _WRITE_STATEMENTS):
+        return WRITE
+    if isinstance(statement, _DDL_STATEMENTS):
+        return DDL
+    if isinstance(statement, exp.Command):
+        word = str(statement.this).upper()
+        if word in _READ_COMMANDS:
+            return READ
+        if word in _WRITE_COMMANDS:
+            return WRITE
+        return DDL
+    return None
+
+def classify_sql(sql):
+    """
+    Whether SQL only reads, writes rows or changes the schema, from its AST rather than the words in it
+    (so SELECT updated_at is a read), several statements are classed by the most dangerous one
+    returns READ, WRITE or DDL, raises SqlParseError if it isn't a SQL statement
+    """
+    kinds = [_statement_kind(statement) for statement in parse_sql(sql)]
+    if None in kinds:
+        raise SqlParseError("not a SQL statement")
+    for kind in (DDL, WRITE):
+        if kind in kinds:
+            return kind
+    return READ
+
+def _lower_schema(schema):
+    return {str(name).lower(): {str(column).lower() for column in (columns or {})} for name, columns in schema.items()}
+
+def _source_columns(source, tables):
+    #column names a FROM source provides, None when they can't be known (a table function, SELECT * from a derived table)
+    if isinstance(source, exp.Table):
+        #a table qualified with a database (information_schema.tables, otherdb.t) isn't in the schema, which is one database's
+        return tables.get(source.name.lower()) if not source.db else None
+    expression = getattr(source, "expression", None)
+    if isinstance(expression, (exp.Select, exp.SetOperation)):
+        if any(isinstance(projection, exp.Star) or (isinstance(projection, exp.Column) and projection.is_star)
+               for projection in expression.selects):
+            return None
+        return {name.lower() for name in expression.named_selects}
+    return None
+
+def _add(problems, problem):
+    if problem not in problems:
+        problems.append(problem)
+
+def _find_problems(statements, tables):
+    problems = []
+    for statement in statements:
+        kind = _statement_kind(statement)
+        if kind is None:
+            return ["not a SQL statement"]
+        if kind == DDL or isinstance(statement, (exp.Show, exp.Describe, exp.Command)):
+            continue
+        if isinstance(statement, _WRITE_STATEMENTS):
+            _write_problems(statement, tables, problems)
+            #queries inside the statement (INSERT ... SELECT, WHERE id IN (SELECT ...)) are checked on their own
+            for select in statement.find_all(exp.Select):
+                if _outermost_select(select, statement):
+                    _query_problems(select, tables, problems)
+        else:
+            _query_problems(statement, tables, problems)
+    return problems
+
+def _outermost_select(node, statement):
+    parent = node.parent
+    while parent is not None and parent is not statement:
+        if isinstance(parent, exp.Select):
+            return False
+        parent = parent.parent
+    return True
+
+def _write_problems(statement, tables, problems):
+    #the tables an INSERT / UPDATE / DELETE writes to and the columns it names outside any subquery
+    #a multi table DELETE names what it deletes from by alias (DELETE o FROM orders o JOIN ...), those are resolved
+    #against the FROM / JOIN tables after them
+    deleted = (statement.args.get("tables") or []) if isinstance(statement, exp.Delete) else []
+    targets = {}
+    #aliases and names of tables in other databases, their columns can't be checked
+    elsewhere = set()
+    for table in statement.find_all(exp.Table):
+        if table.find_ancestor(exp.Select) or any(table is target for target in deleted):
+            continue
+        name = table.name.lower()
+        if table.db:
+            elsewhere.add(table.alias.lower() if table.alias else name)
+            continue
+        if name not in tables:
+            _add(problems, f"unknown table {table.name}")
+            continue
+        targets[name] = name
+        if table.alias:
+            targets[table.alias.lower()] = name
+    for table in deleted:
+        name = table.name.lower()
+        if not table.db and name not in targets and name not in elsewhere and name not in tables:
+            _add(problems, f"unknown table {table.name}")
+    if not targets:
+        return
+    target = statement.this
+    if isinstance(target, exp.Schema) and isinstance(target.this, exp.Table) and not target.this.db:
+        columns = tables.get(target.this.name.lower())
+        for identifier in target.expressions:
+            if columns is not None and isinstance(identifier, exp.Identifier) and identifier.name.lower() not in columns:
+                _add(problems, f"unknown column {identifier.name}")
+    visible = set().union(*(tables[name] for name in targets.values()))
+    for column in statement.find_all(exp.Column):
+        if column.find_ancestor(exp.Select) or column.is_star:
+            continue
+        if column.table:
+            table = targets.get(column.table.lower())
+            if table is not None and column.name.lower() not in tables[table]:
+                _add(problems, f"unknown column {column.table}.{column.name}")
+        elif not elsewhere and column.name.lower() not in visible:
+            _add(problems, f"unknown column {column.name}")
+
+def _query_problems(query, tables, problems):
+    #every table and column of a query, resolved scope by scope (subqueries, CTEs and derived tables included)
+    try:
+        scopes = traverse_scope(query)
+    except SqlglotError:
+        return
+    for scope in scopes:
+        for table in scope.tables:
+            if table.db:
+                #another database's table, the schema only covers the current one
+                continue
+            if table.name.lower() not in tables and not _cte_visible(scope, table.name.lower()):
+                _add(problems, f"unknown table {table.name}")
+        #names given with AS in the select list can be used in ORDER BY / HAVING
+        aliases = {projection.alias.lower() for projection in getattr(scope.expression, "selects", []) if isinstance(projection, exp.Alias)}
+        for column in scope.columns:
+            name = column.name.lower()
+            if not name or column.is_star or not _in_scope(column, scope):
+                continue
+            if column.table:
+                columns = _qualified_columns(scope, column.table, tables)
+                if columns is not None and name not in columns:
+                    _add(problems, f"unknown column {column.table}.{column.name}")
+                continue
+            if name in aliases:
+                continue
+            candidates = _visible_columns(scope, tables)
+            if candidates is not None and name not in candidates:
+                _add(problems, f"unknown column {column.name}")
+
+def _in_scope(column, scope):
+    #a scope also lists the outside columns its subqueries use, those are checked in the subquery's own scope
+    node = column.parent
+    while node is not None and node is not scope.expression:
+        if isinstance(node, exp.Select):
+            return False
+        node = node.parent
+    return True
+
+def _cte_visible(scope, name):
+    #a CTE defined further out (or on the statement) can be used by name in a nested query
+    while scope is not None:
+        if name in {key.lower() for key in scope.cte_sources}:
+            return True
+        scope = scope.parent
+    return False
+
+def _qualified_columns(scope, qualifier, tables):
+    #columns of the source a table.column reference points at, searching the enclosing queries for correlated references
+    qualifier = qualifier.lower()
+    while scope is not None:
+        for alias, source in scope.sources.items():
+            if alias.lower() == qualifier:
+                return _source_columns(source, tables)
+        scope = scope.parent if scope.is_subquery else None
+    return None
+
+def _visible_columns(scope, tables):
+    #every column an unqualified name could refer to, None if one of the sources has columns we can't know
+    columns = set()
+    while scope is not None:
+        for source in scope.sources.values():
+            provided = _source_columns(source, tables)
+            if provided is None:
+                #an unknown table (reported already) or a source whose columns can't be known
+                return None
+            columns |= provided
+        #only a subquery in WHERE / SELECT can use the columns of the query around it, a CTE or derived table can't
+        scope = scope.parent if scope.is_subquery else None
+    return columns
+
+_validated = OrderedDict()
+_validated_lock = threading.Lock()
+
+def validate_sql(sql, schema):
+    """
+    Look for the mistakes a model makes most, text that isn't SQL, tables that aren't in the schema and
+    columns none of the tables in the query have, the result is cached per statement and schema
+    parameters:
+    sql: the generated statement
+    schema: table name to column name to type, as used in the prompt
+    returns a list of problems, empty when nothing is wrong
+    """
+    key = (sql, hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode("utf-8")).hexdigest())
+    with _validated_lock:
+        problems = _validated.get(key)
+        if problems is not None:
+            _validated.move_to_end(key)
+            return list(problems)
+    try:
+        statements = parse_sql(sql)
+        tables = _lower_schema(schema) if isinstance(schema, dict) and schema else None
+        if tables is None:
+            problems = ["not a SQL statement"] if any(_statement_kind(s) is None for s in statements) else []
+        else:
+            problems = _find_problems(statements, tables)
+    except SqlParseError as e:
+        problems = [f"syntax error: {e}"]
+    with _validated_lock:
+        _validated[key] = problems
+        while len(_validated) > _CACHE_SIZE:
+            _validated.popitem(last=False)
+    return list(problems)
+
+def repair_sql(sql, schema):
+    """
+    Fix tables and columns the model got slightly wrong (a typo, a plural), each unknown name is swapped for the
+    closest name in the schema if it is close enough, and the repaired SQL has to pass validation
+    returns the SQL (unchanged if there was nothing wrong with it), or None if it can't be repaired
+    """
+    if not validate_sql(sql, schema):
+        return sql
+    if not isinstance(schema, dict) or not schema:
+        return None
+    try:
+        statements = parse_sql(sql)
+    except SqlParseError:
+        return None
+    tables = _lower_schema(schema)
+    all_columns = sorted(set().union(*tables.values()))
+    for statement in statements:
+        #CTE names and table aliases (DELETE o FROM orders o) aren't misspelt tables
+        known = {cte.alias.lower() for cte in statement.find_all(exp.CTE)} | {table.alias.lower() for table in statement.find_all(exp.Table) if table.alias}
+        for table in statement.find_all(exp.Table):
+            name = table.name.lower()
+            if name and not table.db and name not in tables and name not in known:
+                match = difflib.get_close_matches(name, list(tables), n=1, cutoff=0.8)
+                if not match:
+                    return None
+                table.set("this", exp.to_identifier(match[0]))
+    for problem in _find_problems(statements, tables):
+        if not problem.startswith("unknown column "):
+            return None
+        wrong = problem[len("unknown column "):].split(".")[-1].lower()
+        match = difflib.get_close_matches(wrong, all_columns, n=1, cutoff=0.8)
+        if not match:
+            return None
+        for statement in statements:
+            for column in statement.find_all(exp.Column):
+                if column.name.lower() == wrong:
+                    column.set("this", exp.to_identifier(match[0]))
+    repaired = "; ".join(statement.sql(dialect="mysql") for statement in statements)
+    return repaired if not validate_sql(repaired, schema) else None
+
+def _statement_text(sql):
+    #the text of a single statement without its trailing semicolon or comments, so something can be added after it
+    tokens = [token for token in sqlglot.Dialect.get_or_raise("mysql").tokenize(sql) if token.token_type != TokenType.SEMICOLON]
+    return sql[:tokens[-1].end + 1] if tokens else None
+
+def limit_sql(sql, limit, offset=0):
+    """
+    The query as the user wrote it with LIMIT (and OFFSET) added after it, so mysql stops once it has the rows
+    the text is left exactly as it is otherwise (same column headers, same ORDER BY)
+    returns the new SQL, or None if it isn't a single SELECT or already has its own LIMIT / OFFSET / row locks,
+    then it has to run unchanged and the rows are capped while fetching
+    """
+    try:
+        statements = parse_sql(sql)
+    except SqlParseError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.SetOperation)):
+        return None
+    query = statements[0]
+    #LIMIT can't go after INTO or FOR UPDATE / LOCK IN SHARE MODE
+    if query.args.get("limit") is not None or query.args.get("offset") is not None or query.args.get("into") or query.args.get("locks"):
+        return None
+    text = _statement_text(sql)
+    if text is None:
+        return None
+    #on its own line, a trailing -- comment in the text would swallow it otherwise
+    return f"{text}\nLIMIT {int(limit)}" + (f" OFFSET {int(offset)}" if offset else "")
+
+def time_limit_sql(sql, milliseconds):
+    """
+    The same SELECT with a MAX_EXECUTION_TIME optimizer hint right after its leading SELECT keyword, so mysql itself
+    stops it once the time is up, the rest of the text is left exactly as it was written
+    (mysql only honours the hint on SELECTs, other statements have to be killed)
+    returns the new SQL, or None if it isn't a single statement starting with SELECT
+    """
+    try:
+        statements = parse_sql(sql)
+    except SqlParseError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.SetOperation)) or statements[0].args.get("into"):
+        return None
+    tokens = sqlglot.Dialect.get_or_raise("mysql").tokenize(sql)
+    #WITH ... or (SELECT ...) has no leading SELECT to put the hint on, the watchdog stops those
+    if not tokens or tokens[0].token_type != TokenType.SELECT:
+        return None
+    hint = f"MAX_EXECUTION_TIME({max(1, int(milliseconds))})"
+    after = tokens[0].end + 1
+    if len(tokens) > 1 and tokens[1].token_type == TokenType.HINT:
+        #only the first hint comment of a query block counts, so it goes inside the one already there
+        inside = tokens[1].start + len("/*+")
+        return f"{sql[:inside]} {hint}{sql[inside:]}"
+    return f"{sql[:after]} /*+ {hint} */{sql[after:]}"
+
+#functions whose result changes from one run to the next, a query using them can't be answered from a cache
+_VOLATILE_FUNCTIONS = {
+    "NOW", "SYSDATE", "CURDATE", "CURTIME", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "LOCALTIME", "LOCALTIMESTAMP",
+    "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP", "UNIX_TIMESTAMP", "RAND", "UUID", "UUID_SHORT", "CONNECTION_ID", "LAST_INSERT_ID",
+    "FOUND_ROWS", "ROW_COUNT", "USER", "CURRENT_USER", "SESSION_USER", "SYSTEM_USER", "DATABASE", "SCHEMA", "CURRENT_SCHEMA",
+    "SLEEP", "BENCHMARK", "GET_LOCK", "RELEASE_LOCK", "IS_FREE_LOCK", "IS_USED_LOCK",
+}
+
+def cacheable_sql(sql):
+    """
+    The canonical text of a read whose result only depends on the data (same statement however it is spaced or cased),
+    for keying a result cache
+    returns the canonical SQL, or None for anything that writes, locks rows or calls a volatile function like NOW()
+    """
+    try:
+        statements = parse_sql(sql)
+    except SqlParseError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.SetOperation)):
+        return None
+    statement = statements[0]
+    if statement.args.get("into") or any(select.args.get("locks") for select in statement.find_all(exp.Select)):
+        return None
+    for function in statement.find_all(exp.Func):
+        name = function.name if isinstance(function, exp.Anonymous) else function.sql_name()
+        if name.upper() in _VOLATILE_FUNCTIONS:
+            return None
+    return statement.sql(dialect="mysql")
+
+def databases_named(sql):
+    """
+    The databases a statement names in qualified table names (db.table), for working out whose cached results it changes
+    returns a set (empty when it only uses unqualified tables), or None if it can't be parsed
+    """
+    try:
+        statements = parse_sql(sql)
+    except SqlParseError:
+        return None
+    return {table.db for statement in statements for table in statement.find_all(exp.Table) if table.db}
@@ -35,10 +35,13 @@ function App() {
   const [schemaPreview, setSchemaPreview] = useState({});
   const [showSchemaSidebar, setShowSchemaSidebar] = useState(true);
   const [autocompleteEnabled, setAutocompleteEnabled] = useState(true);
+  const [uploadProgress, setUploadProgress] = useState(""); // progress text while a background upload job runs
+  const [datasetId, setDatasetId] = useState(null); // id the backend registered the uploaded file under
   
   // event handles
   const handleDatasetChange = (e) => {
     setDataset(e.target.files[0]); //updata the dataset state with the file which is uploaed in the upload section
+    setDatasetId(null); // a new file needs uploading before it has an id
   };
 
   // table sorting helper 
@@ -50,6 +53,84 @@ function App() {
     setSortConfig({ key, direction });
   };
 
+  // refer to the dataset by its registered id once we have one, so the file isn't uploaded again for every request
+  const appendDataset = (formData) => {
+    if (datasetId) {
+      formData.append("datasetId", datasetId);
+    } else {
+      formData.append("dataset", dataset);
+    }
+  };
+
+  // poll a background upload job until it finishes, showing the rows loaded so far on the upload button
+  const waitForIngestJob = async (jobId) => {
+    while (true) {
+      const jobResponse = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/jobs/${jobId}`);
+      const job = await jobResponse.json();
+      if (!jobResponse.ok) {
+        throw new Error(job.error || "Could not check the upload progress.");
+      }
+      if (job.phase === "done") {
+        return job;
+      }
+      if (job.phase === "failed") {
+        throw new Error(job.errors.join(" ") || "Dataset upload failed.");
+      }
+      setUploadProgress(`Loaded ${job.rowsLoaded} rows (${job.tablesDone} tables)...`);
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  };
+
+  // ask for the SQL over server-sent events, showing the query as the model writes it
+  // resolves with the same json /api/generate-query returns once the final "result" event arrives
+  const streamGeneratedQuery = async (formData) => {
+    const genResponse = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/generate-query-stream`, {
+      method: "POST",
+      body: formData,
+    });
+    if (!genResponse.ok) {
+      let errorMsg = "";
+      try {
+        const errorJson = await genResponse.json();
+        errorMsg = errorJson.message || "Unknown error occurred.";
+      } catch (jsonParseError) {
+        errorMsg = await genResponse.text();
+      }
+      throw new Error(`Generate Query Error: ${errorMsg}`);
+    }
+    const reader = genResponse.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let partial = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) {
+        throw new Error("Generate Query Error: the response ended before the query was finished.");
+      }
+      buffer += decoder.decode(value, { stream: true });
+      // events are separated by a blank line, the last piece may still be incomplete
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const block of events) {
+        const eventLine = block.split("\n").find((line) => line.startsWith("event: "));
+        const dataLine = block.split("\n").find((line) => line.startsWith("data: "));
+        if (!eventLine || !dataLine) continue;
+        const eventType = eventLine.slice(7);
+        const data = JSON.parse(dataLine.slice(6));
+        if (eventType === "token") {
+          partial += data.text;
+          setGeneratedSQL(partial);
+        } else if (eventType === "result") {
+          // the streamed text might have been a clarifying question, only the result says which
+          setGeneratedSQL("");
+          return data;
+        } else if (eventType === "error") {
+          throw new Error(data.message);
+        }
+      }
+    }
+  };
+
   // Upload dataset by calling the /api/upload-dataset endpoint
   const handleDatasetUpload = async () => {
     if (!dataset) {
@@ -75,11 +156,22 @@ function App() {
         setDataset(null); // Clear the invalid dataset
         return;
       } else {
+        // big uploads load in the background, wait for the job before showing the schema
+        if (data.jobId) {
+          try {
+            await waitForIngestJob(data.jobId);
+          } catch (jobErr) {
+            setError(jobErr.message);
+            setDataset(null);
+            return;
+          }
+        }
         // grab the an overview of the scheam for the the sidebar
         setError("");
         setNewDatabaseCreated(data.newDatabaseCreated);
+        setDatasetId(data.datasetId);
         const schemaForm = new FormData();
-        schemaForm.append("dataset", dataset);
+        schemaForm.append("datasetId", data.datasetId);
         const previewResponse = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/schema-preview`, {
           method: "POST",
           body: schemaForm
@@ -94,6 +186,7 @@ function App() {
       setError(err.message);
     } finally {
       setLoading(false);
+      setUploadProgress("");
     }
   };
 
@@ -109,7 +202,7 @@ function App() {
     setLoading(true);
     try {
       const formData = new FormData();
-      formData.append("dataset", dataset);
+      appendDataset(formData);
       formData.append("host", phpHost);
       formData.append("user", phpUser);
       formData.append("password", phpPassword);
@@ -127,6 +220,7 @@ function App() {
         alert(data.message);
         setNewDatabaseCreated(false); // Reset after removal
         setDataset(null);
+        setDatasetId(null);
         setSchemaPreview({});
       }
     } catch (err) {
@@ -160,31 +254,11 @@ function App() {
       // Prepare form data with the persisted dataset and the question
       const formData = new FormData(); 
       //appedning the file and question to the formdata obeject so that it can be sent together to the server
-      formData.append("dataset", dataset);
+      appendDataset(formData);
       formData.append("question", question);
 
-      // Call API to generate SQL query
-      const genResponse = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/generate-query`, {
-        method: "POST", //send a post request to the generate query api endepoint 
-        body: formData,
-      });
-      if (!genResponse.ok) {//throw an error if response is not ok
-        let errorMsg = "";
-        try {
-          const errorJson = await genResponse.json();
-          // If the server returned { "type": "error", "message": "..."},
-          // we can grab that message directly
-          errorMsg = errorJson.message || "Unknown error occurred.";
-        } catch (jsonParseError) {
-          // If parsing fails (not valid JSON), fall back to plain text
-          errorMsg = await genResponse.text();
-        }
-        throw new Error(`Execute Query Error: ${errorMsg}`);
-      }
-      //update the generateSQL state to the response from the api
-      const genText = await genResponse.text();
-      console.log("Raw generate-query response:", genText);
-      const genData = JSON.parse(genText);
+      // Call API to generate SQL query, the query appears as it is generated
+      const genData = await streamGeneratedQuery(formData);
       // Check if the response is a clarification prompt
       if (genData.type === "clarification") {
         // Display clarifying question to the user
@@ -239,18 +313,10 @@ function App() {
     setLoading(true);
     try {
       const formData = new FormData();
-      formData.append("dataset", dataset);
+      appendDataset(formData);
       formData.append("question", updatedQuestion);
 
-      const genResponse = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/generate-query`, {
-        method: "POST",
-        body: formData,
-      });
-      if (!genResponse.ok) {
-        const errorMsg = await genResponse.text();
-        throw new Error(`Generate Query Error: ${errorMsg}`);
-      }
-      const genData = await genResponse.json();
+      const genData = await streamGeneratedQuery(formData);
 
       if (genData.type === "clarification") {
         setClarificationMessage(genData.message);
@@ -496,7 +562,7 @@ function App() {
           onMouseOver={(e) => (e.target.style.backgroundColor = "#1565c0")}
           onMouseOut={(e) => (e.target.style.backgroundColor = "#1976d2")}
           >
-            {loading ? "Uploading..." : "Upload Dataset"}
+            {loading ? (uploadProgress || "Uploading...") : "Upload Dataset"}
           </button>
         </div>
       </div>
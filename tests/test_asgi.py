@@ -0,0 +1,208 @@
+import os
+import time
+import contextlib
+import asyncio
+import pytest
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+import api
+import asgi
+from asyncModelClient import AsyncModelClient
+from datasetRegistry import DatasetRegistry
+from responseCache import ResponseCache
+
+SCHEMA = {"orders": {"order_id": "int", "total": "float"}}
+
+#stands in for AsyncOpenAI, every completion takes a while and the calls are counted
+class FakeAsyncOpenAI:
+    def __init__(self, delay=0.2):
+        self.calls = 0
+        fake = self
+
+        class Completions:
+            async def create(self, model, messages, stream=False, timeout=None):
+                fake.calls += 1
+                answer = f"SELECT COUNT(*) FROM orders -- {messages[-1]['content']}"
+                if stream:
+                    return fake.chunks(answer)
+                await asyncio.sleep(delay)
+                message = type("Message", (), {"content": answer})
+                return type("Completion", (), {"choices": [type("Choice", (), {"message": message})]})
+
+        self.chat = type("Chat", (), {"completions": Completions()})
+
+    async def chunks(self, answer):
+        #the answer a few words at a time, like the streaming api
+        for word in answer.split(" "):
+            await asyncio.sleep(0)
+            delta = type("Delta", (), {"content": word + " "})
+            yield type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})]})
+
+@pytest.fixture
+def async_app(tmp_path, monkeypatch):
+    fake = FakeAsyncOpenAI()
+    client = AsyncModelClient(fake, "model", response_cache=ResponseCache(path=""))
+    #only the exact cache, so every distinct question reaches the fake model
+    client.question_index = None
+    client.template_cache = None
+    monkeypatch.setattr(asgi, "async_model_client", client)
+    registry = DatasetRegistry(directory=str(tmp_path))
+    registry.add("abc123", "shop.json", {"database": None, "schema": SCHEMA, "preview": {}, "rowCounts": {}})
+    monkeypatch.setattr(api, "dataset_registry", registry)
+    return fake
+
+def post_question(client, question):
+    return client.post("/api/generate-query", data={"datasetId": "abc123", "question": question})
+
+@pytest.mark.unit
+def test_model_calls_run_concurrently(async_app):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(post_question(client, f"question {i}") for i in range(20)))
+            return responses, time.perf_counter() - start
+    responses, elapsed = asyncio.run(run())
+    assert all(r.status_code == 200 and r.json()["type"] == "sql" for r in responses)
+    assert async_app.calls == 20
+    #twenty 0.2s model calls overlap instead of taking 4s back to back
+    assert elapsed < 2
+
+@pytest.mark.unit
+def test_identical_questions_share_one_model_call(async_app):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(post_question(client, "how many orders") for _ in range(10)))
+    responses = asyncio.run(run())
+    assert len({r.text for r in responses}) == 1
+    assert async_app.calls == 1
+
+@pytest.mark.unit
+def test_errors_and_flask_routes_still_served(async_app):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            missing = await client.post("/api/generate-query", data={"datasetId": "feed", "question": "q"})
+            no_question = await client.post("/api/generate-query", data={"datasetId": "abc123"})
+            job = await client.get("/api/jobs/unknown")
+            return missing, no_question, job
+    missing, no_question, job = asyncio.run(run())
+    assert missing.status_code == 404
+    assert no_question.status_code == 400
+    #served by the flask app mounted underneath
+    assert job.status_code == 404
+
+#one table mysql connection for the execute option of a batch
+class FakeConnection:
+    connection_id = 7
+
+    def cursor(self):
+        class Cursor:
+            description = [("count",)]
+            def execute(self, query):
+                pass
+            def fetchmany(self, size):
+                return [(7,)]
+            def close(self):
+                pass
+        return Cursor()
+
+    def close(self):
+        pass
+
+def run_batch(data):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            response = await client.post("/api/generate-batch", data=data)
+            return response, time.perf_counter() - start
+    return asyncio.run(run())
+
+@pytest.mark.unit
+def test_batch_fans_out_with_a_concurrency_limit(async_app):
+    import json
+    questions = [f"question {i}" for i in range(30)]
+    response, elapsed = run_batch({"datasetId": "abc123", "questions": json.dumps(questions), "concurrency": "10"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.status_code == 200
+    assert lines[-1]["done"] and lines[-1]["questions"] == 30 and lines[-1]["errors"] == 0
+    assert sorted(line["index"] for line in lines[:-1]) == list(range(30))
+    assert all(line["response"]["query"].endswith(line["question"]) for line in lines[:-1])
+    #three rounds of 0.2s, not thirty
+    assert 0.55 < elapsed < 2.5
+    assert async_app.calls == 30
+
+@pytest.mark.unit
+def test_batch_can_execute_selects(async_app):
+    import json
+    asgi.async_model_client.mysql_connection = lambda: contextlib.nullcontext(FakeConnection())
+    response, _ = run_batch({"datasetId": "abc123", "questions": json.dumps(["how many orders"]), "execute": "true"})
+    item = json.loads(response.text.splitlines()[0])
+    assert item["results"] == [{"count": 7}]
+
+@pytest.mark.unit
+def test_async_client_keeps_the_blocking_run_query(async_app):
+    asgi.async_model_client.mysql_connection = lambda: contextlib.nullcontext(FakeConnection())
+    assert asgi.async_model_client.run_query("SELECT COUNT(*) FROM orders") == [{"count": 7}]
+    assert asyncio.run(asgi.async_model_client.run_query_async("SELECT COUNT(*) FROM orders")) == [{"count": 7}]
+
+@pytest.mark.unit
+def test_batch_reports_query_failures_as_they_are(async_app, caplog):
+    import json
+    from queryControl import QueryTimeoutError
+    def too_slow(sql_query, confirmed=False):
+        raise QueryTimeoutError("The query ran for longer than 30 seconds and was stopped.")
+    asgi.async_model_client.run_query_result = too_slow
+    response, _ = run_batch({"datasetId": "abc123", "questions": json.dumps(["how many orders"]), "execute": "true"})
+    item = json.loads(response.text.splitlines()[0])
+    assert item["error"] == "The query ran for longer than 30 seconds and was stopped."
+    assert "Unhandled error" not in caplog.text
+
+@pytest.mark.unit
+@pytest.mark.parametrize("sql, runs", [
+    ("SELECT COUNT(*) FROM orders", True),
+    ("WITH big AS (SELECT * FROM orders WHERE total > 10) SELECT COUNT(*) FROM big", True),
+    ("WITH old AS (SELECT order_id FROM orders) DELETE FROM orders WHERE order_id IN (SELECT order_id FROM old)", False),
+    ("DROP TABLE orders", False),
+    ("not sql (", False),
+])
+def test_batch_only_runs_reads(sql, runs):
+    assert asgi._reads_only(sql) == runs
+
+@pytest.mark.unit
+def test_batch_rejects_bad_requests(async_app):
+    assert run_batch({"datasetId": "abc123", "questions": "{\"a\": 1}"})[0].status_code == 400
+    assert run_batch({"datasetId": "abc123", "questions": "[]"})[0].status_code == 400
+    assert run_batch({"questions": "[\"q\"]"})[0].status_code == 400
+    assert run_batch({"datasetId": "feed", "questions": "[\"q\"]"})[0].status_code == 404
+
+def parse_sse(text):
+    #list of (event, data) from a server-sent event stream
+    import json
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+@pytest.mark.unit
+def test_stream_sends_tokens_then_the_result(async_app):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.post("/api/generate-query-stream", data={"datasetId": "abc123", "question": "how many orders"})
+            again = await client.post("/api/generate-query-stream", data={"datasetId": "abc123", "question": "how many orders"})
+            return first, again
+    first, again = asyncio.run(run())
+    assert first.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(first.text)
+    tokens = [data["text"] for event, data in events if event == "token"]
+    assert len(tokens) > 1
+    assert events[-1] == ("result", {"type": "sql", "query": "SELECT COUNT(*) FROM orders -- how many orders"})
+    assert "".join(tokens).strip() == events[-1][1]["query"]
+    #the second time the answer is cached so there is only the result
+    assert parse_sse(again.text) == [events[-1]]
+    assert async_app.calls == 1
@@ -0,0 +1,51 @@
+import pytest
+import pandas as pd
+from columnProfile import DatasetProfiler, ColumnProfile, SKETCH_SIZE, preview_from_profile, prompt_values
+
+@pytest.mark.unit
+def test_profile_stats_across_chunks():
+    profiler = DatasetProfiler()
+    profiler.observe_rows("orders", [{"id": 1, "status": "new"}, {"id": 2, "status": None}])
+    profiler.observe_rows("orders", [{"id": 3, "status": "new"}, {"id": 4, "status": "paid", "note": "late"}])
+    stats = profiler.to_dict()["orders"]
+    assert stats["id"]["min"] == 1 and stats["id"]["max"] == 4
+    assert stats["id"]["distinct"] == 4 and stats["id"]["distinctExact"]
+    assert stats["status"]["nulls"] == 1 and stats["status"]["nullRatio"] == 0.25
+    assert stats["status"]["topValues"][0] == {"value": "new", "count": 2}
+    assert stats["status"]["samples"] == ["new", "paid"]
+    #a column that only shows up in the last row was null everywhere before it
+    assert stats["note"]["count"] == 4 and stats["note"]["nulls"] == 3
+    assert profiler.row_counts == {"orders": 4}
+
+@pytest.mark.unit
+def test_distinct_estimate_for_many_values():
+    profile = ColumnProfile()
+    for start in range(0, 20000, 5000):
+        profile.update(pd.Series(range(start, start + 5000), dtype=object))
+    distinct, exact = profile.distinct()
+    assert not exact
+    assert 16000 < distinct < 24000
+    assert len(profile.sketch) == SKETCH_SIZE
+
+@pytest.mark.unit
+def test_heavy_hitters_survive_many_rare_values():
+    profile = ColumnProfile()
+    rows = ["common"] * 500 + [f"rare{i}" for i in range(1000)]
+    profile.update(pd.Series(rows, dtype=object))
+    assert profile.to_dict()["topValues"][0]["value"] == "common"
+
+@pytest.mark.unit
+def test_mixed_and_nested_values():
+    profile = ColumnProfile()
+    profile.update(pd.Series([1, "a", {"x": 1}, [1, 2], None], dtype=object))
+    stats = profile.to_dict()
+    assert stats["distinct"] == 4 and stats["nulls"] == 1
+    assert stats["min"] is not None and stats["max"] is not None
+
+@pytest.mark.unit
+def test_preview_and_prompt_values():
+    profiler = DatasetProfiler()
+    profiler.observe_rows("t", [{"city": "Oslo"}, {"city": "Oslo"}, {"city": "Rome"}])
+    profile = profiler.to_dict()
+    assert preview_from_profile(profile) == {"t": {"city": ["Oslo", "Rome"]}}
+    assert prompt_values(profile) == {"t": {"city": ["Oslo", "Rome"]}}
@@ -0,0 +1,120 @@
+import time
+import threading
+import pytest
+import mysql.connector
+from mysql.connector import errors
+import connectionPool
+from connectionPool import ConnectionPool, ConnectionUnavailableError, connection_pool, close_pool
+
+#stands in for a mysql connection, counts pings and closes
+class FakeConnection:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+        self.pings = 0
+        self.autocommit = False
+        self.in_transaction = False
+        self.unread_result = False
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if not self.alive:
+            raise errors.InterfaceError("gone away")
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def connections(monkeypatch):
+    made = []
+    def connect(**kwargs):
+        made.append(FakeConnection())
+        return made[-1]
+    monkeypatch.setattr(mysql.connector, "connect", connect)
+    return made
+
+@pytest.mark.unit
+def test_connections_are_reused(connections):
+    pool = ConnectionPool({"host": "h"}, size=2, ping_after=60)
+    for _ in range(5):
+        with pool.connection() as conn:
+            assert conn.autocommit is True
+    stats = pool.stats()
+    assert len(connections) == 1
+    assert stats["checkouts"] == 5 and stats["created"] == 1 and stats["reused"] == 4
+    assert stats["open"] == 1 and stats["idle"] == 1 and stats["inUse"] == 0
+
+@pytest.mark.unit
+def test_waits_for_a_busy_pool_and_times_out(connections):
+    pool = ConnectionPool({"host": "h"}, size=1, wait_seconds=0.1)
+    held = pool.acquire()
+    with pytest.raises(ConnectionUnavailableError):
+        pool.acquire()
+    #a connection given back wakes up a waiting caller
+    threading.Timer(0.05, pool.release, args=(held,)).start()
+    pool.wait_seconds = 2
+    assert pool.acquire() is held
+    stats = pool.stats()
+    assert stats["waits"] == 2 and stats["waitTimeouts"] == 1 and stats["maxWaitSeconds"] > 0
+
+@pytest.mark.unit
+def test_health_check_replaces_dead_connections(connections):
+    pool = ConnectionPool({"host": "h"}, size=2, ping_after=0)
+    with pool.connection():
+        pass
+    connections[0].alive = False
+    with pool.connection() as conn:
+        assert conn is connections[1]
+    assert connections[0].closed and pool.stats()["healthCheckFailures"] == 1
+
+@pytest.mark.unit
+def test_idle_connections_are_evicted(connections):
+    pool = ConnectionPool({"host": "h"}, size=2, idle_seconds=0.05)
+    with pool.connection():
+        pass
+    time.sleep(0.06)
+    with pool.connection() as conn:
+        assert conn is connections[1]
+    assert connections[0].closed and pool.stats()["evictedIdle"] == 1
+
+@pytest.mark.unit
+def test_broken_and_dirty_connections_are_not_given_back(connections):
+    pool = ConnectionPool({"host": "h"}, size=2)
+    with pytest.raises(errors.OperationalError):
+        with pool.connection():
+            raise errors.OperationalError("lost connection")
+    assert connections[0].closed
+    with pool.connection() as conn:
+        conn.unread_result = True
+    assert connections[1].closed
+    #an open transaction is rolled back and the connection kept
+    with pool.connection() as conn:
+        conn.in_transaction = True
+    assert pool.stats()["idle"] == 1 and connections[2].in_transaction is False
+
+@pytest.mark.unit
+def test_connect_failures_free_the_slot(monkeypatch):
+    def refuse(**kwargs):
+        raise errors.DatabaseError("refused")
+    monkeypatch.setattr(mysql.connector, "connect", refuse)
+    pool = ConnectionPool({"host": "h"}, size=1, wait_seconds=0)
+    for _ in range(2):
+        with pytest.raises(ConnectionUnavailableError, match="Could not connect"):
+            pool.acquire()
+    assert pool.stats()["open"] == 0
+
+@pytest.mark.unit
+def test_pools_by_host_user_and_database(connections, monkeypatch):
+    monkeypatch.setattr(connectionPool, "_pools", {})
+    pool = connection_pool("h", "u", "p", "db")
+    assert connection_pool("h", "u", "p", "db") is pool
+    assert connection_pool("h", "u", "p") is not pool
+    assert "database" not in connection_pool("h", "u", "p").connect_args
+    #new credentials replace the pool
+    replaced = connection_pool("h", "u", "new", "db")
+    assert replaced is not pool and pool.closed
+    close_pool("h", "u", "db")
+    assert replaced.closed and connection_pool("h", "u", "new", "db") is not replaced
@@ -0,0 +1,70 @@
+import io
+import json
+import pytest
+from datasetRegistry import DatasetRegistry, DatasetNotFoundError
+
+DATASET = [
+    {"type": "database", "name": "Shop"},
+    {"type": "table", "name": "orders", "data": [{"order_id": i, "status": ["new", "paid"][i % 2]} for i in range(10)]}
+]
+
+def dataset_file():
+    return io.BytesIO(json.dumps(DATASET).encode("utf-8"))
+
+@pytest.mark.unit
+def test_register_extracts_schema_preview_and_counts(tmp_path):
+    registry = DatasetRegistry(directory=str(tmp_path))
+    entry = registry.register(dataset_file(), "shop.json")
+    assert entry["database"] == "Shop"
+    assert entry["schema"] == {"orders": {"order_id": "int", "status": "str"}}
+    assert entry["preview"] == {"orders": {"order_id": [0, 1, 2], "status": ["new", "paid"]}}
+    assert entry["rowCounts"] == {"orders": 10}
+
+@pytest.mark.unit
+def test_same_content_is_only_parsed_once(tmp_path, monkeypatch):
+    registry = DatasetRegistry(directory=str(tmp_path))
+    first = registry.register(dataset_file(), "shop.json")
+    import datasetRegistry
+    monkeypatch.setattr(datasetRegistry, "iter_dataset_events", lambda *a, **k: pytest.fail("file parsed again"))
+    assert registry.register(dataset_file(), "renamed.json")["datasetId"] == first["datasetId"]
+
+@pytest.mark.unit
+def test_entries_survive_a_restart(tmp_path):
+    entry = DatasetRegistry(directory=str(tmp_path)).register(dataset_file(), "shop.json")
+    reopened = DatasetRegistry(directory=str(tmp_path))
+    assert reopened.get(entry["datasetId"])["schema"] == entry["schema"]
+    with pytest.raises(DatasetNotFoundError):
+        reopened.get("0" * 64)
+
+@pytest.mark.unit
+def test_register_builds_column_profiles(tmp_path):
+    entry = DatasetRegistry(directory=str(tmp_path)).register(dataset_file(), "shop.json")
+    status = entry["profile"]["orders"]["status"]
+    assert status["distinct"] == 2 and status["nulls"] == 0
+    assert entry["profile"]["orders"]["order_id"]["max"] == 9
+
+@pytest.mark.unit
+def test_register_profiles_csv(tmp_path):
+    import io
+    csv_file = io.BytesIO(b"name,age\nann,30\nbob,\n")
+    entry = DatasetRegistry(directory=str(tmp_path)).register(csv_file, "people.csv")
+    assert entry["database"] is None
+    assert entry["preview"] == {"uploaded_table": {"name": ["ann", "bob"], "age": [30.0]}}
+    assert entry["profile"]["uploaded_table"]["age"]["nulls"] == 1
+
+@pytest.mark.unit
+def test_memory_holds_only_the_most_recent_entries(tmp_path):
+    registry = DatasetRegistry(directory=str(tmp_path), memory_entries=2)
+    first = registry.register(dataset_file(), "shop.json")
+    registry.add("b" * 64, "b.json", {"database": None, "schema": {}})
+    registry.add("c" * 64, "c.json", {"database": None, "schema": {}})
+    assert len(registry.entries) == 2 and first["datasetId"] not in registry.entries
+    #pushed out of memory, still on disk
+    assert registry.get(first["datasetId"])["schema"] == first["schema"]
+    assert list(registry.entries) == ["c" * 64, first["datasetId"]]
+    #without a directory there is nowhere to read it back from
+    in_memory = DatasetRegistry(directory="", memory_entries=1)
+    in_memory.add("a" * 64, "a.json", {"database": None, "schema": {}})
+    in_memory.add("b" * 64, "b.json", {"database": None, "schema": {}})
+    with pytest.raises(DatasetNotFoundError):
+        in_memory.get("a" * 64)
@@ -0,0 +1,37 @@
+import io
+import json
+import pytest
+import datasetStream
+from datasetStream import iter_dataset_events, read_database_name, DatasetFormatError
+
+DATASET = [
+    {"type": "database", "name": "Shop"},
+    {"type": "table", "name": "orders", "data": [{"order_id": i, "total": i * 1.5, "note": "é ü"} for i in range(7)]},
+    {"type": "table", "name": "empty", "data": []},
+    {"type": "table", "data": [{"id": 1}], "name": "late_name"}
+]
+
+@pytest.mark.unit
+def test_stream_matches_full_parse(monkeypatch):
+    """
+    Reading a tiny piece at a time gives the same rows as json.loads, in chunks of chunk_rows.
+    """
+    monkeypatch.setattr(datasetStream, "READ_SIZE", 5)
+    raw = io.BytesIO(json.dumps(DATASET).encode("utf-8"))
+    events = list(iter_dataset_events(raw, chunk_rows=3))
+    assert events[0] == ("database", {"type": "database", "name": "Shop"})
+    order_chunks = [e[2] for e in events if e[0] == "rows" and e[1] == "orders"]
+    assert [len(c) for c in order_chunks] == [3, 3, 1]
+    assert sum(order_chunks, []) == DATASET[1]["data"]
+    assert ("table_end", "empty", 0) in events
+    assert ("rows", "late_name", [{"id": 1}]) in events
+
+@pytest.mark.unit
+def test_read_database_name_from_text_stream():
+    assert read_database_name(io.StringIO(json.dumps(DATASET))) == "Shop"
+
+@pytest.mark.unit
+def test_truncated_dataset_raises():
+    raw = io.BytesIO(json.dumps(DATASET).encode("utf-8")[:-20])
+    with pytest.raises(DatasetFormatError):
+        list(iter_dataset_events(raw))
@@ -0,0 +1,206 @@
+import io
+import os
+import json
+import contextlib
+import pytest
+import mysql.connector
+from datasetIngest import insert_rows, build_create_table_query, load_dataset, profile_sample, choose_indexes
+from datasetStream import events_from_records
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+#records the statements instead of sending them to mysql so the batching can be checked without a server
+class RecordingCursor:
+    def __init__(self):
+        self.batches = []
+
+    def executemany(self, query, rows):
+        self.batches.append((query, list(rows)))
+
+class RecordingConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+@pytest.mark.unit
+def test_insert_rows_batches_by_size():
+    """
+    Rows are sent in parameterised batches of at most batch_size, with no values inlined in the SQL.
+    """
+    conn, cursor = RecordingConnection(), RecordingCursor()
+    rows = [{"id": i, "name": f"o'neil {i}"} for i in range(25)]
+    inserted = insert_rows(conn, cursor, "people", ["id", "name"], rows, batch_size=10, commit_interval=0)
+    assert inserted == 25
+    assert [len(batch) for _, batch in cursor.batches] == [10, 10, 5]
+    query = cursor.batches[0][0]
+    assert query == "INSERT INTO `people` (`id`, `name`) VALUES (%s, %s)"
+    assert cursor.batches[0][1][0] == (0, "o'neil 0")
+    assert conn.commits == 0
+
+@pytest.mark.unit
+def test_insert_rows_respects_packet_size_and_commit_interval():
+    """
+    Batches are cut before they outgrow the packet budget and commits happen every commit_interval rows.
+    """
+    conn, cursor = RecordingConnection(), RecordingCursor()
+    rows = [{"id": i, "note": "x" * 100} for i in range(20)]
+    insert_rows(conn, cursor, "notes", ["id", "note"], rows, batch_size=1000, commit_interval=5, max_packet=1000)
+    assert sum(len(batch) for _, batch in cursor.batches) == 20
+    assert all(len(batch) < 20 for _, batch in cursor.batches)
+    assert conn.commits >= 1
+
+@pytest.mark.unit
+def test_missing_columns_become_null():
+    conn, cursor = RecordingConnection(), RecordingCursor()
+    insert_rows(conn, cursor, "t", ["a", "b"], [{"a": 1}], batch_size=10, commit_interval=0)
+    assert cursor.batches[0][1] == [(1, None)]
+
+@pytest.mark.unit
+def test_create_table_query_types():
+    """
+    Types come from the whole sample, NOT NULL is only used when the sample is the entire table.
+    """
+    sample = [
+        {"id": 1, "price": 2.5, "name": "x", "big": 2**40, "day": "2020-01-31", "at": "2020-01-31 10:00:00", "note": None},
+        {"id": 2, "price": 3, "name": "y" * 300, "big": 1, "day": "2021-02-01", "at": "2021-02-01T11:30", "note": "n"}
+    ]
+    profile = profile_sample(list(sample[0].keys()), sample, complete=True)
+    query = build_create_table_query("t", profile)
+    assert query == ("CREATE TABLE IF NOT EXISTS `t` (`id` INT NOT NULL, `price` DOUBLE NOT NULL, `name` TEXT NOT NULL, "
+                     "`big` BIGINT NOT NULL, `day` DATE NOT NULL, `at` DATETIME NOT NULL, `note` VARCHAR(255));")
+    partial = profile_sample(list(sample[0].keys()), sample, complete=False)
+    assert all(info["nullable"] for info in partial.values())
+
+@pytest.mark.unit
+def test_strings_that_are_not_real_dates_stay_strings():
+    profile = profile_sample(["code", "year"], [{"code": "2020-13-45", "year": "2020"}], complete=True)
+    assert profile["code"]["type"] == "VARCHAR(255)"
+    assert profile["year"]["type"] == "VARCHAR(255)"
+
+@pytest.mark.unit
+def test_choose_indexes_prefers_table_id_as_primary_key():
+    sample = [{"order_id": i, "customer_id": i % 2, "customerId": i % 3, "name": "x"} for i in range(4)]
+    profile = profile_sample(list(sample[0].keys()), sample, complete=True)
+    primary_key, secondary = choose_indexes("orders", profile)
+    assert primary_key == "order_id"
+    assert secondary == ["customer_id", "customerId"]
+
+@pytest.mark.unit
+def test_infile_rows_round_trip(tmp_path):
+    """
+    Values written for LOAD DATA keep NULLs, tabs, newlines and backslashes intact when read back.
+    """
+    from datasetIngest import write_infile_rows, _read_infile_rows
+    rows = [{"id": 1, "text": "tab\there\nnew \\N line"}, {"id": 2, "text": None}]
+    path = tmp_path / "rows.tsv"
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        assert write_infile_rows(f, ["id", "text"], rows) == 2
+    assert path.read_text(encoding="utf-8").splitlines()[1] == "2\t\\N"
+    assert list(_read_infile_rows(str(path), ["id", "text"])) == [
+        {"id": "1", "text": "tab\there\nnew \\N line"},
+        {"id": "2", "text": None}
+    ]
+
+@pytest.mark.unit
+def test_infile_refused_falls_back_to_inserts():
+    from datasetIngest import load_rows_infile
+
+    class RefusingCursor(RecordingCursor):
+        def execute(self, query, params=None):
+            raise mysql.connector.Error(msg="local infile disabled", errno=3948)
+
+    conn, cursor = RecordingConnection(), RefusingCursor()
+    count, used_infile = load_rows_infile(conn, cursor, "t", ["a"], [{"a": 1}, {"a": None}], batch_size=10, commit_interval=0)
+    assert (count, used_infile) == (2, False)
+    assert cursor.batches[0][1] == [("1",), (None,)]
+
+#a connection that hands out cursors recording into a shared list, enough for load_dataset to run without a server
+class FakeServerConnection(RecordingConnection):
+    def __init__(self, statements, fail_table=None):
+        super().__init__()
+        self.statements = statements
+        self.fail_table = fail_table
+        self.closed = False
+
+    def cursor(self):
+        conn = self
+
+        class FakeCursor(RecordingCursor):
+            def execute(self, query, params=None):
+                if conn.fail_table and f"`{conn.fail_table}`" in query:
+                    raise mysql.connector.Error(msg="table failed", errno=1105)
+                conn.statements.append(query)
+
+            def fetchone(self):
+                return (1024 * 1024,)
+
+            def executemany(self, query, rows):
+                conn.statements.append((query, len(rows)))
+
+            def close(self):
+                pass
+        return FakeCursor()
+
+    def close(self):
+        self.closed = True
+
+PARALLEL_DATASET = [{"type": "database", "name": "Shop"}] + [
+    {"type": "table", "name": f"t{i}", "data": [{"id": n} for n in range(5)]} for i in range(4)
+]
+
+@pytest.mark.unit
+def test_load_dataset_parallel_loads_every_table():
+    statements, opened = [], []
+
+    def connect():
+        conn = FakeServerConnection(statements)
+        opened.append(conn)
+        return conn
+    stats = load_dataset(connect, events_from_records(PARALLEL_DATASET, chunk_rows=2), workers=3, batch_size=10)
+    assert (stats["tables"], stats["rows"], stats["mode"]) == (4, 20, "insert")
+    assert sum(1 for s in statements if isinstance(s, str) and s.startswith("CREATE TABLE")) == 4
+    assert stats["indexes"]["t0"] == ["PRIMARY KEY (id)"]
+    assert 1 <= len(opened) <= 3 and all(conn.closed for conn in opened)
+
+@pytest.mark.unit
+def test_load_dataset_parallel_raises_on_failed_table():
+    def connect():
+        return FakeServerConnection([], fail_table="t2")
+    with pytest.raises(mysql.connector.Error):
+        load_dataset(connect, events_from_records(PARALLEL_DATASET), workers=2)
+
+class FakePool:
+    def connection(self):
+        class Cursor:
+            def execute(self, query):
+                pass
+            def close(self):
+                pass
+
+        class Connection:
+            def cursor(self):
+                return Cursor()
+            def commit(self):
+                pass
+        return contextlib.nullcontext(Connection())
+
+@pytest.mark.unit
+def test_failed_upload_drops_database_whatever_the_error(monkeypatch):
+    import api
+    from config import MySQLConfig
+    for name in ("host", "user", "password", "database"):
+        monkeypatch.setattr(MySQLConfig, name, getattr(MySQLConfig, name))
+    dropped = []
+    monkeypatch.setattr(api, "connection_pool", lambda *args: FakePool())
+    monkeypatch.setattr(api, "drop_database", lambda host, user, password, db_name: dropped.append(db_name))
+    def load_dataset(*args, **kwargs):
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+    monkeypatch.setattr(api, "load_dataset", load_dataset)
+    dataset = json.dumps([{"type": "database", "name": "broken_upload"}, {"type": "table", "name": "t", "data": [{"id": 1}]}])
+    with api.app.test_client() as client:
+        response = client.post("/api/upload-dataset", data={"wait": "true", "dataset": (io.BytesIO(dataset.encode()), "broken.json")})
+    assert response.status_code == 400
+    assert "invalid start byte" in response.get_json()["error"]
+    assert dropped == ["broken_upload"]
@@ -0,0 +1,43 @@
+import time
+import pytest
+from ingestJobs import IngestJobManager
+
+def wait_for(job, timeout=2.0):
+    deadline = time.time() + timeout
+    while job.phase not in ("done", "failed") and time.time() < deadline:
+        time.sleep(0.01)
+    return job.to_dict()
+
+@pytest.mark.unit
+def test_job_reports_progress_and_result():
+    manager = IngestJobManager(workers=1, history=10)
+
+    def work(job):
+        job.add_rows(40)
+        job.table_done("orders")
+        return {"rowsLoaded": 40}
+    job = manager.submit("Shop", work)
+    status = wait_for(job)
+    assert status["phase"] == "done"
+    assert (status["tablesDone"], status["rowsLoaded"]) == (1, 40)
+    assert status["result"] == {"rowsLoaded": 40}
+    assert manager.get(job.id) is job
+
+@pytest.mark.unit
+def test_failed_job_keeps_error():
+    manager = IngestJobManager(workers=1, history=10)
+
+    def work(job):
+        raise RuntimeError("table t failed")
+    status = wait_for(manager.submit("Shop", work))
+    assert status["phase"] == "failed"
+    assert status["errors"] == ["table t failed"]
+
+@pytest.mark.unit
+def test_old_finished_jobs_are_forgotten():
+    manager = IngestJobManager(workers=1, history=2)
+    jobs = [manager.submit("Shop", lambda job: {}) for _ in range(3)]
+    for job in jobs:
+        wait_for(job)
+    manager.submit("Shop", lambda job: {})
+    assert manager.get(jobs[0].id) is None
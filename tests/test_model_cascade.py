@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from ModelClient import ModelClient
+from asyncModelClient import AsyncModelClient
+from modelResilience import ResilientCaller
+
+SCHEMA = {
+    "orders": {"order_id": "int", "customer_id": "int", "total": "float", "created": "date"},
+    "customers": {"customer_id": "int", "name": "str"},
+}
+
+def completion(answer):
+    message = type("Message", (), {"content": answer})
+    return type("Completion", (), {"choices": [type("Choice", (), {"message": message})]})
+
+#answers by model name, the fast model's answer picked by the question, and records which models were asked
+class FakeCascadeOpenAI:
+    def __init__(self, fast_answers, strong_answer="SELECT name FROM customers", strong_error=None):
+        self.models = []
+        fake = self
+
+        class Completions:
+            def create(self, model, messages, timeout=None):
+                fake.models.append(model)
+                if model == "strong":
+                    if strong_error is not None:
+                        raise strong_error
+                    return completion(strong_answer)
+                return completion(fast_answers[messages[-1]["content"]])
+
+        self.chat = type("Chat", (), {"completions": Completions()})
+
+def cascade_client(fake, cls=ModelClient):
+    client = cls(fake, "fast", escalation_model="strong", caller=ResilientCaller(deadline=5, retries=0, hedge=False))
+    client.response_cache = None
+    client.question_index = None
+    client.template_cache = None
+    return client
+
+@pytest.mark.unit
+def test_valid_answers_stay_on_the_fast_model():
+    fake = FakeCascadeOpenAI({"How many orders?": "SELECT COUNT(*) FROM orders"})
+    client = cascade_client(fake)
+    result = client.query(None, "How many orders?", schema=SCHEMA)
+    assert result == {"type": "sql", "query": "SELECT COUNT(*) FROM orders"}
+    assert fake.models == ["fast"]
+
+@pytest.mark.unit
+def test_invalid_sql_and_clarifications_escalate():
+    fake = FakeCascadeOpenAI({
+        "Which products sold most?": "SELECT name FROM products",
+        "Who are the customers?": "Could you clarify what you mean?",
+        "How many orders?": "SELECT COUNT(*) FROM orders",
+    })
+    client = cascade_client(fake)
+    invalid = client.query(None, "Which products sold most?", schema=SCHEMA)
+    assert invalid["query"] == "SELECT name FROM customers"
+    assert invalid["escalation"] == {"model": "strong", "reason": "unknown table products"}
+    clarification = client.query(None, "Who are the customers?", schema=SCHEMA)
+    assert clarification["escalation"]["reason"] == "clarification"
+    client.query(None, "How many orders?", schema=SCHEMA)
+    assert fake.models == ["fast", "strong", "fast", "strong", "fast"]
+    stats = client.cascade.stats()
+    assert stats["questions"] == 3 and stats["escalations"] == 2 and stats["escalationRate"] == 0.6667
+    assert stats["reasons"] == {"validation": 1, "clarification": 1}
+    assert stats["tiers"]["fast"]["calls"] == 3 and stats["tiers"]["strong"]["calls"] == 2
+    assert stats["tiers"]["strong"]["p50Seconds"] is not None
+
+@pytest.mark.unit
+def test_keeps_the_fast_answer_when_the_strong_model_is_down():
+    fake = FakeCascadeOpenAI({"Which products sold most?": "SELECT name FROM products"}, strong_error=TimeoutError("down"))
+    client = cascade_client(fake)
+    result = client.query(None, "Which products sold most?", schema=SCHEMA)
+    assert result == {"type": "sql", "query": "SELECT name FROM products"}
+
+@pytest.mark.unit
+def test_async_client_escalates_too():
+    class FakeAsync:
+        def __init__(self):
+            self.models = []
+            fake = self
+
+            class Completions:
+                async def create(self, model, messages, timeout=None):
+                    fake.models.append(model)
+                    return completion("SELECT name FROM customers" if model == "strong" else "SELECT * FROM products")
+
+            self.chat = type("Chat", (), {"completions": Completions()})
+
+    fake = FakeAsync()
+    client = cascade_client(fake, AsyncModelClient)
+    result = asyncio.run(client.query(None, "Which products sold most?", schema=SCHEMA))
+    assert result["query"] == "SELECT name FROM customers" and fake.models == ["fast", "strong"]
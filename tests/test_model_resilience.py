@@ -0,0 +1,189 @@
+import time
+import asyncio
+import pytest
+import responseCache
+import modelResilience
+from modelResilience import ResilientCaller, CircuitBreaker, ModelUnavailableError
+from responseCache import ResponseCache
+from ModelClient import ModelClient
+from test_response_cache import FakeOpenAI, SCHEMA
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(modelResilience.ResilienceConfig, "backoff_base", 0.0)
+
+def flaky(failures, answer="ok"):
+    #fails with a retryable error the first few times, records the timeout each attempt was given
+    timeouts = []
+    def call(timeout):
+        timeouts.append(timeout)
+        if len(timeouts) <= failures:
+            raise TimeoutError("slow provider")
+        return answer
+    return call, timeouts
+
+@pytest.mark.unit
+def test_retries_until_success_within_the_deadline():
+    caller = ResilientCaller(deadline=5, retries=2, hedge=False)
+    call, timeouts = flaky(2)
+    assert caller.call(call) == "ok"
+    assert len(timeouts) == 3 and all(0 < t <= 5 for t in timeouts)
+    assert caller.stats()["retries"] == 2
+
+@pytest.mark.unit
+def test_gives_up_after_the_last_retry():
+    caller = ResilientCaller(deadline=5, retries=1, hedge=False)
+    call, timeouts = flaky(10)
+    with pytest.raises(ModelUnavailableError):
+        caller.call(call)
+    assert len(timeouts) == 2 and caller.stats()["failures"] == 1
+
+@pytest.mark.unit
+def test_bad_requests_are_not_retried():
+    caller = ResilientCaller(deadline=5, retries=3, hedge=False)
+    calls = []
+    def call(timeout):
+        calls.append(timeout)
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        caller.call(call)
+    assert len(calls) == 1 and caller.breaker.state == "closed"
+
+@pytest.mark.unit
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.1)
+    caller = ResilientCaller(deadline=5, retries=0, hedge=False, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(ModelUnavailableError):
+            caller.call(flaky(1)[0])
+    assert breaker.state == "open"
+    #fails fast without calling the provider
+    call, timeouts = flaky(0)
+    with pytest.raises(ModelUnavailableError):
+        caller.call(call)
+    assert timeouts == [] and caller.stats()["rejected"] == 1
+    time.sleep(0.15)
+    assert breaker.state == "half-open"
+    assert caller.call(call) == "ok"
+    assert breaker.state == "closed"
+
+@pytest.mark.unit
+def test_retries_stop_once_the_breaker_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.1)
+    caller = ResilientCaller(deadline=5, retries=5, hedge=False, breaker=breaker)
+    call, timeouts = flaky(10)
+    with pytest.raises(ModelUnavailableError):
+        caller.call(call)
+    assert len(timeouts) == 2 and breaker.failures == 2
+    assert breaker.state == "open"
+    #a failed half-open trial isn't retried either
+    time.sleep(0.15)
+    with pytest.raises(ModelUnavailableError):
+        caller.call(call)
+    assert len(timeouts) == 3 and breaker.state == "open"
+
+@pytest.mark.unit
+def test_async_retries_stop_once_the_breaker_opens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=5)
+    caller = ResilientCaller(deadline=5, retries=3, hedge=False, breaker=breaker)
+    calls = []
+    async def call(timeout):
+        calls.append(timeout)
+        raise TimeoutError("slow provider")
+    with pytest.raises(ModelUnavailableError):
+        asyncio.run(caller.call_async(call))
+    assert len(calls) == 1 and caller.stats()["retries"] == 0
+
+@pytest.mark.unit
+def test_cancelled_half_open_trial_lets_the_next_call_try():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    caller = ResilientCaller(deadline=5, retries=0, hedge=False, breaker=breaker)
+    breaker.record_failure()
+    time.sleep(0.1)
+    async def hang(timeout):
+        await asyncio.sleep(10)
+    async def ok(timeout):
+        return "ok"
+    async def cancel_trial():
+        task = asyncio.ensure_future(caller.call_async(hang))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancel_trial())
+    assert breaker.state == "half-open" and not breaker.trial_running
+    assert asyncio.run(caller.call_async(ok)) == "ok"
+    assert breaker.state == "closed"
+
+@pytest.mark.unit
+def test_hedged_call_takes_the_faster_answer(monkeypatch):
+    monkeypatch.setattr(modelResilience.ResilienceConfig, "hedge_after", 0.05)
+    caller = ResilientCaller(deadline=5, retries=0, hedge=True)
+    started = []
+    def call(timeout):
+        started.append(timeout)
+        if len(started) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+    start = time.perf_counter()
+    assert caller.call(call) == "fast"
+    assert time.perf_counter() - start < 0.4
+    stats = caller.stats()
+    assert stats["hedges"] == 1 and stats["hedgeWins"] == 1
+
+@pytest.mark.unit
+def test_async_hedged_call_cancels_the_slower_request(monkeypatch):
+    monkeypatch.setattr(modelResilience.ResilienceConfig, "hedge_after", 0.05)
+    caller = ResilientCaller(deadline=5, retries=0, hedge=True)
+    started, cancelled = [], []
+
+    async def call(timeout):
+        started.append(timeout)
+        if len(started) == 1:
+            try:
+                await asyncio.sleep(0.5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "slow"
+        return "fast"
+
+    async def run():
+        result = await caller.call_async(call)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "fast"
+    assert cancelled == [True] and caller.stats()["hedgeWins"] == 1
+
+@pytest.mark.unit
+def test_async_deadline_cuts_off_a_hung_call():
+    caller = ResilientCaller(deadline=0.1, retries=3, hedge=False)
+
+    async def hang(timeout):
+        await asyncio.sleep(5)
+
+    start = time.perf_counter()
+    with pytest.raises(ModelUnavailableError):
+        asyncio.run(caller.call_async(hang))
+    assert time.perf_counter() - start < 1
+
+@pytest.mark.unit
+def test_open_breaker_falls_back_to_a_stale_answer(tmp_path, monkeypatch):
+    fake = FakeOpenAI()
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), ttl=60)
+    client = ModelClient(fake, "model", response_cache=cache)
+    client.question_index = None
+    client.template_cache = None
+    first = client.query(None, "How many orders?", schema=SCHEMA)
+    #the answer expires and the provider goes down
+    later = time.time() + 61
+    monkeypatch.setattr(responseCache.time, "time", lambda: later)
+    client.caller.breaker.opened = time.monotonic()
+    answer = client.query(None, "How many orders?", schema=SCHEMA)
+    assert answer["stale"] is True and answer["query"] == first["query"]
+    assert fake.calls == 1
+    #nothing cached for a new question, so it fails fast
+    with pytest.raises(ModelUnavailableError):
+        client.query(None, "What is the largest total?", schema=SCHEMA)
@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+import contextlib
+import pytest
+from mysql.connector import errors
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+import api
+from queryControl import QueryRegistry, QueryTimeoutError, QueryCancelledError, QueryIdInUseError, ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT
+from sqlValidation import time_limit_sql
+from config import ResultConfig
+
+class Connection:
+    connection_id = 42
+
+def wait_for(condition, seconds=2):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.005)
+
+@pytest.mark.unit
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT a FROM t", "SELECT /*+ MAX_EXECUTION_TIME(1500) */ a FROM t"),
+    #the text is otherwise untouched, IFNULL isn't rewritten to COALESCE
+    ("select IFNULL(a, 0) AS a FROM t -- totals", "select /*+ MAX_EXECUTION_TIME(1500) */ IFNULL(a, 0) AS a FROM t -- totals"),
+    ("SELECT /*+ BKA(t) */ a FROM t", "SELECT /*+ MAX_EXECUTION_TIME(1500) BKA(t) */ a FROM t"),
+    ("SELECT a FROM t UNION SELECT b FROM u", "SELECT /*+ MAX_EXECUTION_TIME(1500) */ a FROM t UNION SELECT b FROM u"),
+    ("WITH c AS (SELECT a FROM t) SELECT a FROM c", None),
+    ("UPDATE t SET a = 1", None),
+    ("SELECT 1; SELECT 2", None),
+])
+def test_time_limit_sql(sql, expected):
+    assert time_limit_sql(sql, 1500) == expected
+
+@pytest.mark.unit
+def test_watchdog_kills_statement_past_its_budget():
+    killed = []
+    registry = QueryRegistry(killed.append, grace_seconds=0)
+    query = registry.start("slow", timeout=0.05)
+    with registry.running(query, Connection()):
+        wait_for(lambda: killed)
+    registry.finish(query)
+    assert killed == [42]
+    assert query.state == "timedOut"
+    assert registry.stats()["timedOut"] == 1 and registry.stats()["running"] == 0
+
+@pytest.mark.unit
+def test_hinted_select_gets_grace_before_it_is_killed():
+    killed = []
+    registry = QueryRegistry(killed.append, grace_seconds=0.3)
+    query = registry.start(timeout=0.01)
+    with registry.running(query, Connection(), hinted=True):
+        time.sleep(0.1)
+        assert killed == []
+        wait_for(lambda: killed)
+    registry.finish(query)
+
+@pytest.mark.unit
+def test_finished_query_is_not_killed():
+    killed = []
+    registry = QueryRegistry(killed.append, grace_seconds=0)
+    query = registry.start(timeout=0.05)
+    with registry.running(query, Connection()):
+        pass
+    registry.finish(query)
+    time.sleep(0.1)
+    assert killed == []
+
+@pytest.mark.unit
+def test_cancel_running_and_not_yet_running_queries():
+    killed = []
+    registry = QueryRegistry(killed.append)
+    query = registry.start("q1", timeout=10)
+    with registry.running(query, Connection()):
+        assert registry.cancel("q1")
+    assert killed == [42] and query.state == "cancelled"
+    registry.finish(query)
+    assert not registry.cancel("q1")
+    #cancelled before it got to mysql, it never runs
+    query = registry.start("q2", timeout=10)
+    assert registry.cancel("q2")
+    with pytest.raises(QueryCancelledError):
+        with registry.running(query, Connection()):
+            pass
+    registry.finish(query)
+    assert killed == [42]
+
+@pytest.mark.unit
+def test_expired_budget_stops_query_before_it_runs():
+    registry = QueryRegistry(lambda thread_id: None)
+    query = registry.start(timeout=0.001)
+    time.sleep(0.01)
+    with pytest.raises(QueryTimeoutError):
+        with registry.running(query, Connection()):
+            pass
+
+@pytest.mark.unit
+def test_duplicate_query_id_and_budget_cap(monkeypatch):
+    monkeypatch.setattr("queryControl.QueryTimeoutConfig.max_timeout_seconds", 60)
+    registry = QueryRegistry(lambda thread_id: None)
+    query = registry.start("same", timeout=1000)
+    assert query.timeout == 60
+    with pytest.raises(QueryIdInUseError):
+        registry.start("same")
+
+#a mysql connection whose statements run until they are killed
+class BlockingConnection:
+    connection_id = 99
+
+    def __init__(self, timeout_errno=None):
+        self.executed = []
+        self.killed = threading.Event()
+        self.timeout_errno = timeout_errno
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            description = [("n",)]
+            def execute(self, sql):
+                connection.executed.append(sql)
+                if connection.timeout_errno:
+                    raise errors.DatabaseError(msg="Query execution was interrupted", errno=connection.timeout_errno)
+                assert connection.killed.wait(5)
+                raise errors.DatabaseError(msg="Query execution was interrupted", errno=ER_QUERY_INTERRUPTED)
+            def close(self):
+                pass
+        return Cursor()
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api.model_client.schema_provider, "snapshot", lambda database: None)
+    monkeypatch.setattr(api.model_client, "result_cache", None)
+    with api.app.test_client() as test_client:
+        yield test_client
+
+def use_connection(monkeypatch, connection):
+    monkeypatch.setattr(api.model_client, "mysql_connection", lambda: contextlib.nullcontext(connection))
+    monkeypatch.setattr(api.model_client, "kill_query", lambda thread_id: connection.killed.set())
+    monkeypatch.setattr(api.model_client.running_queries, "kill", api.model_client.kill_query)
+
+@pytest.mark.unit
+def test_select_carries_execution_time_hint(client, monkeypatch):
+    connection = BlockingConnection(timeout_errno=ER_QUERY_TIMEOUT)
+    use_connection(monkeypatch, connection)
+    response = client.post("/api/execute-query", json={"query": "SELECT n FROM numbers", "timeoutSeconds": 5})
+    assert response.status_code == 504
+    assert response.get_json()["type"] == "timeout"
+    assert connection.executed[0].startswith("SELECT /*+ MAX_EXECUTION_TIME(")
+    assert connection.executed[0].endswith(f"*/ n FROM numbers\nLIMIT {ResultConfig.max_rows + 1}")
+
+@pytest.mark.unit
+def test_write_past_its_budget_is_killed(client, monkeypatch):
+    connection = BlockingConnection()
+    use_connection(monkeypatch, connection)
+    response = client.post("/api/execute-query", json={"query": "DELETE FROM numbers", "confirmed": True, "timeoutSeconds": 0.05})
+    assert response.status_code == 504
+    assert "MAX_EXECUTION_TIME" not in connection.executed[0]
+
+@pytest.mark.unit
+def test_cancel_endpoint_stops_running_query(client, monkeypatch):
+    connection = BlockingConnection()
+    use_connection(monkeypatch, connection)
+    responses = []
+    worker = threading.Thread(target=lambda: responses.append(
+        api.app.test_client().post("/api/execute-query", json={"query": "SELECT n FROM numbers", "queryId": "dash-1"})))
+    worker.start()
+    wait_for(lambda: connection.executed)
+    cancel = client.post("/api/cancel-query", json={"queryId": "dash-1"})
+    worker.join(5)
+    assert cancel.status_code == 200
+    assert responses[0].status_code == 409
+    assert responses[0].get_json() == {"type": "cancelled", "message": "Query dash-1 was cancelled.", "queryId": "dash-1"}
+    assert client.post("/api/cancel-query", json={"queryId": "dash-1"}).status_code == 404
+
+@pytest.mark.unit
+def test_query_id_is_returned(client, monkeypatch):
+    connection = BlockingConnection()
+    use_connection(monkeypatch, connection)
+    monkeypatch.setattr(api.model_client, "run_query_result", lambda query, confirmed, query_id=None, timeout=None: {"results": [{"n": 1}], "truncated": False})
+    response = client.post("/api/execute-query", json={"query": "SELECT n FROM numbers"})
+    assert response.headers["X-Query-Id"] == response.get_json()["queryId"]
@@ -0,0 +1,30 @@
+import pytest
+from questionIndex import QuestionIndex, question_literals
+
+ANSWER = {"type": "sql", "query": "SELECT 1"}
+
+@pytest.mark.unit
+def test_literals_are_numbers_quotes_and_names():
+    assert question_literals("Orders from Oslo in 2020 for 'Sales'") == ["oslo", "2020", "sales"]
+
+@pytest.mark.unit
+def test_rephrasings_match_and_other_questions_dont():
+    index = QuestionIndex(threshold=0.8)
+    index.add("schema", "how many orders in 2020", ANSWER)
+    index.add("schema", "average order total per customer", {"type": "sql", "query": "SELECT 2"})
+    score, question, response = index.lookup("schema", "Number of orders placed during 2020?")
+    assert question == "how many orders in 2020" and response == ANSWER and score >= 0.8
+    assert index.lookup("schema", "mean total of orders for each customer")[2]["query"] == "SELECT 2"
+    assert index.lookup("schema", "how many customers in 2020") is None
+    assert index.lookup("schema", "how many orders in 2021") is None
+    assert index.lookup("other schema", "how many orders in 2020") is None
+
+@pytest.mark.unit
+def test_limits_drop_the_oldest():
+    index = QuestionIndex(threshold=0.8, max_questions=1, max_schemas=1)
+    index.add("a", "how many orders", ANSWER)
+    index.add("a", "list every customer", ANSWER)
+    assert index.lookup("a", "how many orders") is None
+    index.add("b", "list every customer", ANSWER)
+    assert index.lookup("a", "list every customer") is None
+    assert index.lookup("b", "list every customer") is not None
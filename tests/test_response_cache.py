@@ -0,0 +1,88 @@
+import time
+import pytest
+import responseCache
+from responseCache import ResponseCache, cache_key, normalize_question, schema_fingerprint
+from ModelClient import ModelClient
+
+SCHEMA = {"orders": {"order_id": "int", "total": "float"}}
+
+#stands in for the OpenAI client, always answers with the same SQL and counts the calls
+class FakeOpenAI:
+    def __init__(self, answer="SELECT COUNT(*) FROM orders"):
+        self.calls = 0
+        fake = self
+
+        class Completions:
+            def create(self, model, messages, timeout=None):
+                fake.calls += 1
+                message = type("Message", (), {"content": answer})
+                choice = type("Choice", (), {"message": message})
+                return type("Completion", (), {"choices": [choice]})
+
+        self.chat = type("Chat", (), {"completions": Completions()})
+
+@pytest.mark.unit
+def test_normalize_and_fingerprint():
+    assert normalize_question("  How many   Orders? ") == "how many orders"
+    assert schema_fingerprint({"a": {"x": "int"}, "b": {}}) == schema_fingerprint({"b": {}, "a": {"x": "int"}})
+    assert cache_key("m", "f", "How many orders?") == cache_key("m", "f", "how many orders")
+
+@pytest.mark.unit
+def test_memory_and_disk_tiers(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path=path, ttl=0, memory_entries=10, disk_entries=10)
+    assert cache.get("k") is None
+    cache.put("k", {"type": "sql", "query": "SELECT 1"})
+    assert cache.get("k") == {"type": "sql", "query": "SELECT 1"}
+    #a new instance (a restart) only has the file
+    reopened = ResponseCache(path=path, ttl=0, memory_entries=10, disk_entries=10)
+    assert reopened.get("k") == {"type": "sql", "query": "SELECT 1"}
+    assert reopened.get("k") is not None
+    stats = reopened.stats()
+    assert stats["diskHits"] == 1 and stats["memoryHits"] == 1 and stats["diskEntries"] == 1
+
+@pytest.mark.unit
+def test_ttl_expires_entries(tmp_path, monkeypatch):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.put("k", {"type": "sql", "query": "SELECT 1"})
+    later = time.time() + 61
+    monkeypatch.setattr(responseCache.time, "time", lambda: later)
+    assert cache.get("k") is None
+    #kept as a stale fallback for when the model is unavailable
+    assert cache.get("k", stale=True) == {"type": "sql", "query": "SELECT 1"}
+    assert cache.stats()["diskEntries"] == 1
+
+@pytest.mark.unit
+def test_size_limits(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), ttl=0, memory_entries=2, disk_entries=3)
+    for i in range(5):
+        cache.put(f"k{i}", {"i": i})
+    stats = cache.stats()
+    assert stats["memoryEntries"] == 2 and stats["diskEntries"] == 3
+    assert cache.get("k0") is None and cache.get("k4") == {"i": 4}
+
+@pytest.mark.unit
+def test_model_client_only_calls_the_model_once(tmp_path):
+    fake = FakeOpenAI()
+    client = ModelClient(fake, "model", response_cache=ResponseCache(path=str(tmp_path / "cache.sqlite3")))
+    first = client.query(None, "How many orders?", schema=SCHEMA)
+    second = client.query(None, "how many orders", schema=SCHEMA)
+    assert first == second == {"type": "sql", "query": "SELECT COUNT(*) FROM orders"}
+    assert fake.calls == 1
+    #a different schema is a different question
+    client.query(None, "how many orders", schema={"orders": {"order_id": "int"}})
+    assert fake.calls == 2
+
+@pytest.mark.unit
+def test_rephrased_question_reuses_the_answer(tmp_path):
+    from questionIndex import QuestionIndex
+    fake = FakeOpenAI()
+    client = ModelClient(fake, "model", response_cache=ResponseCache(path=""), question_index=QuestionIndex(threshold=0.8))
+    client.query(None, "how many orders in 2020", schema=SCHEMA)
+    match = client.query(None, "number of orders placed during 2020", schema=SCHEMA)
+    assert fake.calls == 1
+    assert match["query"] == "SELECT COUNT(*) FROM orders"
+    assert match["cacheMatch"]["question"] == "how many orders in 2020" and match["cacheMatch"]["score"] >= 0.8
+    #a different literal is a different question
+    client.query(None, "how many orders in 2021", schema=SCHEMA)
+    assert fake.calls == 2
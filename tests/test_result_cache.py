@@ -0,0 +1,152 @@
+import os
+import contextlib
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+from resultCache import ResultCache
+from sqlValidation import cacheable_sql, databases_named
+from ModelClient import ModelClient
+
+@pytest.mark.unit
+@pytest.mark.parametrize("sql", [
+    "SELECT NOW()",
+    "SELECT * FROM orders WHERE created > CURRENT_DATE",
+    "SELECT id FROM orders ORDER BY RAND()",
+    "SELECT UUID()",
+    "SELECT * FROM orders FOR UPDATE",
+    "UPDATE orders SET total = 0",
+    "SELECT 1; SELECT 2",
+    "not sql at all (",
+])
+def test_volatile_or_writing_sql_is_not_cacheable(sql):
+    assert cacheable_sql(sql) is None
+
+@pytest.mark.unit
+def test_cacheable_sql_ignores_spacing_and_case():
+    assert cacheable_sql("select  id\nfrom orders where total>1") == cacheable_sql("SELECT id FROM orders WHERE total > 1")
+
+@pytest.mark.unit
+def test_databases_named():
+    assert databases_named("UPDATE orders SET total = 0") == set()
+    assert databases_named("INSERT INTO other.orders SELECT * FROM orders") == {"other"}
+
+@pytest.mark.unit
+def test_hit_until_the_database_is_bumped():
+    cache = ResultCache(ttl=0, max_entries=10, max_rows=100, max_entry_rows=100)
+    key = cache.key("sales", "SELECT id FROM orders")
+    assert cache.get(key) is None
+    cache.put(key, [{"id": 1}])
+    assert cache.get(cache.key("sales", "select id from orders")) == [{"id": 1}]
+    #another database changing doesn't matter
+    cache.bump("hr")
+    assert cache.get(cache.key("sales", "SELECT id FROM orders")) == [{"id": 1}]
+    cache.bump("sales")
+    assert cache.get(cache.key("sales", "SELECT id FROM orders")) is None
+    assert cache.stats()["entries"] == 0
+
+@pytest.mark.unit
+def test_result_read_before_a_write_is_not_stored():
+    cache = ResultCache(ttl=0, max_entries=10, max_rows=100, max_entry_rows=100)
+    key = cache.key("sales", "SELECT id FROM orders")
+    cache.bump("sales") #a write finished while the read was running
+    cache.put(key, [{"id": 1}])
+    assert cache.get(cache.key("sales", "SELECT id FROM orders")) is None
+
+@pytest.mark.unit
+def test_bump_everything():
+    cache = ResultCache(ttl=0, max_entries=10, max_rows=100, max_entry_rows=100)
+    for database in ("sales", "hr"):
+        cache.put(cache.key(database, "SELECT 1"), [{"1": 1}])
+    cache.bump()
+    assert cache.get(cache.key("sales", "SELECT 1")) is None
+    assert cache.get(cache.key("hr", "SELECT 1")) is None
+
+@pytest.mark.unit
+def test_lru_eviction_by_entries_and_rows():
+    cache = ResultCache(ttl=0, max_entries=2, max_rows=5, max_entry_rows=4)
+    first, second, third = (cache.key("db", f"SELECT {i}") for i in range(3))
+    cache.put(first, [{}])
+    cache.put(second, [{}])
+    cache.get(first)
+    cache.put(third, [{}])
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    #too big for one entry, not stored at all
+    cache.put(second, [{}] * 5)
+    assert cache.get(second) is None
+    #over the entry and row budgets, the least recently used goes
+    cache.put(second, [{}] * 4)
+    assert cache.get(third) is None
+    assert cache.get(second) is not None and cache.get(first) is not None
+    assert cache.stats()["rows"] == 5
+
+@pytest.mark.unit
+def test_ttl_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("resultCache.time.time", lambda: now[0])
+    cache = ResultCache(ttl=60, max_entries=10, max_rows=100, max_entry_rows=100)
+    key = cache.key("db", "SELECT 1")
+    cache.put(key, [{"1": 1}])
+    now[0] += 59
+    assert cache.get(key) is not None
+    now[0] += 2
+    assert cache.get(key) is None
+
+class FakeConnection:
+    connection_id = 7
+
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            rowcount = 1
+            def execute(self, sql):
+                connection.executed.append(sql)
+                self.description = [("id",)] if sql.upper().startswith("SELECT") else None
+            def fetchmany(self, size):
+                return [(1,), (2,)][:size]
+            def close(self):
+                pass
+        return Cursor()
+
+    def commit(self):
+        pass
+
+@pytest.fixture
+def model_client(monkeypatch):
+    client = ModelClient(None, "test-model", result_cache=ResultCache(ttl=0, max_entries=10, max_rows=100, max_entry_rows=100))
+    connection = FakeConnection()
+    monkeypatch.setattr(client, "mysql_connection", lambda: contextlib.nullcontext(connection))
+    monkeypatch.setattr(client.schema_provider, "snapshot", lambda database: None)
+    client.connection = connection
+    return client
+
+@pytest.mark.unit
+def test_repeated_query_is_served_from_memory(model_client):
+    first = model_client.run_query("SELECT id FROM orders")
+    assert model_client.run_query("select id from orders") == first == [{"id": 1}, {"id": 2}]
+    assert len(model_client.connection.executed) == 1
+    assert model_client.result_cache.stats()["hits"] == 1
+
+@pytest.mark.unit
+def test_confirmed_write_invalidates_results(model_client):
+    model_client.run_query("SELECT id FROM orders")
+    assert model_client.run_query("DELETE FROM orders WHERE id = 1", confirmed=True) == [{"rowsAffected": 1}]
+    model_client.run_query("SELECT id FROM orders")
+    assert len(model_client.connection.executed) == 3
+
+@pytest.mark.unit
+def test_unconfirmed_write_keeps_results(model_client):
+    model_client.run_query("SELECT id FROM orders")
+    assert model_client.run_query("DELETE FROM orders")["type"] == "confirmation"
+    model_client.run_query("SELECT id FROM orders")
+    assert len(model_client.connection.executed) == 1
+
+@pytest.mark.unit
+def test_volatile_query_always_runs(model_client):
+    model_client.run_query("SELECT id FROM orders WHERE created > NOW()")
+    model_client.run_query("SELECT id FROM orders WHERE created > NOW()")
+    assert len(model_client.connection.executed) == 2
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import contextlib
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+import api
+import ModelClient as model_client_module
+from resultCache import ResultCache
+
+ROWS = [(i, f"value {i}") for i in range(2500)]
+
+#a mysql connection with one table, honours LIMIT / OFFSET and records what it ran
+class FakeConnection:
+    connection_id = 7
+
+    def __init__(self, rows=ROWS):
+        self.rows = rows
+        self.executed = []
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            description = [("id",), ("value",)]
+            def execute(self, sql):
+                connection.executed.append(sql)
+                match = re.search(r"LIMIT (\d+)(?: OFFSET (\d+))?$", sql)
+                start = int(match.group(2) or 0) if match else 0
+                end = start + int(match.group(1)) if match else None
+                self.remaining = list(connection.rows[start:end])
+            def fetchmany(self, size):
+                batch, self.remaining = self.remaining[:size], self.remaining[size:]
+                return batch
+            def fetchall(self):
+                return self.fetchmany(len(self.remaining))
+            def close(self):
+                pass
+        return Cursor()
+
+class FakeSnapshot:
+    def to_prompt_schema(self):
+        return {"big": {"id": "int", "value": "varchar(20)"}}
+
+@pytest.fixture
+def client(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(api.model_client, "mysql_connection", lambda: contextlib.nullcontext(connection))
+    monkeypatch.setattr(api.model_client.schema_provider, "snapshot", lambda database: FakeSnapshot())
+    monkeypatch.setattr(api.model_client, "result_cache", ResultCache())
+    with api.app.test_client() as test_client:
+        test_client.connection = connection
+        yield test_client
+
+def stream_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+@pytest.mark.unit
+def test_stream_sends_rows_in_batches(client):
+    response = client.post("/api/execute-query", json={"query": "SELECT id, value FROM big ORDER BY id", "stream": True, "batchSize": 1000})
+    assert response.mimetype == "application/x-ndjson"
+    lines = stream_lines(response)
+    assert lines[0] == {"type": "columns", "columns": ["id", "value"]}
+    assert [len(line["rows"]) for line in lines[1:-1]] == [1000, 1000, 500]
+    assert lines[1]["rows"][0] == {"id": 0, "value": "value 0"}
+    assert lines[-1] == {"type": "done", "rowCount": 2500, "truncated": False}
+    #mysql is asked for one row over the cap, never the whole table
+    assert client.connection.executed[-1].endswith(f"LIMIT {model_client_module.ResultConfig.max_rows + 1}")
+
+@pytest.mark.unit
+def test_stream_stops_at_the_row_cap(client, monkeypatch):
+    monkeypatch.setattr(model_client_module.ResultConfig, "max_rows", 1200)
+    lines = stream_lines(client.post("/api/execute-query", json={"query": "SELECT * FROM big", "stream": True, "batchSize": 500}))
+    assert sum(len(line["rows"]) for line in lines if line["type"] == "rows") == 1200
+    assert lines[-1] == {"type": "done", "rowCount": 1200, "truncated": True}
+
+@pytest.mark.unit
+def test_stream_writes_still_need_confirming(client):
+    response = client.post("/api/execute-query", json={"query": "DELETE FROM big", "stream": True})
+    assert response.get_json()["results"]["type"] == "confirmation"
+    assert client.connection.executed == []
+
+@pytest.mark.unit
+def test_pages_follow_the_token(client):
+    query = "SELECT id, value FROM big ORDER BY id"
+    first = client.post("/api/execute-query", json={"query": query, "pageSize": 1000}).get_json()
+    assert len(first["results"]) == 1000 and first["nextPageToken"]
+    second = client.post("/api/execute-query", json={"query": query, "pageSize": 1000, "pageToken": first["nextPageToken"]}).get_json()
+    assert second["results"][0]["id"] == 1000
+    last = client.post("/api/execute-query", json={"query": query, "pageSize": 1000, "pageToken": second["nextPageToken"]}).get_json()
+    assert len(last["results"]) == 500 and last["nextPageToken"] is None
+    assert client.connection.executed[-1].endswith("LIMIT 1001 OFFSET 2000")
+
+@pytest.mark.unit
+def test_plain_results_say_when_they_were_cut_off(client, monkeypatch):
+    monkeypatch.setattr(model_client_module.ResultConfig, "max_rows", 1200)
+    body = client.post("/api/execute-query", json={"query": "SELECT id, value FROM big"}).get_json()
+    assert len(body["results"]) == 1200 and body["truncated"] is True
+    body = client.post("/api/execute-query", json={"query": "SELECT id, value FROM big LIMIT 10"}).get_json()
+    assert body["truncated"] is False
+
+@pytest.mark.unit
+def test_query_with_its_own_limit_is_not_wrapped(client, monkeypatch):
+    monkeypatch.setattr(model_client_module.ResultConfig, "max_rows", 1200)
+    body = client.post("/api/execute-query", json={"query": "SELECT * FROM big ORDER BY id LIMIT 2000"}).get_json()
+    assert len(body["results"]) == 1200 and body["truncated"] is True
+    executed = client.connection.executed[-1]
+    assert "limited" not in executed and executed.endswith("ORDER BY id LIMIT 2000")
+
+@pytest.mark.unit
+def test_pages_of_a_query_with_its_own_limit(client):
+    query = "SELECT id, value FROM big ORDER BY id LIMIT 1500"
+    first = client.post("/api/execute-query", json={"query": query, "pageSize": 1000}).get_json()
+    second = client.post("/api/execute-query", json={"query": query, "pageSize": 1000, "pageToken": first["nextPageToken"]}).get_json()
+    assert [row["id"] for row in second["results"]] == list(range(1000, 1500))
+    assert second["nextPageToken"] is None
+
+@pytest.mark.unit
+def test_page_token_belongs_to_its_query(client):
+    first = client.post("/api/execute-query", json={"query": "SELECT id FROM big", "pageSize": 10}).get_json()
+    response = client.post("/api/execute-query", json={"query": "SELECT value FROM big", "pageSize": 10, "pageToken": first["nextPageToken"]})
+    assert response.status_code == 400
+    response = client.post("/api/execute-query", json={"query": "SELECT id FROM big", "pageToken": "not-a-token"})
+    assert response.status_code == 400
@@ -0,0 +1,38 @@
+import io
+import json
+import pytest
+import datasetStream
+from schemaExtract import extract_schema
+
+TRICKY_ROWS = [{"id": 1, "text": "plain"}] + [
+    {"id": i, "text": 'brackets ] } [ { and "quotes" \\ backslash é', "nested": {"a": [1, {"b": "]"}]}} for i in range(2, 50)
+]
+DATASET = [
+    {"type": "database", "name": "Shop"},
+    {"type": "table", "name": "notes", "data": TRICKY_ROWS},
+    {"type": "table", "name": "after", "data": [{"when": "2020-01-01", "score": 1.5}]}
+]
+
+@pytest.mark.unit
+def test_json_schema_streams_and_skips_rows(monkeypatch):
+    """
+    Only the first row of each table is decoded, the rest is skipped even when it contains brackets and quotes.
+    """
+    monkeypatch.setattr(datasetStream, "READ_SIZE", 7)
+    raw = io.BytesIO(json.dumps(DATASET).encode("utf-8"))
+    schema = extract_schema(raw, filename="shop.json")
+    assert schema == {"notes": {"id": "int", "text": "str"}, "after": {"when": "str", "score": "float"}}
+
+@pytest.mark.unit
+def test_jsonl_schema_from_each_line():
+    lines = "\n".join(json.dumps(record) for record in DATASET) + "\n"
+    schema = extract_schema(io.BytesIO(lines.encode("utf-8")), filename="shop.jsonl")
+    assert schema == {"notes": {"id": "int", "text": "str"}, "after": {"when": "str", "score": "float"}}
+
+@pytest.mark.unit
+def test_csv_schema_reads_a_bounded_sample(monkeypatch):
+    import schemaExtract
+    monkeypatch.setattr(schemaExtract, "CSV_SAMPLE_ROWS", 2)
+    csv_text = "id,name\n1,a\n2,b\nnot,a valid,row\n"
+    schema = extract_schema(io.StringIO(csv_text), filename="people.csv")
+    assert list(schema["uploaded_table"].keys()) == ["id", "name"]
@@ -0,0 +1,76 @@
+import contextlib
+import pytest
+import mysql.connector
+from schemaProvider import SchemaProvider
+
+COLUMNS = [
+    ("customers", "customer_id", "int", "NO", "PRI"),
+    ("customers", "name", "varchar(255)", "YES", ""),
+    ("orders", "order_id", "int", "NO", "PRI"),
+    ("orders", "customer_id", "int", "YES", "MUL")
+]
+KEYS = [
+    ("customers", "customer_id", "PRIMARY", None, None),
+    ("orders", "order_id", "PRIMARY", None, None),
+    ("orders", "customer_id", "fk_customer", "customers", "customer_id")
+]
+
+#answers the two INFORMATION_SCHEMA queries and counts how often the server was asked
+class FakeInformationSchema:
+    def __init__(self, columns=COLUMNS, down=False):
+        self.connects = 0
+        self.columns = columns
+        self.down = down
+
+    def connect(self):
+        self.connects += 1
+        server = self
+        if self.down:
+            raise mysql.connector.errors.InterfaceError("Can't connect to MySQL server")
+
+        class Cursor:
+            def execute(self, query, params):
+                self.rows = server.columns if "COLUMNS" in query else KEYS
+
+            def fetchall(self):
+                return self.rows
+
+            def close(self):
+                pass
+
+        class Conn:
+            def cursor(self):
+                return Cursor()
+        return contextlib.nullcontext(Conn())
+
+@pytest.mark.unit
+def test_snapshot_has_keys_and_is_cached():
+    server = FakeInformationSchema()
+    provider = SchemaProvider(connect=server.connect, ttl=0)
+    snapshot = provider.snapshot("Shop")
+    assert snapshot.to_prompt_schema() == {
+        "customers": {"customer_id": "int primary key", "name": "varchar(255)"},
+        "orders": {"order_id": "int primary key", "customer_id": "int references customers(customer_id)"}
+    }
+    assert provider.snapshot("Shop") is snapshot
+    assert server.connects == 1
+    provider.invalidate("Shop")
+    provider.snapshot("Shop")
+    assert server.connects == 2
+
+@pytest.mark.unit
+@pytest.mark.parametrize("server", [FakeInformationSchema(columns=[]), FakeInformationSchema(down=True)])
+def test_empty_or_unreachable_database_is_not_asked_every_time(server, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("schemaProvider.time.time", lambda: now[0])
+    provider = SchemaProvider(connect=server.connect, ttl=0, missing_ttl=30)
+    assert provider.snapshot("Shop") is None
+    assert provider.snapshot("Shop") is None
+    assert server.connects == 1
+    now[0] += 31
+    provider.snapshot("Shop")
+    assert server.connects == 2
+    #loading a dataset invalidates it, the next query asks straight away
+    provider.invalidate("Shop")
+    provider.snapshot("Shop")
+    assert server.connects == 3
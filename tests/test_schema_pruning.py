@@ -0,0 +1,54 @@
+import pytest
+from schemaPruning import SchemaIndex, tokenize, infer_links
+
+#a wide schema, a few tables that matter plus lots of filler the question has nothing to do with
+def wide_schema():
+    schema = {
+        "customers": {"customer_id": "int", "name": "str", "city": "str"},
+        "orders": {"order_id": "int", "customer_id": "int", "order_date": "str", "total": "float"},
+        "products": {"product_id": "int", "title": "str", "price": "float"},
+        "order_items": {"order_id": "int", "product_id": "int", "quantity": "int"}
+    }
+    for i in range(60):
+        schema[f"audit_log_{i}"] = {f"event_{j}": "str" for j in range(8)}
+    return schema
+
+@pytest.mark.unit
+def test_tokenize_splits_identifiers():
+    words = [term for term in tokenize("customerIds order_items") if not term.startswith("~")]
+    assert words == ["customer", "id", "order", "item"]
+
+@pytest.mark.unit
+def test_infer_links_from_id_columns():
+    links = infer_links(wide_schema())
+    assert links["orders"] == {"customers", "order_items"}
+    assert "products" in links["order_items"]
+
+@pytest.mark.unit
+def test_select_keeps_relevant_tables_and_join_neighbours():
+    index = SchemaIndex(wide_schema())
+    pruned = index.select("total spent by each customer", top_k=1, token_budget=300)
+    assert "customers" in pruned
+    #orders joins to customers so it comes along even though only the top table was asked for
+    assert "orders" in pruned
+    assert not any(table.startswith("audit_log") for table in pruned)
+
+@pytest.mark.unit
+def test_select_uses_sample_values():
+    samples = {"customers": {"city": ["Lisbon", "Oslo"]}}
+    index = SchemaIndex(wide_schema(), samples=samples)
+    pruned = index.select("how many people live in Oslo", top_k=1, token_budget=300)
+    assert "customers" in pruned
+
+@pytest.mark.unit
+def test_select_respects_budget_but_keeps_best_table():
+    index = SchemaIndex(wide_schema())
+    pruned = index.select("products and their price", top_k=5, token_budget=1)
+    assert list(pruned) == ["products"]
+
+@pytest.mark.unit
+def test_small_or_unmatched_schema_is_left_alone():
+    schema = wide_schema()
+    index = SchemaIndex(schema)
+    assert index.select("anything", token_budget=100000) is schema
+    assert index.select("zzz qqq", token_budget=300) is schema
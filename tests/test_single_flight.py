@@ -0,0 +1,148 @@
+import time
+import asyncio
+import threading
+import pytest
+from singleFlight import SingleFlight, AsyncSingleFlight
+from responseCache import ResponseCache
+
+@pytest.mark.unit
+def test_threads_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"type": "sql", "query": "SELECT 1"}
+
+    results = []
+    def worker():
+        results.append(flight.do("key", slow))
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(result == {"type": "sql", "query": "SELECT 1"} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False] + [True] * 9
+    assert flight.shared == 9 and flight.calls == {}
+
+@pytest.mark.unit
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("model down")
+
+    errors = []
+    def worker():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(str(e))
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == ["model down"] * 3
+
+@pytest.mark.unit
+def test_async_calls_share_one_task_and_survive_a_cancelled_caller():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", slow))
+        await asyncio.sleep(0)
+        others = [asyncio.ensure_future(flight.do("key", slow)) for _ in range(5)]
+        #the caller that started the call going away doesn't stop it for the rest
+        first.cancel()
+        return await asyncio.gather(*others)
+
+    results = asyncio.run(run())
+    assert results == [("answer", True)] * 5
+    assert len(calls) == 1
+
+@pytest.mark.unit
+def test_leases_are_shared_through_the_cache_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = ResponseCache(path=path), ResponseCache(path=path)
+    assert first.acquire_lease("key", 30)
+    assert not second.acquire_lease("key", 30)
+    first.release_lease("key")
+    assert second.acquire_lease("key", 30)
+    #an expired lease can be taken over
+    second.release_lease("key")
+    assert first.acquire_lease("other", -1)
+    assert second.acquire_lease("other", 30)
+
+@pytest.mark.unit
+def test_model_client_waits_for_another_worker(tmp_path, monkeypatch):
+    from ModelClient import ModelClient
+    from config import CoalesceConfig
+    from test_response_cache import FakeOpenAI, SCHEMA
+    monkeypatch.setattr(CoalesceConfig, "cross_worker", True)
+    monkeypatch.setattr(CoalesceConfig, "poll_interval", 0.01)
+    path = str(tmp_path / "cache.sqlite3")
+    fake = FakeOpenAI()
+    client = ModelClient(fake, "model", response_cache=ResponseCache(path=path))
+    other_worker = ResponseCache(path=path)
+    _, prompt = client.prepare_query(None, "how many orders", schema=SCHEMA)
+    assert other_worker.acquire_lease(prompt["key"], 30)
+    #the other worker answers a little later, this one picks the answer up from the shared file
+    threading.Timer(0.1, other_worker.put, (prompt["key"], {"type": "sql", "query": "SELECT 42"})).start()
+    assert client.query(None, "how many orders", schema=SCHEMA) == {"type": "sql", "query": "SELECT 42"}
+    assert fake.calls == 0
+
+@pytest.mark.unit
+def test_waiting_worker_takes_over_when_the_other_gives_up(tmp_path, monkeypatch):
+    from ModelClient import ModelClient
+    from config import CoalesceConfig
+    from test_response_cache import FakeOpenAI, SCHEMA
+    monkeypatch.setattr(CoalesceConfig, "cross_worker", True)
+    monkeypatch.setattr(CoalesceConfig, "poll_interval", 0.01)
+    path = str(tmp_path / "cache.sqlite3")
+    fake = FakeOpenAI()
+    client = ModelClient(fake, "model", response_cache=ResponseCache(path=path))
+    other_worker = ResponseCache(path=path)
+    _, prompt = client.prepare_query(None, "how many orders", schema=SCHEMA)
+    assert other_worker.acquire_lease(prompt["key"], 30)
+    #the other worker's model call fails, it lets the lease go without storing anything
+    threading.Timer(0.1, other_worker.release_lease, (prompt["key"],)).start()
+    start = time.perf_counter()
+    assert client.query(None, "how many orders", schema=SCHEMA)["type"] == "sql"
+    assert time.perf_counter() - start < 2
+    assert fake.calls == 1
+
+@pytest.mark.unit
+def test_async_waiting_worker_takes_over_when_the_other_gives_up(tmp_path, monkeypatch):
+    from asyncModelClient import AsyncModelClient
+    from config import CoalesceConfig
+    monkeypatch.setattr(CoalesceConfig, "cross_worker", True)
+    monkeypatch.setattr(CoalesceConfig, "poll_interval", 0.01)
+    path = str(tmp_path / "cache.sqlite3")
+    client = AsyncModelClient(None, "model", response_cache=ResponseCache(path=path))
+    other_worker = ResponseCache(path=path)
+    assert other_worker.acquire_lease("key", 30)
+    threading.Timer(0.1, other_worker.release_lease, ("key",)).start()
+    start = time.perf_counter()
+    assert asyncio.run(client.other_worker_answer_async("key")) is None
+    assert time.perf_counter() - start < 2
+    #this worker holds the lease now
+    assert not other_worker.acquire_lease("key", 30)
@@ -0,0 +1,46 @@
+import pytest
+from sqlTemplates import TemplateCache, build_sql_template, extract_literals, question_template
+
+@pytest.mark.unit
+def test_question_template_slots_literals():
+    assert question_template("How many orders in 2020 from Oslo?") == "how many orders in {num} from {text}"
+    assert [value for value, _, _ in extract_literals("orders over 9.5 for 'Acme Ltd'")] == ["9.5", "Acme Ltd"]
+
+@pytest.mark.unit
+def test_template_fills_every_occurrence():
+    cache = TemplateCache()
+    sql = "SELECT COUNT(*) FROM orders WHERE order_date BETWEEN '2020-01-01' AND '2020-12-31' AND city = 'Oslo'"
+    assert cache.add("scope", "how many orders in 2020 from Oslo", sql)
+    filled, source = cache.lookup("scope", "How many orders in 2023 from Bergen?")
+    assert filled == "SELECT COUNT(*) FROM orders WHERE order_date BETWEEN '2023-01-01' AND '2023-12-31' AND city = 'Bergen'"
+    assert source == "how many orders in 2020 from Oslo"
+    assert cache.lookup("other scope", "how many orders in 2023 from Bergen") is None
+
+@pytest.mark.unit
+def test_text_only_replaced_inside_strings_and_escaped():
+    cache = TemplateCache()
+    assert cache.add("s", "total salary in the 'Sales' department", "SELECT SUM(salary) FROM sales WHERE dept = 'Sales'")
+    filled, _ = cache.lookup("s", 'total salary in the "R&D\'s" department')
+    assert filled == "SELECT SUM(salary) FROM sales WHERE dept = 'R&D''s'"
+
+@pytest.mark.unit
+def test_untemplatable_answers():
+    #no literals, a literal the SQL doesn't use, and the same value twice
+    assert build_sql_template("how many orders", "SELECT COUNT(*) FROM orders") is None
+    assert build_sql_template("orders in 2020", "SELECT * FROM orders") is None
+    assert build_sql_template("orders between 5 and 5", "SELECT * FROM orders WHERE qty BETWEEN 5 AND 5") is None
+    #numbers inside names don't count
+    assert build_sql_template("top 5 rows", "SELECT col5 FROM t") is None
+
+@pytest.mark.unit
+def test_model_client_fills_templates():
+    from ModelClient import ModelClient
+    from responseCache import ResponseCache
+    from test_response_cache import FakeOpenAI, SCHEMA
+    fake = FakeOpenAI("SELECT COUNT(*) FROM orders WHERE YEAR(order_date) = 2020")
+    client = ModelClient(fake, "model", response_cache=ResponseCache(path=""), template_cache=TemplateCache())
+    client.query(None, "how many orders in 2020", schema=SCHEMA)
+    result = client.query(None, "how many orders in 2022", schema=SCHEMA)
+    assert fake.calls == 1
+    assert result["query"] == "SELECT COUNT(*) FROM orders WHERE YEAR(order_date) = 2022"
+    assert result["templateMatch"] == {"question": "how many orders in 2020"}
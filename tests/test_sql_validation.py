@@ -0,0 +1,93 @@
+import pytest
+from sqlValidation import classify_sql, validate_sql, repair_sql, SqlParseError, READ, WRITE, DDL
+from ModelClient import ModelClient, InvalidQueryError
+
+SCHEMA = {
+    "orders": {"order_id": "int", "customer_id": "int", "total": "float", "created": "date"},
+    "customers": {"customer_id": "int", "name": "str"},
+}
+
+@pytest.mark.unit
+def test_classify_from_the_ast():
+    #column names that contain keywords are reads
+    assert classify_sql("SELECT updated_at, deleted FROM orders") == READ
+    assert classify_sql("WITH t AS (SELECT 1) SELECT * FROM t") == READ
+    assert classify_sql("SHOW TABLES") == READ
+    assert classify_sql("UPDATE orders SET total = 1") == WRITE
+    assert classify_sql("REPLACE INTO orders VALUES (1, 1, 1, NULL)") == WRITE
+    assert classify_sql("SELECT * INTO copy FROM orders") == WRITE
+    assert classify_sql("DROP TABLE orders") == DDL
+    assert classify_sql("RENAME TABLE orders TO old_orders") == DDL
+    #several statements are as dangerous as the worst one
+    assert classify_sql("SELECT 1; DELETE FROM orders") == WRITE
+    with pytest.raises(SqlParseError):
+        classify_sql("Could you say which year you mean?")
+
+@pytest.mark.unit
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(*) FROM orders -- how many",
+    "SELECT Total FROM Orders",
+    "SELECT o.total, c.name FROM orders o JOIN customers AS c ON o.customer_id = c.customer_id WHERE c.name = 'x.y'",
+    "SELECT total AS t FROM orders ORDER BY t",
+    "SELECT EXTRACT(YEAR FROM created), COUNT(*) FROM orders GROUP BY 1",
+    "WITH x AS (SELECT customer_id, SUM(total) s FROM orders GROUP BY 1) SELECT name, s FROM x JOIN customers USING (customer_id)",
+    "SELECT name FROM customers c WHERE EXISTS (SELECT 1 FROM orders o WHERE o.customer_id = c.customer_id AND total > 3)",
+    "SELECT x.s FROM (SELECT SUM(total) AS s FROM orders) x",
+    "UPDATE orders o JOIN customers c ON o.customer_id = c.customer_id SET o.total = 1 WHERE c.name = 'a'",
+    "INSERT INTO orders (order_id, total) VALUES (1, 2)",
+    #multi table delete, the tables deleted from are named by alias
+    "DELETE o FROM orders o JOIN customers c ON o.customer_id = c.customer_id WHERE c.name = 'a'",
+    "DELETE orders FROM orders JOIN customers ON orders.customer_id = customers.customer_id",
+    #tables of another database aren't checked against this one's schema
+    "SELECT table_name FROM information_schema.tables WHERE table_schema = 'shop'",
+    "SELECT t.label, o.total FROM otherdb.t AS t JOIN orders o ON o.order_id = t.id",
+    "INSERT INTO otherdb.archive (a, b) SELECT order_id, total FROM orders",
+    "UPDATE otherdb.t SET anything = 1",
+])
+def test_valid_sql_passes(sql):
+    assert validate_sql(sql, SCHEMA) == []
+
+@pytest.mark.unit
+@pytest.mark.parametrize("sql, problems", [
+    ("Could you say which year?", ["syntax error: Invalid expression / Unexpected token"]),
+    ("SELECT updated_at FROM orders", ["unknown column updated_at"]),
+    ("SELECT o.price FROM orders o JOIN products p ON 1", ["unknown table products", "unknown column o.price"]),
+    ("WITH t AS (SELECT totl FROM orders) SELECT * FROM t", ["unknown column totl"]),
+    ("SELECT x.q FROM (SELECT SUM(total) AS s FROM orders) x", ["unknown column x.q"]),
+    ("DELETE FROM orders WHERE customer_id IN (SELECT customer_id FROM customers WHERE nam = 'x')", ["unknown column nam"]),
+    ("INSERT INTO orders (order_id, amount) VALUES (1, 2)", ["unknown column amount"]),
+    ("DELETE x FROM orders o JOIN customers c ON o.customer_id = c.customer_id", ["unknown table x"]),
+    ("DELETE o FROM orders o JOIN customers c ON o.customer_id = c.customer_id WHERE o.totl > 1", ["unknown column o.totl"]),
+    ("SELECT o.totl FROM otherdb.t AS t JOIN orders o ON o.order_id = t.id", ["unknown column o.totl"]),
+])
+def test_invalid_sql_is_caught(sql, problems):
+    assert validate_sql(sql, SCHEMA) == problems
+
+@pytest.mark.unit
+def test_repair_near_misses():
+    assert repair_sql("SELECT total FROM orders", SCHEMA) == "SELECT total FROM orders"
+    assert repair_sql("SELECT totl FROM order", SCHEMA) == "SELECT total FROM orders"
+    assert repair_sql("SELECT c.nam FROM customer c", SCHEMA) == "SELECT c.name FROM customers AS c"
+    assert repair_sql("SELECT shipping FROM orders", SCHEMA) is None
+    assert repair_sql("DELETE o FROM orders o WHERE o.totl > 1", SCHEMA) == "DELETE o FROM orders AS o WHERE o.total > 1"
+
+class FakeSnapshot:
+    def to_prompt_schema(self):
+        return SCHEMA
+
+class FakeSchemaProvider:
+    def snapshot(self, database):
+        return FakeSnapshot()
+
+@pytest.mark.unit
+def test_run_query_rejects_bad_sql_before_mysql(monkeypatch):
+    client = ModelClient(None, "model", schema_provider=FakeSchemaProvider())
+    connections = []
+    monkeypatch.setattr(client, "mysql_connection", lambda: connections.append(1))
+    #a read with a keyword in a column name isn't held for confirmation, a write is
+    assert client.run_query("DELETE FROM orders")["type"] == "confirmation"
+    with pytest.raises(InvalidQueryError):
+        client.run_query("SELECT updated_at FROM orders")
+    with pytest.raises(InvalidQueryError):
+        client.run_query("Which year do you mean?")
+    assert connections == []